@@ -0,0 +1,84 @@
+"""
+Runs the cluster mode against the local fake gateway: a ClusterSupervisor launches the cluster processes, every
+cluster connects its shard range and reports its guild count. One cluster is then killed to check that the
+supervisor restarts it and that the aggregated guild count recovers.
+
+    python -m benchmarks.bench_cluster --clusters 2 --shards 4 --guilds 1000
+"""
+import argparse
+import asyncio
+import os
+import signal
+import tempfile
+import time
+
+import discord
+from discord.ext.commands import AutoShardedBot
+
+from benchmarks.fake_gateway import FakeGateway, use_fake_gateway
+from discord_handler.cluster import ClusterMixin, ClusterSupervisor
+
+
+class BenchShardedBot(ClusterMixin, AutoShardedBot):
+    pass
+
+
+def run_bench_cluster(cluster_id: int, shard_ids: list, shard_count: int, socket_path: str, port: int):
+    use_fake_gateway(port)
+    bot = BenchShardedBot(command_prefix='!', help_command=None, intents=discord.Intents(messages=True, guilds=True),
+                          shard_ids=shard_ids, shard_count=shard_count, cluster_id=cluster_id,
+                          cluster_socket=socket_path)
+    bot.run('token')
+
+
+async def wait_for(condition, timeout: float) -> float:
+    start = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError()
+        await asyncio.sleep(0.05)
+    return time.perf_counter() - start
+
+
+async def bench(args):
+    gateway = FakeGateway(args.guilds, args.shards)
+    port = await gateway.start()
+    supervisor = ClusterSupervisor(run_bench_cluster, args.clusters, args.shards,
+                                   os.path.join(tempfile.mkdtemp(), 'cluster.sock'), args=(port,),
+                                   restart_delay=args.restart_delay)
+    task = asyncio.ensure_future(supervisor.run())
+    try:
+        elapsed = await wait_for(lambda: supervisor.total_guilds == args.guilds, args.timeout)
+        print(f"clusters: {args.clusters}, shards: {args.shards}, guilds: {args.guilds}")
+        print(f"all clusters ready after {elapsed:.2f}s, identifies: {gateway.identifies}, "
+              f"counts: {supervisor.counts}")
+
+        victim = supervisor.clusters[-1]
+        os.kill(victim.process.pid, signal.SIGKILL)
+        killed = time.perf_counter()
+        reports = supervisor.reports
+        await wait_for(lambda: victim.restarts == 1, args.timeout)
+        await wait_for(lambda: supervisor.reports > reports and supervisor.total_guilds == args.guilds,
+                       args.timeout)
+        print(f"cluster {victim.cluster_id} killed, restarted and reported again after "
+              f"{time.perf_counter() - killed:.2f}s (restart delay {args.restart_delay}s), "
+              f"total guilds: {supervisor.total_guilds}")
+    finally:
+        await supervisor.close()
+        task.cancel()
+        await gateway.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clusters", type=int, default=2)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--restart_delay", type=float, default=1)
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Per command db latency with and without persistent connections. A command does what cog_before_invoke and a
+typical command do on the db (guild and user upsert, a prefix lookup) through run_db. Without pooling
+(CONN_MAX_AGE 0) every job connects again, with pooling each db thread keeps its connection. --connect_latency
+adds a delay to every new connection, standing in for the TCP and auth handshake of postgres.
+
+    python -m benchmarks.bench_db_pool --commands 2000 --concurrency 8 --connect_latency 0.005
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks.env import setup_django
+
+setup_django()
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.backends.signals import connection_created
+
+from db.models import DBGuild
+from discord_handler import db_async
+from discord_handler.db_async import pool_stats
+from discord_handler.helper import get_guild, get_user
+from benchmarks.fakes import FakeGuild, FakeMember
+
+connect_latency = 0.0
+
+
+def slow_connect(sender, connection, **kwargs):
+    time.sleep(connect_latency)
+
+
+connection_created.connect(slow_connect)
+
+
+def command(guild: FakeGuild, member: FakeMember):
+    get_user(member)
+    get_guild(guild)
+    return DBGuild.objects.filter(g_id=guild.id).values_list('prefix', flat=True).first()
+
+
+async def run(args, conn_max_age) -> list:
+    db_async.shutdown()
+    connections[DEFAULT_DB_ALIAS].settings_dict['CONN_MAX_AGE'] = conn_max_age
+    guilds = [FakeGuild(i) for i in range(1, 51)]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one(nr: int):
+        guild = guilds[nr % len(guilds)]
+        async with semaphore:
+            start = time.perf_counter()
+            await db_async.run_db(command, guild, FakeMember(nr % 200, guild))
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[one(i) for i in range(args.commands)])
+    return latencies
+
+
+def report(name: str, latencies: list, elapsed: float):
+    latencies = sorted(i * 1000 for i in latencies)
+    print(f"{name:<16} p50 {statistics.median(latencies):6.2f}ms  p99 {latencies[int(len(latencies) * 0.99) - 1]:6.2f}ms"
+          f"  {len(latencies) / elapsed:7.0f} commands/s  {pool_stats.as_dict()}")
+
+
+def main():
+    global connect_latency
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--commands", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--connect_latency", type=float, default=0.005)
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    # warm up the rows, so both runs do the same (cached) upserts
+    loop.run_until_complete(run(args, None))
+    connect_latency = args.connect_latency
+
+    for name, conn_max_age in [("without pooling", 0), ("with pooling", 600)]:
+        for key in pool_stats.as_dict().keys():
+            setattr(pool_stats, key, 0)
+        start = time.perf_counter()
+        latencies = loop.run_until_complete(run(args, conn_max_age))
+        report(name, latencies, time.perf_counter() - start)
+    db_async.shutdown()
+
+
+if __name__ == "__main__":
+    main()
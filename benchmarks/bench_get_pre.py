@@ -0,0 +1,71 @@
+"""
+Messages per second through get_pre with and without the prefix cache.
+
+    python -m benchmarks.bench_get_pre --guilds 1000 --messages 20000
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.env import setup_django
+
+setup_django()
+
+from db.models import DBGuild
+from discord_handler.helper import get_pre
+from discord_handler.prefix_cache import prefix_cache
+from benchmarks.fakes import FakeGuild, FakeMember, FakeMessage
+
+
+async def uncached_get_pre(_, message):
+    # get_pre as it was before the cache: one query per message
+    if message.guild is None:
+        return ";"
+    try:
+        g = DBGuild.objects.get(g_id=message.guild.id)
+    except DBGuild.DoesNotExist:
+        g = DBGuild(g_id=message.guild.id, name=message.guild.name)
+        g.save()
+    return g.prefix
+
+
+def make_messages(guilds, n, command_ratio):
+    messages = []
+    for _ in range(n):
+        g = random.choice(guilds)
+        content = "!help" if random.random() < command_ratio else "just chatting"
+        messages.append(FakeMessage(content, FakeMember(random.randint(1, 10 ** 6), g), g))
+    return messages
+
+
+async def run(fun, messages, fast_path=False):
+    start = time.perf_counter()
+    for m in messages:
+        if fast_path and not prefix_cache.may_be_command(m):
+            continue
+        await fun(None, m)
+    return len(messages) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--command_ratio", type=float, default=0.05)
+    args = parser.parse_args()
+
+    guilds = [FakeGuild(i) for i in range(1, args.guilds + 1)]
+    DBGuild.objects.bulk_create([DBGuild(g_id=g.id, name=g.name) for g in guilds])
+    messages = make_messages(guilds, args.messages, args.command_ratio)
+
+    loop = asyncio.get_event_loop()
+    print(f"uncached:             {loop.run_until_complete(run(uncached_get_pre, messages)):12.0f} msg/s")
+    prefix_cache.load()
+    print(f"cached:               {loop.run_until_complete(run(get_pre, messages)):12.0f} msg/s")
+    print(f"cached + fast path:   {loop.run_until_complete(run(get_pre, messages, True)):12.0f} msg/s")
+    print(f"hits {prefix_cache.hits}, misses {prefix_cache.misses}, dropped {prefix_cache.dropped}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Event loop lag while the db is slow. A ticker coroutine measures how late the loop wakes it up while
+get_guild runs with simulated query latency, once blocking on the loop and once through run_db.
+
+    python -m benchmarks.bench_loop_lag --latency 0.05 --calls 40
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks.env import setup_django
+
+setup_django()
+
+from discord_handler import db_async
+from discord_handler.helper import get_guild
+from benchmarks.fakes import FakeGuild
+
+TICK = 0.005
+
+
+async def ticker(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+def slow(fun, latency):
+    def wrapped(*args, **kwargs):
+        time.sleep(latency)
+        return fun(*args, **kwargs)
+
+    return wrapped
+
+
+async def measure(calls, latency, use_pool):
+    lags = []
+    stop = asyncio.Event()
+    tick = asyncio.ensure_future(ticker(lags, stop))
+    guilds = [FakeGuild(i) for i in range(calls)]
+    start = time.perf_counter()
+    if use_pool:
+        await asyncio.gather(*[db_async.run_db(slow(get_guild, latency), g) for g in guilds])
+    else:
+        for g in guilds:
+            slow(get_guild, latency)(g)
+            await asyncio.sleep(0)
+    total = time.perf_counter() - start
+    stop.set()
+    await tick
+    return total, lags
+
+
+def report(name, total, lags):
+    lags = sorted(lags) or [0.0]
+    print(f"{name:10} total {total * 1000:8.1f} ms | loop lag p50 {statistics.median(lags) * 1000:7.2f} ms "
+          f"p99 {lags[int(len(lags) * 0.99) - 1 if len(lags) > 1 else 0] * 1000:7.2f} ms max {lags[-1] * 1000:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated latency per db call in seconds")
+    parser.add_argument("--calls", type=int, default=40)
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    report("blocking", *loop.run_until_complete(measure(args.calls, args.latency, False)))
+    report("run_db", *loop.run_until_complete(measure(args.calls, args.latency, True)))
+    db_async.shutdown()
+
+
+if __name__ == "__main__":
+    main()
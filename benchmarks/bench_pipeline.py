@@ -0,0 +1,147 @@
+"""
+Cost of a command through the pipeline, stage by stage: get_pre -> cog_check -> cog_before_invoke -> command
+-> send_table. Runs with fake discord objects on sqlite (or the db of --db_path), once with warm caches and
+once with the process caches cleared before every command. Reports latency, db queries and peak allocations
+per stage and compares them against a baseline file.
+
+    python -m benchmarks.bench_pipeline --commands 2000
+    python -m benchmarks.bench_pipeline --update_baseline
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tracemalloc
+
+from benchmarks.env import setup_django
+
+setup_django()
+
+from discord.ext.commands import command, Context
+
+from db.models import CommandStats
+from discord_handler.base.cog_interface import ICog
+from discord_handler.command_stats import command_stats
+from discord_handler.db_async import run_db
+from discord_handler.helper import get_pre, send_table
+from discord_handler.permissions import AuthorState, permissions
+from discord_handler.prefix_cache import prefix_cache
+from discord_handler.upsert import snapshots
+from benchmarks.fakes import FakeGuild, FakeMember, FakeMessage, FakeContext
+from benchmarks.harness import QueryCounter, StageRecorder, report, load_baseline, write_baseline, compare
+
+BASELINE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'baseline_pipeline.json')
+
+
+class Bench(ICog):
+    """
+    A typical read command: looks up the last commands of the author and prints them as a table.
+    """
+
+    def __init__(self):
+        super().__init__(None, AuthorState.User)
+
+    def last_commands(self, u_id: int, nr_of_commands: int):
+        return list(CommandStats.objects.filter(user_id=u_id).order_by('-timestamp')
+                    .values_list('command_id', 'timestamp')[:nr_of_commands])
+
+    async def render(self, ctx: Context, nr_of_commands: int = 10) -> str:
+        invocation = await self.get_invocation(ctx)
+        rows = await run_db(self.last_commands, invocation.u.id, nr_of_commands)
+        text = f"Last commands of {ctx.author.display_name}\n"
+        text += "\n".join(f"{name:<20} {timestamp.strftime('%Y-%m-%d %H:%M')}" for name, timestamp in rows)
+        return "```" + text + "```"
+
+    @command(name='last', help='Shows your last commands')
+    async def last(self, ctx: Context, nr_of_commands: int = 10):
+        await send_table(ctx.send, await self.render(ctx, nr_of_commands))
+
+
+def make_messages(guilds: int, users: int, commands: int):
+    guild_list = [FakeGuild(i) for i in range(1, guilds + 1)]
+    members = [FakeMember(10 ** 6 + i, guild_list[i % guilds]) for i in range(users)]
+    random.seed(1)
+    return members, [FakeMessage("!last", random.choice(members), None) for _ in range(commands)]
+
+
+def clear_caches(message: FakeMessage):
+    prefix_cache.invalidate(message.author.guild.id)
+    snapshots.clear()
+    permissions.invalidate_guild(message.author.guild.id)
+
+
+async def pipeline(cog: Bench, recorder: StageRecorder, message: FakeMessage):
+    message.guild = message.author.guild
+    with recorder.stage('get_pre'):
+        prefix = await get_pre(None, message)
+    ctx = FakeContext(message, command=cog.last, cog=cog, prefix=prefix)
+    with recorder.stage('cog_check'):
+        assert await cog.cog_check(ctx)
+    with recorder.stage('cog_before_invoke'):
+        await cog.cog_before_invoke(ctx)
+    with recorder.stage('command'):
+        text = await cog.render(ctx)
+    with recorder.stage('send_table'):
+        await send_table(ctx.send, text)
+
+
+async def run(cog: Bench, messages, cold: bool, queries: QueryCounter, allocations: int) -> dict:
+    recorder = StageRecorder(queries)
+    for message in messages:
+        if cold:
+            clear_caches(message)
+        await pipeline(cog, recorder, message)
+
+    tracemalloc.start()
+    for message in messages[:allocations]:
+        if cold:
+            clear_caches(message)
+        await pipeline(cog, recorder, message)
+    tracemalloc.stop()
+    return recorder.results()
+
+
+async def main(args) -> dict:
+    queries = QueryCounter()
+    queries.install()
+    # the write behind buffer is flushed at the end, so its writes don't land in a random stage
+    command_stats.max_size = command_stats.interval = 10 ** 9
+
+    cog = Bench()
+    members, messages = make_messages(args.guilds, args.users, args.commands)
+    # first touch of every guild and user, creates the rows
+    await run(cog, [FakeMessage("!last", i, None) for i in members], False, queries, 0)
+    await command_stats.flush()
+
+    results = {}
+    for scenario, cold in [('warm', False), ('cold', True)]:
+        results[scenario] = await run(cog, messages, cold, queries, args.allocations)
+        report(f"{scenario} ({len(messages)} commands)", results[scenario])
+    await command_stats.drain()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--commands", type=int, default=2000)
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--allocations", type=int, default=200, help="commands traced with tracemalloc")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update_baseline", action='store_true')
+    parser.add_argument("--latency_tolerance", type=float, default=2.0)
+    parser.add_argument("--alloc_tolerance", type=float, default=1.25)
+    args = parser.parse_args()
+
+    results = asyncio.get_event_loop().run_until_complete(main(args))
+    if args.update_baseline:
+        write_baseline(args.baseline, results)
+        print(f"Wrote {args.baseline}")
+    elif os.path.exists(args.baseline):
+        regressions = compare(results, load_baseline(args.baseline), args.latency_tolerance, args.alloc_tolerance)
+        for i in regressions:
+            print(f"REGRESSION {i}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline")
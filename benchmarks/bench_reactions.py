@@ -0,0 +1,119 @@
+"""
+Time to interactive of a choose_option prompt against a local fake HTTP endpoint. Every reaction is a PUT to
+a local aiohttp server that answers after --latency seconds and, like discord, handles one request of the
+reaction route at a time. The prompt is interactive once the router accepts an answer for it.
+
+    python -m benchmarks.bench_reactions --options 10 --latency 0.05
+"""
+import argparse
+import asyncio
+import time
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.env import setup_django
+
+setup_django()
+
+from discord_handler.helper import choose_option, emojiList
+from discord_handler.interactions import get_router
+
+
+class FakeBot:
+    def add_listener(self, fun, name):
+        pass
+
+
+class FakeMessage:
+    def __init__(self, session: aiohttp.ClientSession, url: str):
+        self.id = 1
+        self._session = session
+        self._url = url
+
+    async def add_reaction(self, emoji):
+        async with self._session.put(f"{self._url}/reactions/{emoji}") as resp:
+            await resp.read()
+
+    async def delete(self):
+        pass
+
+
+class FakeCtx:
+    def __init__(self, message: FakeMessage):
+        self.bot = FakeBot()
+        self.author = None
+        self.channel = None
+        self._message = message
+
+    async def send(self, *args, **kwargs):
+        return self._message
+
+
+async def fake_discord(latency: float) -> web.AppRunner:
+    bucket = asyncio.Lock()
+
+    async def reaction(request):
+        async with bucket:
+            await asyncio.sleep(latency)
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.router.add_put('/reactions/{emoji}', reaction)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    return runner
+
+
+async def sequential(ctx: FakeCtx, options):
+    # choose_option before the reaction seeding: every reaction is awaited before the prompt listens
+    msg = await ctx.send("")
+    for i in options:
+        await msg.add_reaction(i)
+    await asyncio.sleep(0)
+
+
+async def time_to_interactive(ctx: FakeCtx, options, old: bool) -> float:
+    router = get_router(ctx.bot)
+    start = time.perf_counter()
+    if old:
+        await sequential(ctx, options)
+        return time.perf_counter() - start
+
+    task = asyncio.ensure_future(choose_option(ctx, "", options))
+    while len(router) == 0:
+        await asyncio.sleep(0.001)
+    tti = time.perf_counter() - start
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return tti
+
+
+async def run(n_options, latency, repeats):
+    runner = await fake_discord(latency)
+    port = runner.addresses[0][1]
+    async with aiohttp.ClientSession() as session:
+        ctx = FakeCtx(FakeMessage(session, f"http://127.0.0.1:{port}"))
+        options = [f"option {i}" for i in range(n_options)]
+        for old, name in [(True, "sequential"), (False, "seeded")]:
+            times = [await time_to_interactive(ctx, emojiList[:n_options] if old else options, old)
+                     for _ in range(repeats)]
+            print(f"{name:10} time to interactive {sum(times) / len(times) * 1000:8.1f} ms")
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--options", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(run(args.options, args.latency, args.repeats))
+
+
+if __name__ == "__main__":
+    main()
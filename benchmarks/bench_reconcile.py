@@ -0,0 +1,91 @@
+"""
+Time to get guilds, channels, roles and members of the gateway cache into the db after a restart. The lazy
+path calls the get_* helpers once per object through run_db, the way the first commands after a restart did,
+the bulk path runs the reconciler. Both run once against an empty db (cold start) and once more with a
+share of the names changed (restart with drift).
+
+    python -m benchmarks.bench_reconcile --guilds 50 --members 200
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.env import setup_django
+
+setup_django()
+
+from django.db import connection
+
+from db.models import DBGuild
+from discord_handler.db_async import run_db
+from discord_handler.helper import get_guild, get_channel, get_role, get_user
+from discord_handler.reconcile import Reconciler
+from discord_handler.upsert import snapshots
+from benchmarks.fakes import FakeGuild, FakeChannel, FakeRole, FakeMember
+
+
+def make_guilds(args, offset: int):
+    guilds = []
+    for g in range(1, args.guilds + 1):
+        guild = FakeGuild(offset + g)
+        base = guild.id * 10000
+        guild.channels = [FakeChannel(base + i, guild) for i in range(args.channels)]
+        guild.roles = [FakeRole(base + 1000 + i, guild) for i in range(args.roles)]
+        guild.members = [FakeMember(base + 2000 + i, guild) for i in range(args.members)]
+        guilds.append(guild)
+    return guilds
+
+
+def drift(guilds, every: int):
+    for guild in guilds:
+        for objects in [guild.channels, guild.roles]:
+            for i in objects[::every]:
+                i.name += " renamed"
+        for i in guild.members[::every]:
+            i.display_name += " renamed"
+
+
+async def lazy(guilds):
+    for guild in guilds:
+        await run_db(get_guild, guild)
+        for i in guild.channels:
+            await run_db(get_channel, i)
+        for i in guild.roles:
+            await run_db(get_role, i)
+        for i in guild.members:
+            await run_db(get_user, i)
+
+
+def run(name: str, fun, guilds, rows: int):
+    snapshots.clear()
+    start = time.perf_counter()
+    result = asyncio.get_event_loop().run_until_complete(fun(guilds))
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {elapsed:7.2f}s  {rows / elapsed:9.0f} rows/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--roles", type=int, default=10)
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--drift", type=int, default=10, help="rename every nth object before the second run")
+    args = parser.parse_args()
+
+    rows = args.guilds * (1 + args.channels + args.roles + args.members)
+    print(f"{args.guilds} guilds, {rows} rows, {connection.vendor}")
+    reconciler = Reconciler()
+    for name, fun, offset in [("lazy", lazy, 0), ("bulk", reconciler.sync, 10 ** 6)]:
+        guilds = make_guilds(args, offset)
+        run(f"{name} cold start", fun, guilds, rows)
+        drift(guilds, args.drift)
+        stats = run(f"{name} with drift", fun, guilds, rows)
+        if stats is not None:
+            print(stats.report())
+    assert DBGuild.objects.count() == args.guilds * 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Replays gateway traffic into the bot: the fake gateway and REST stand-in run in a child process, the bot with
+the DBotOwner, Listener, Crawler, Mod, Owner and Setup cogs in this one against sqlite. The traffic is either a
+recording of the record_events command or synthesized for --guilds guilds at --rate dispatches per second;
+synthesized traffic is written to a recording first, so both take the same path. Reports the throughput, p50/p99
+latency per event handler and the event loop lag while replaying.
+
+    python -m benchmarks.bench_replay --guilds 10000 --events 20000 --rate 2000
+    python -m benchmarks.bench_replay --recording recordings/events_1610000000.jsonl.gz --speedup 10
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+from typing import Dict, List
+
+import aiohttp
+import discord
+from aiohttp import web
+
+from benchmarks.env import setup_django
+from benchmarks.fake_gateway import FakeGateway, REPLAY_DONE, use_fake_gateway
+from benchmarks.workload import recorded_world, synthesize, synthetic_world
+from discord_handler.event_recorder import read_events, write_events
+
+EXTENSIONS = [
+    'discord_handler.cogs.cog_crawler',
+    'discord_handler.cogs.cog_listener',
+    'discord_handler.cogs.cog_mod',
+    'discord_handler.cogs.cog_owner',
+    'discord_handler.cogs.cog_setup',
+]
+TICK = 0.005
+
+
+def run_gateway(args, conn):
+    """
+    Child process: builds the world and the events, serves the gateway and answers the control routes of the
+    benchmark.
+    """
+    if args.recording is not None:
+        path = args.recording
+        world = recorded_world(read_events(path), args.guilds)
+    else:
+        path = args.save or os.path.join(tempfile.mkdtemp(), 'synthetic.jsonl.gz')
+        world = synthetic_world(args.guilds, args.members)
+        write_events(path, synthesize(world, args.events, args.rate, args.commands, args.seed))
+    events = list(read_events(path))
+    gateway = FakeGateway(world.guild_ids, args.shards, world.payload, args.rest_latency)
+
+    async def start(request):
+        asyncio.ensure_future(gateway.replay(events, args.speedup))
+        return web.json_response({'events': len(events), 'guilds': len(world.guilds)})
+
+    async def stats(request):
+        return web.json_response({'replayed': gateway.replayed, 'replay_lag': gateway.replay_lag,
+                                  'requests': gateway.requests, 'not_found': gateway.not_found})
+
+    app = gateway.app()
+    app.router.add_post('/bench/start', start)
+    app.router.add_get('/bench/stats', stats)
+    loop = asyncio.get_event_loop()
+    conn.send(loop.run_until_complete(gateway.start(app=app)))
+    loop.run_forever()
+
+
+setup_django()
+
+from discord.ext.commands import AutoShardedBot
+
+from discord_handler import db_async
+from discord_handler.analytics import analytics
+from discord_handler.CustHelp import CustHelp
+from discord_handler.cogs.cog_bot_owner import DBotOwner
+from discord_handler.helper import get_pre
+from discord_handler.metrics import MetricsMixin
+from discord_handler.prefix_cache import prefix_cache
+from discord_handler.reconcile import reconciler
+
+
+class ReplayBot(MetricsMixin, AutoShardedBot):
+    """
+    Times every event handler from its dispatch to its end and counts the REPLAY_DONE messages of the shards.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.measuring = False
+        self.handler_latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.pending = set()
+        self.done_shards = 0
+        self.done = asyncio.Event()
+
+    @property
+    def prompts(self) -> int:
+        router = getattr(self, 'interaction_router', None)
+        return len(router) if router is not None else 0
+
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        task = super()._schedule_event(coro, event_name, *args, **kwargs)
+        if self.measuring:
+            name = getattr(coro, '__qualname__', event_name)
+            start = time.perf_counter()
+            self.pending.add(task)
+
+            def done(_):
+                self.pending.discard(task)
+                if self.measuring:
+                    self.handler_latencies.setdefault(name, []).append(time.perf_counter() - start)
+
+            task.add_done_callback(done)
+        return task
+
+    async def on_message(self, message: discord.Message):
+        if message.content == REPLAY_DONE:
+            self.done_shards += 1
+            if self.done_shards == self.shard_count:
+                self.done.set()
+            return
+        if message.author.bot or not prefix_cache.may_be_command(message):
+            return
+        await self.process_commands(message)
+
+    async def on_error(self, event_method, *args, **kwargs):
+        self.errors[event_method] = self.errors.get(event_method, 0) + 1
+        if self.errors[event_method] == 1:
+            await super().on_error(event_method, *args, **kwargs)
+
+
+async def ticker(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+def percentile(values: List[float], p: float) -> float:
+    return values[max(int(len(values) * p) - 1, 0)]
+
+
+async def wait_for(condition, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError()
+        await asyncio.sleep(0.05)
+
+
+async def bench(args, port: int):
+    use_fake_gateway(port)
+    intents = discord.Intents(guilds=True, messages=True, reactions=True, members=True, voice_states=True)
+    bot = ReplayBot(command_prefix=get_pre, help_command=CustHelp(show=True), intents=intents,
+                    shard_count=args.shards, chunk_guilds_at_startup=False)
+    prefix_cache.load()
+    bot.add_cog(DBotOwner(bot, {}, EXTENSIONS))
+
+    start = time.perf_counter()
+    await bot.login('token')
+    connect = asyncio.ensure_future(bot.connect(reconnect=False))
+    base = f"http://127.0.0.1:{port}/bench"
+    try:
+        await wait_for(bot.is_ready, args.timeout)
+        # the Crawler syncs the db with the gateway cache on ready, replaying starts on a warm db
+        await wait_for(lambda: reconciler.last is not None, args.timeout)
+        print(f"{len(bot.guilds)} guilds on {bot.shard_count} shards ready and synced after "
+              f"{time.perf_counter() - start:.2f}s")
+
+        lags = []
+        stop = asyncio.Event()
+        tick = asyncio.ensure_future(ticker(lags, stop))
+        bot.measuring = True
+        async with aiohttp.ClientSession() as session:
+            start = time.perf_counter()
+            async with session.post(f"{base}/start") as r:
+                info = await r.json()
+            await asyncio.wait_for(bot.done.wait(), args.timeout)
+            # handlers waiting for a reaction or a reply, i.e. the help menu, would only end on their timeout
+            await wait_for(lambda: len(bot.pending) <= bot.prompts, args.timeout)
+            elapsed = time.perf_counter() - start
+            bot.measuring = False
+            waiting = len(bot.pending)
+            stop.set()
+            await tick
+            async with session.get(f"{base}/stats") as r:
+                stats = await r.json()
+    finally:
+        await bot.close()
+        connect.cancel()
+
+    speed = f"{args.speedup}x" if args.speedup else "as fast as possible"
+    print(f"replayed {stats['replayed']} of {info['events']} dispatches to {info['guilds']} guilds, {speed}, "
+          f"in {elapsed:.2f}s: {stats['replayed'] / elapsed:.0f} dispatches/s, "
+          f"gateway behind schedule by up to {stats['replay_lag'] * 1000:.0f}ms")
+    print(f"  {'handler':<40} {'count':>7} {'p50':>9} {'p99':>9} {'max':>9}")
+    for name, latencies in sorted(bot.handler_latencies.items(), key=lambda i: -len(i[1])):
+        latencies = sorted(latencies)
+        print(f"  {name:<40} {len(latencies):7} {statistics.median(latencies) * 1000:7.2f}ms "
+              f"{percentile(latencies, 0.99) * 1000:7.2f}ms {latencies[-1] * 1000:7.2f}ms")
+    lags = sorted(lags) or [0.0]
+    print(f"loop lag p50 {statistics.median(lags) * 1000:.2f}ms, p99 {percentile(lags, 0.99) * 1000:.2f}ms, "
+          f"max {lags[-1] * 1000:.2f}ms")
+    print(f"REST requests: {sum(stats['requests'].values())}, not found: {stats['not_found']}")
+    for name, count in sorted(stats['requests'].items(), key=lambda i: -i[1]):
+        print(f"  {name:<60} {count:7}")
+    if waiting:
+        print(f"{waiting} handlers still waiting for user input are not included")
+    if bot.errors:
+        print(f"handler errors: {bot.errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recording", type=str, default=None, help="Recording to replay instead of synthetic events")
+    parser.add_argument("--save", type=str, default=None, help="Keeps the synthesized recording at this path")
+    parser.add_argument("--guilds", type=int, default=10000, help="Guilds, recordings are padded up to this count")
+    parser.add_argument("--members", type=int, default=5, help="Members per synthetic guild")
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--rate", type=float, default=2000, help="Synthesized dispatches per second")
+    parser.add_argument("--commands", type=float, default=0.1, help="Share of the messages invoking a command")
+    parser.add_argument("--speedup", type=float, default=1.0, help="0 replays as fast as possible")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--rest_latency", type=float, default=0.0, help="Seconds every REST request takes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    parent, child = ctx.Pipe()
+    process = ctx.Process(target=run_gateway, args=(args, child), daemon=True)
+    process.start()
+    try:
+        port = parent.recv()
+        asyncio.get_event_loop().run_until_complete(bench(args, port))
+    finally:
+        process.terminate()
+        process.join()
+        analytics.shutdown()
+        db_async.shutdown()
+
+
+if __name__ == "__main__":
+    main()
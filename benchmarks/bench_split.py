@@ -0,0 +1,148 @@
+"""
+Throughput of the gateway/worker split. A GatewayBridge is fed a simulated event stream (READY, GUILD_CREATE
+for every guild, then MESSAGE_CREATE payloads invoking a ping command) and forwards it over a Unix socket to
+worker processes. The workers parse the events with discord.py, run the command and send the reply back
+through the bridge to a fake http client, where the round trip is measured.
+
+    python -m benchmarks.bench_split --workers 2 --messages 20000 --work 0.001
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+import discord
+from discord.ext.commands import Bot, Cog, command
+
+from benchmarks import payloads
+from benchmarks.env import setup_django
+
+setup_django()
+
+from discord_handler.split import GatewayBridge, Worker, WorkerMixin
+
+
+class BenchWorkerBot(WorkerMixin, Bot):
+    pass
+
+
+class Ping(Cog):
+    def __init__(self, work: float):
+        self.work = work
+
+    @command(name='ping')
+    async def ping(self, ctx, nr: int):
+        # blocking work stands in for heavy command logic
+        end = time.perf_counter() + self.work
+        while time.perf_counter() < end:
+            pass
+        await ctx.send(f"pong {nr}")
+
+
+def run_worker(socket_path: str, worker_id: int, work: float):
+    bot = BenchWorkerBot(command_prefix='!', help_command=None,
+                         intents=discord.Intents(messages=True, guilds=True))
+    bot.add_cog(Ping(work))
+    worker = Worker(bot, socket_path, worker_id)
+    try:
+        bot.loop.run_until_complete(worker.run())
+    except KeyboardInterrupt:
+        pass
+
+
+class FakeHTTP:
+    def __init__(self):
+        self.replies = {}
+
+    async def request(self, route, *, files=None, form=None, **kwargs):
+        content = kwargs.get('json', {}).get('content', '')
+        if content.startswith('pong '):
+            self.replies[int(content[5:])] = time.perf_counter()
+        data = payloads.message_create(route.channel_id // 100, route.channel_id, payloads.BOT_ID, content, True)
+        return data
+
+
+class FakeGatewayBot:
+    def __init__(self):
+        self.http = FakeHTTP()
+
+
+async def settle(bridge: GatewayBridge):
+    while any(i.backlog or i.in_flight for i in bridge.links.values()):
+        await asyncio.sleep(0.01)
+
+
+async def bench(args):
+    socket_path = os.path.join(tempfile.mkdtemp(), 'bench.sock')
+    bot = FakeGatewayBot()
+    bridge = GatewayBridge(bot, socket_path, max_in_flight=args.max_in_flight, max_backlog=args.max_backlog)
+    await bridge.start()
+
+    ctx = multiprocessing.get_context('spawn')
+    processes = [ctx.Process(target=run_worker, args=(socket_path, i, args.work), daemon=True)
+                 for i in range(args.workers)]
+    for p in processes:
+        p.start()
+    while len(bridge.links) < args.workers:
+        await asyncio.sleep(0.05)
+
+    guild_ids = [1000 + i for i in range(args.guilds)]
+    bridge.forward(payloads.dispatch('READY', payloads.ready(guild_ids)))
+    for g_id in guild_ids:
+        bridge.forward(payloads.dispatch('GUILD_CREATE', payloads.guild_create(g_id)))
+    await settle(bridge)
+    # discord.py delays on_ready until no guild arrived for a while
+    await asyncio.sleep(2.5)
+
+    sent = {}
+    start = time.perf_counter()
+    for nr in range(args.messages):
+        g_id = guild_ids[nr % len(guild_ids)]
+        c_id = payloads.channel_id(g_id, nr % 2)
+        sent[nr] = time.perf_counter()
+        bridge.forward(payloads.dispatch('MESSAGE_CREATE', payloads.message_create(g_id, c_id, 5, f"!ping {nr}")))
+        if nr % args.batch == 0:
+            await asyncio.sleep(0)
+
+    expected = args.messages - bridge.dropped
+    deadline = time.perf_counter() + args.timeout
+    while len(bot.http.replies) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+        expected = args.messages - bridge.dropped
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted((bot.http.replies[i] - sent[i]) * 1000 for i in bot.http.replies)
+    print(f"workers: {args.workers}, guilds: {args.guilds}, messages: {args.messages}, work: {args.work * 1000}ms")
+    print(f"replies: {len(latencies)}, dropped: {bridge.dropped}, elapsed: {elapsed:.2f}s, "
+          f"throughput: {len(latencies) / elapsed:.0f} commands/s")
+    if latencies:
+        print(f"round trip p50: {statistics.median(latencies):.1f}ms, "
+              f"p99: {latencies[int(len(latencies) * 0.99) - 1]:.1f}ms")
+    for link in bridge.links.values():
+        print(f"worker {link.worker_id}: sent {link.sent}, dropped {link.dropped}")
+
+    await bridge.close()
+    for p in processes:
+        p.terminate()
+        p.join()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--work", type=float, default=0.0, help="Blocking seconds per command")
+    parser.add_argument("--batch", type=int, default=100, help="Events forwarded between yields")
+    parser.add_argument("--max_in_flight", type=int, default=256)
+    parser.add_argument("--max_backlog", type=int, default=10000)
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(bench(args))
+
+
+if __name__ == "__main__":
+    main()
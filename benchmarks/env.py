@@ -0,0 +1,34 @@
+"""
+Shared setup for the benchmark scripts. Django is configured against a throwaway sqlite database, so the
+benchmarks run without postgres or a secret.json.
+"""
+import os
+import tempfile
+
+import django
+from django.conf import settings
+
+
+def setup_django(db_path: str = None):
+    if settings.configured:
+        return
+
+    db_path = db_path or os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    settings.configure(
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': db_path,
+            }
+        },
+        INSTALLED_APPS=('db',),
+        SECRET_KEY='bench',
+        USE_TZ=True,
+    )
+    django.setup()
+
+    from django.apps import apps
+    from django.db import connection
+    with connection.schema_editor() as editor:
+        for model in apps.get_app_config('db').get_models():
+            editor.create_model(model)
@@ -0,0 +1,194 @@
+"""
+Local stand-in for the discord gateway and the REST routes the bot uses. Speaks enough of the gateway protocol
+for discord.py to connect shards: HELLO, IDENTIFY, READY, one GUILD_CREATE per guild of the shard and heartbeat
+ACKs. Sent messages, fetched messages and members get synthetic answers, other writes a 204 and unknown reads a
+404. replay() streams recorded dispatches to the shards of their guilds. Point discord.py at it with
+use_fake_gateway(port).
+"""
+import asyncio
+import json
+import time
+from typing import Callable, Dict, List, Sequence, Union
+
+import discord.http
+from aiohttp import web, WSMsgType
+
+from benchmarks import payloads
+
+HELLO = 10
+IDENTIFY = 2
+HEARTBEAT = 1
+HEARTBEAT_ACK = 11
+DISPATCH = 0
+
+REPLAY_DONE = '__replay_done__'
+
+
+def json_response(data, status: int = 200) -> web.Response:
+    # discord.py only parses bodies with exactly this content type
+    return web.Response(body=json.dumps(data).encode(), status=status, headers={'Content-Type': 'application/json'})
+
+
+def use_fake_gateway(port: int):
+    discord.http.Route.BASE = f"http://127.0.0.1:{port}/api/v7"
+
+
+def guild_ids(count: int) -> List[int]:
+    # the shard of a guild is (guild_id >> 22) % shard_count
+    return [(i << 22) + 1 for i in range(1, count + 1)]
+
+
+def shard_of(g_id: int, shard_count: int) -> int:
+    return (g_id >> 22) % shard_count
+
+
+class Session:
+    def __init__(self, ws: web.WebSocketResponse):
+        self.ws = ws
+        self.seq = 0
+
+    async def dispatch(self, t: str, d: dict):
+        self.seq += 1
+        await self.ws.send_json({'op': DISPATCH, 't': t, 's': self.seq, 'd': d})
+
+
+class FakeGateway:
+    def __init__(self, guilds: Union[int, Sequence[int]], shard_count: int,
+                 guild_payload: Callable[[int], dict] = payloads.guild_create, rest_latency: float = 0.0):
+        """
+        :param guilds: number of synthetic guilds or their ids
+        :param guild_payload: builds the GUILD_CREATE payload of a guild id
+        :param rest_latency: seconds every REST request is delayed
+        """
+        self.guild_ids = guild_ids(guilds) if isinstance(guilds, int) else list(guilds)
+        self.shard_count = shard_count
+        self.guild_payload = guild_payload
+        self.rest_latency = rest_latency
+        self.port = None
+        self.identifies = 0
+        self.sessions = 0
+        self.shards: Dict[int, Session] = {}
+        self.requests: Dict[str, int] = {}
+        self.not_found = 0
+        self.replayed = 0
+        self.replay_lag = 0.0
+        self._runner = None
+
+    def shard_guilds(self, shard_id: int, shard_count: int) -> List[int]:
+        return [i for i in self.guild_ids if shard_of(i, shard_count) == shard_id]
+
+    @web.middleware
+    async def count_requests(self, request, handler):
+        if request.path.startswith('/api/'):
+            name = f"{request.method} {request.match_info.route.resource.canonical}"
+            self.requests[name] = self.requests.get(name, 0) + 1
+            if self.rest_latency:
+                await asyncio.sleep(self.rest_latency)
+        return await handler(request)
+
+    async def me(self, request):
+        return json_response(payloads.user(payloads.BOT_ID, True))
+
+    async def gateway(self, request):
+        return json_response({'url': f"ws://127.0.0.1:{self.port}/ws", 'shards': self.shard_count,
+                              'session_start_limit': {'total': 1000, 'remaining': 1000, 'reset_after': 0,
+                                                      'max_concurrency': 1}})
+
+    async def send_message(self, request):
+        data = await request.json()
+        message = payloads.message(payloads.snowflake(), 0, int(request.match_info['channel_id']), payloads.BOT_ID,
+                                   data.get('content') or '')
+        del message['guild_id']
+        message['author']['bot'] = True
+        return json_response(message)
+
+    async def get_message(self, request):
+        message = payloads.message(int(request.match_info['message_id']), 0, int(request.match_info['channel_id']),
+                                   payloads.BOT_ID, '', reactions=['\N{THUMBS UP SIGN}'])
+        del message['guild_id']
+        return json_response(message)
+
+    async def get_member(self, request):
+        return json_response(payloads.member(int(request.match_info['user_id'])))
+
+    async def fallback(self, request):
+        if request.method in ('PUT', 'PATCH', 'DELETE', 'POST'):
+            return web.Response(status=204)
+        self.not_found += 1
+        return json_response({'message': 'Unknown', 'code': 0}, status=404)
+
+    async def ws(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.sessions += 1
+        session = Session(ws)
+        await ws.send_json({'op': HELLO, 'd': {'heartbeat_interval': 41250}})
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                break
+            data = msg.json()
+            if data['op'] == HEARTBEAT:
+                await ws.send_json({'op': HEARTBEAT_ACK, 'd': None})
+            elif data['op'] == IDENTIFY:
+                self.identifies += 1
+                shard_id, shard_count = data['d'].get('shard', [0, 1])
+                self.shards[shard_id] = session
+                guilds = self.shard_guilds(shard_id, shard_count)
+                ready = payloads.ready(guilds)
+                ready['shard'] = [shard_id, shard_count]
+                await session.dispatch('READY', ready)
+                for g_id in guilds:
+                    await session.dispatch('GUILD_CREATE', self.guild_payload(g_id))
+        return ws
+
+    async def replay(self, events: Sequence[tuple], speedup: float = 1.0, batch: int = 100):
+        """
+        Sends the dispatches to the shards of their guilds, dispatches without a guild go to shard 0. Every shard
+        gets a REPLAY_DONE message last.
+        :param events: (offset in seconds, event type, payload) tuples
+        :param speedup: factor the offsets are divided by, 0 sends everything as fast as possible
+        """
+        start = time.perf_counter()
+        for nr, (t, event, d) in enumerate(events):
+            if speedup:
+                delay = start + t / speedup - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    self.replay_lag = max(self.replay_lag, -delay)
+            if nr % batch == 0:
+                await asyncio.sleep(0)
+            g_id = int(d['guild_id']) if d.get('guild_id') else 0
+            session = self.shards.get(shard_of(g_id, self.shard_count))
+            if session is not None:
+                await session.dispatch(event, d)
+                self.replayed += 1
+
+        for session in self.shards.values():
+            done = payloads.message_create(0, 1, payloads.BOT_ID, REPLAY_DONE, True)
+            del done['guild_id']
+            await session.dispatch('MESSAGE_CREATE', done)
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.count_requests])
+        app.router.add_get('/api/v7/users/@me', self.me)
+        app.router.add_get('/api/v7/gateway', self.gateway)
+        app.router.add_get('/api/v7/gateway/bot', self.gateway)
+        app.router.add_post('/api/v7/channels/{channel_id}/messages', self.send_message)
+        app.router.add_get('/api/v7/channels/{channel_id}/messages/{message_id}', self.get_message)
+        app.router.add_get('/api/v7/guilds/{guild_id}/members/{user_id}', self.get_member)
+        app.router.add_route('*', '/api/v7/{tail:.*}', self.fallback)
+        app.router.add_get('/ws', self.ws)
+        return app
+
+    async def start(self, port: int = 0, app: web.Application = None) -> int:
+        self._runner = web.AppRunner(app if app is not None else self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
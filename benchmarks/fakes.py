@@ -0,0 +1,86 @@
+"""
+Lightweight stand-ins for the discord objects the bot touches. Only the attributes used by the code under
+benchmark are implemented.
+"""
+
+
+class FakeGuild:
+    def __init__(self, g_id: int, name: str = None):
+        self.id = g_id
+        self.name = name if name is not None else f"guild {g_id}"
+        self.unavailable = False
+        self.channels = []
+        self.roles = []
+        self.members = []
+
+
+class FakeChannel:
+    def __init__(self, c_id: int, guild: FakeGuild):
+        self.id = c_id
+        self.guild = guild
+        self.name = f"channel {c_id}"
+
+
+class FakeColor:
+    def __init__(self, value: int):
+        self.r, self.g, self.b = (value >> 16) & 0xff, (value >> 8) & 0xff, value & 0xff
+
+
+class FakeRole:
+    def __init__(self, r_id: int, guild: FakeGuild):
+        self.id = r_id
+        self.guild = guild
+        self.name = f"role {r_id}"
+        self.color = FakeColor(r_id & 0xffffff)
+
+
+class FakePermissions:
+    def __init__(self, administrator=False, manage_roles=False, ban_members=False):
+        self.administrator = administrator
+        self.manage_roles = manage_roles
+        self.ban_members = ban_members
+
+
+class FakeMember:
+    def __init__(self, u_id: int, guild: FakeGuild, bot=False, roles: list = None,
+                 guild_permissions: FakePermissions = None):
+        self.id = u_id
+        self.guild = guild
+        self.bot = bot
+        self.name = self.display_name = f"user {u_id}"
+        self.avatar_url = f"https://cdn.example/avatars/{u_id}.png"
+        self.roles = roles if roles is not None else []
+        self.guild_permissions = guild_permissions if guild_permissions is not None else FakePermissions()
+
+
+class FakeMessage:
+    def __init__(self, content: str, author: FakeMember, guild: FakeGuild = None):
+        self.content = content
+        self.author = author
+        self.guild = guild
+
+
+class FakeSend:
+    """
+    Stands in for Messageable.send, collects what would have been sent.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    async def __call__(self, content: str = None, **kwargs):
+        message = FakeMessage(content, None)
+        self.sent.append(message)
+        return message
+
+
+class FakeContext:
+    def __init__(self, message: FakeMessage, bot=None, command=None, cog=None, prefix: str = "!"):
+        self.message = message
+        self.guild = message.guild
+        self.author = message.author
+        self.bot = bot
+        self.command = command
+        self.cog = cog
+        self.prefix = prefix
+        self.send = FakeSend()
@@ -0,0 +1,135 @@
+"""
+Measuring helpers shared by the benchmarks: per stage latency, db query counts, allocations and a baseline
+file to compare the results against.
+"""
+import json
+import statistics
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+class QueryCounter:
+    """
+    Counts the queries of every db connection, including the ones of the db threads, which are only created
+    on their first job.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def _install(self, connection):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def _on_connection_created(self, sender, connection, **kwargs):
+        self._install(connection)
+
+    def install(self):
+        connection_created.connect(self._on_connection_created, weak=False)
+        for i in connections.all():
+            self._install(i)
+
+
+class StageRecorder:
+    """
+    Collects latency, queries and allocated bytes per stage. Allocations are only tracked while tracemalloc
+    is running, they are measured in a separate pass as tracing slows everything down.
+    """
+
+    def __init__(self, queries: QueryCounter):
+        self.queries = queries
+        self.latencies: Dict[str, List[float]] = {}
+        self.query_counts: Dict[str, List[int]] = {}
+        self.allocations: Dict[str, List[int]] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        queries = self.queries.count
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if tracing:
+                self.allocations.setdefault(name, []).append(tracemalloc.get_traced_memory()[1] - start_memory)
+            else:
+                self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+                self.query_counts.setdefault(name, []).append(self.queries.count - queries)
+
+    def results(self) -> Dict[str, Dict[str, float]]:
+        results = {}
+        for name, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            results[name] = {
+                'p50_ms': statistics.median(latencies) * 1000,
+                'p99_ms': latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000,
+                'queries': sum(self.query_counts[name]) / len(self.query_counts[name]),
+            }
+            if name in self.allocations:
+                results[name]['alloc_kb'] = statistics.mean(self.allocations[name]) / 1024
+        return results
+
+
+def report(title: str, results: Dict[str, Dict[str, float]]):
+    print(title)
+    print(f"  {'stage':<20} {'p50':>9} {'p99':>9} {'queries':>8} {'peak alloc':>11}")
+    for name, i in results.items():
+        alloc = f"{i['alloc_kb']:8.1f} KB" if 'alloc_kb' in i else ""
+        print(f"  {name:<20} {i['p50_ms']:7.3f}ms {i['p99_ms']:7.3f}ms {i['queries']:8.2f} {alloc:>11}")
+
+
+def load_baseline(path: str) -> dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_baseline(path: str, results: dict):
+    results = {scenario: {name: {key: round(value, 3) for key, value in i.items()} for name, i in stages.items()}
+               for scenario, stages in results.items()}
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(results: Dict[str, Dict[str, Dict[str, float]]], baseline: Dict[str, Dict[str, Dict[str, float]]],
+            latency_tolerance: float, alloc_tolerance: float, min_delta_ms: float = 0.05) -> List[str]:
+    """
+    Lists the regressions of results against baseline, both keyed by scenario and stage. Query counts may not
+    grow, latency and allocations may grow by the tolerance factor. Latency changes below min_delta_ms are
+    ignored, stages that fast are mostly noise.
+    :return: one line per regression, empty if there is none
+    """
+    regressions = []
+    for scenario, stages in baseline.items():
+        for name, expected in stages.items():
+            actual = results.get(scenario, {}).get(name)
+            if actual is None:
+                regressions.append(f"{scenario}/{name}: missing")
+                continue
+            if actual['queries'] > expected['queries']:
+                regressions.append(f"{scenario}/{name}: {actual['queries']:.2f} queries, "
+                                   f"baseline {expected['queries']:.2f}")
+            if actual['p50_ms'] > expected['p50_ms'] * latency_tolerance and \
+                    actual['p50_ms'] - expected['p50_ms'] > min_delta_ms:
+                regressions.append(f"{scenario}/{name}: p50 {actual['p50_ms']:.3f}ms, "
+                                   f"baseline {expected['p50_ms']:.3f}ms")
+            if 'alloc_kb' in expected and actual.get('alloc_kb', 0) > expected['alloc_kb'] * alloc_tolerance and \
+                    actual['alloc_kb'] - expected['alloc_kb'] > 1:
+                regressions.append(f"{scenario}/{name}: {actual['alloc_kb']:.1f}KB allocated, "
+                                   f"baseline {expected['alloc_kb']:.1f}KB")
+    return regressions
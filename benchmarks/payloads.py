@@ -0,0 +1,100 @@
+"""
+Synthetic raw gateway payloads, shaped like the dispatches discord sends, for feeding the discord.py parsers.
+"""
+import itertools
+
+BOT_ID = 1
+TIMESTAMP = "2021-01-01T00:00:00.000000+00:00"
+
+_snowflakes = itertools.count(10 ** 17)
+
+
+def snowflake() -> int:
+    return next(_snowflakes)
+
+
+def user(u_id: int, bot: bool = False) -> dict:
+    return {'id': str(u_id), 'username': f"user {u_id}", 'discriminator': '0001', 'avatar': None, 'bot': bot}
+
+
+def ready(guild_ids) -> dict:
+    return {'v': 8, 'user': user(BOT_ID, True), 'guilds': [{'id': str(i), 'unavailable': True} for i in guild_ids],
+            'session_id': 'bench', 'private_channels': [], 'relationships': []}
+
+
+def channel_id(g_id: int, nr: int = 0) -> int:
+    return g_id * 100 + nr
+
+
+def text_channel(c_id: int, position: int = 0) -> dict:
+    return {'id': str(c_id), 'type': 0, 'name': f"channel-{c_id}", 'position': position,
+            'permission_overwrites': []}
+
+
+def voice_channel(c_id: int, position: int = 0) -> dict:
+    return {'id': str(c_id), 'type': 2, 'name': f"voice-{c_id}", 'position': position, 'bitrate': 64000,
+            'user_limit': 0, 'permission_overwrites': []}
+
+
+def member(u_id: int, roles=(), bot: bool = False) -> dict:
+    return {'user': user(u_id, bot), 'roles': [str(i) for i in roles], 'joined_at': TIMESTAMP, 'deaf': False,
+            'mute': False}
+
+
+def guild(g_id: int, channel_ids=(), voice_ids=(), member_ids=()) -> dict:
+    return {
+        'id': str(g_id), 'name': f"guild {g_id}", 'owner_id': str(BOT_ID), 'member_count': len(member_ids) + 1,
+        'unavailable': False, 'large': False, 'features': [], 'emojis': [], 'voice_states': [], 'presences': [],
+        'roles': [{'id': str(g_id), 'name': '@everyone', 'permissions': '104324673', 'position': 0, 'color': 0,
+                   'hoist': False, 'managed': False, 'mentionable': False}],
+        'channels': [text_channel(c, i) for i, c in enumerate(channel_ids)] +
+                    [voice_channel(c, i) for i, c in enumerate(voice_ids)],
+        'members': [member(BOT_ID, bot=True)] + [member(i) for i in member_ids],
+    }
+
+
+def member_id(g_id: int, nr: int = 0) -> int:
+    return g_id * 1000 + nr
+
+
+def guild_create(g_id: int, channels: int = 2, members: int = 1, voice_channels: int = 0) -> dict:
+    return guild(g_id, [channel_id(g_id, i) for i in range(channels)],
+                 [channel_id(g_id, 50 + i) for i in range(voice_channels)],
+                 [member_id(g_id, i) for i in range(members)])
+
+
+def message_create(g_id: int, c_id: int, u_id: int, content: str, bot: bool = False) -> dict:
+    return {
+        'id': str(snowflake()), 'channel_id': str(c_id), 'guild_id': str(g_id), 'author': user(u_id, bot),
+        'member': {'roles': [], 'joined_at': TIMESTAMP, 'deaf': False, 'mute': False}, 'content': content,
+        'timestamp': TIMESTAMP, 'edited_timestamp': None, 'tts': False, 'mention_everyone': False,
+        'mentions': [], 'mention_roles': [], 'attachments': [], 'embeds': [], 'pinned': False, 'type': 0,
+    }
+
+
+def message(m_id: int, g_id: int, c_id: int, u_id: int, content: str, reactions=()) -> dict:
+    d = message_create(g_id, c_id, u_id, content)
+    d['id'] = str(m_id)
+    d['reactions'] = [{'emoji': {'id': None, 'name': i}, 'count': 1, 'me': False} for i in reactions]
+    return d
+
+
+def reaction_add(g_id: int, c_id: int, m_id: int, u_id: int, emoji: str) -> dict:
+    return {'user_id': str(u_id), 'channel_id': str(c_id), 'message_id': str(m_id), 'guild_id': str(g_id),
+            'emoji': {'id': None, 'name': emoji}, 'member': member(u_id)}
+
+
+def member_update(g_id: int, u_id: int, roles=()) -> dict:
+    d = member(u_id, roles)
+    d['guild_id'] = str(g_id)
+    return d
+
+
+def voice_state_update(g_id: int, c_id, u_id: int) -> dict:
+    return {'guild_id': str(g_id), 'channel_id': str(c_id) if c_id is not None else None, 'user_id': str(u_id),
+            'member': member(u_id), 'session_id': 'bench', 'deaf': False, 'mute': False, 'self_deaf': False,
+            'self_mute': False, 'self_video': False, 'suppress': False}
+
+
+def dispatch(t: str, d: dict, seq: int = 0) -> dict:
+    return {'op': 0, 't': t, 's': seq, 'd': d}
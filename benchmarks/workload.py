@@ -0,0 +1,125 @@
+"""
+Synthetic gateway traffic for the replay benchmark. A World holds the guilds, channels and members events refer
+to, either made up or collected from a recording, synthesize() generates a mix of dispatches at a fixed rate.
+"""
+import random
+from typing import Dict, Iterable, Iterator, List, Set
+
+from benchmarks import payloads
+from benchmarks.fake_gateway import guild_ids
+from discord_handler.event_recorder import Event
+
+COMMANDS = ('!help', '!setup')
+EMOJI = '\N{THUMBS UP SIGN}'
+# share of every kind of dispatch, commands are a share of the messages
+MIX = {
+    'message': 0.6,
+    'reaction': 0.2,
+    'member_update': 0.1,
+    'voice': 0.1,
+}
+
+
+class GuildShape:
+    def __init__(self):
+        self.channels: Set[int] = set()
+        self.voice_channels: Set[int] = set()
+        self.members: Set[int] = set()
+
+
+class World:
+    """
+    The guilds the fake gateway sends on IDENTIFY. Every id a replayed event refers to has to exist in the
+    gateway cache, otherwise discord.py drops the event.
+    """
+
+    def __init__(self):
+        self.guilds: Dict[int, GuildShape] = {}
+
+    @property
+    def guild_ids(self) -> List[int]:
+        return list(self.guilds)
+
+    def add_synthetic(self, g_id: int, channels: int = 2, voice_channels: int = 1, members: int = 5):
+        shape = self.guilds.setdefault(g_id, GuildShape())
+        shape.channels.update(payloads.channel_id(g_id, i) for i in range(channels))
+        shape.voice_channels.update(payloads.channel_id(g_id, 50 + i) for i in range(voice_channels))
+        shape.members.update(payloads.member_id(g_id, i) for i in range(members))
+
+    def observe(self, event: str, d: dict):
+        """
+        Adds the guild, channel and member of a recorded dispatch.
+        """
+        if 'guild_id' not in d:
+            return
+        shape = self.guilds.setdefault(int(d['guild_id']), GuildShape())
+        user = d.get('author') or d.get('user') or d.get('member', {}).get('user')
+        if user is not None:
+            shape.members.add(int(user['id']))
+        elif 'user_id' in d:
+            shape.members.add(int(d['user_id']))
+        if d.get('channel_id') is not None:
+            if event == 'VOICE_STATE_UPDATE':
+                shape.voice_channels.add(int(d['channel_id']))
+            else:
+                shape.channels.add(int(d['channel_id']))
+
+    def payload(self, g_id: int) -> dict:
+        shape = self.guilds[g_id]
+        return payloads.guild(g_id, sorted(shape.channels), sorted(shape.voice_channels), sorted(shape.members))
+
+
+def synthetic_world(guilds: int, members: int = 5) -> World:
+    world = World()
+    for g_id in guild_ids(guilds):
+        world.add_synthetic(g_id, members=members)
+    return world
+
+
+def recorded_world(events: Iterable[Event], guilds: int = 0) -> World:
+    """
+    World of a recording, padded with synthetic guilds up to guilds.
+    """
+    world = World()
+    for _, event, d in events:
+        world.observe(event, d)
+    for g_id in guild_ids(guilds):
+        if len(world.guilds) >= guilds:
+            break
+        if g_id not in world.guilds:
+            world.add_synthetic(g_id)
+    return world
+
+
+def synthesize(world: World, count: int, rate: float, commands: float = 0.1, seed: int = 0) -> Iterator[Event]:
+    """
+    :param count: number of dispatches
+    :param rate: dispatches per second
+    :param commands: share of the messages that invoke a command
+    """
+    rng = random.Random(seed)
+    shapes = [(g_id, sorted(i.channels), sorted(i.voice_channels), sorted(i.members))
+              for g_id, i in world.guilds.items() if i.channels and i.members]
+    kinds, weights = zip(*MIX.items())
+    in_voice: Set[int] = set()
+
+    for nr in range(count):
+        g_id, channels, voice_channels, members = rng.choice(shapes)
+        u_id = rng.choice(members)
+        kind = rng.choices(kinds, weights)[0]
+        t = nr / rate
+        if kind == 'voice' and voice_channels:
+            if u_id in in_voice:
+                in_voice.discard(u_id)
+                yield t, 'VOICE_STATE_UPDATE', payloads.voice_state_update(g_id, None, u_id)
+            else:
+                in_voice.add(u_id)
+                yield t, 'VOICE_STATE_UPDATE', payloads.voice_state_update(g_id, rng.choice(voice_channels), u_id)
+        elif kind == 'reaction':
+            yield t, 'MESSAGE_REACTION_ADD', payloads.reaction_add(g_id, rng.choice(channels), payloads.snowflake(),
+                                                                   u_id, EMOJI)
+        elif kind == 'member_update':
+            yield t, 'GUILD_MEMBER_UPDATE', payloads.member_update(g_id, u_id)
+        else:
+            content = rng.choice(COMMANDS) if rng.random() < commands else f"message {nr}"
+            yield t, 'MESSAGE_CREATE', payloads.message_create(g_id, rng.choice(channels), u_id, content)
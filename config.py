@@ -0,0 +1,25 @@
+import json
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_config = None
+
+
+def secret_path() -> str:
+    if sys.platform == "darwin":
+        return os.path.join(BASE_DIR, 'secret_dev.json')
+    return os.path.join(BASE_DIR, 'secret.json')
+
+
+def load_config() -> dict:
+    """
+    Returns the content of the secret file of this platform. The file is read once per process, settings, main
+    and the cogs all share the result.
+    """
+    global _config
+    if _config is None:
+        with open(secret_path(), 'r') as f:
+            _config = json.load(f)
+    return _config
@@ -28,7 +28,7 @@ class DBGuild(models.Model):
         return self.__repr__()
 
     def m_role(self):
-        data = [i.role.role_id for i in self.modrole_set.all()]
+        data = list(self.modrole_set.values_list('role__role_id', flat=True))
         return data if len(data) != 0 else None
 
     def add_m_role(self, role):
@@ -145,6 +145,11 @@ class CommandStats(models.Model):
     timestamp = models.DateTimeField(verbose_name="Timestamp this command was executed", default=timezone.now)
     user = models.ForeignKey(DBUser, verbose_name="User that executed this command", null=True,
                              on_delete=models.CASCADE)
+    # stats are buffered before they are written, this is when the row was inserted
+    created = models.DateTimeField(verbose_name="Timestamp this row was written", default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['timestamp'], name='commandstats_timestamp_idx')]
 
     def __repr__(self):
         return f"{self.g.name}({self.g.id}): {self.command}"
@@ -164,6 +169,10 @@ class GuildStats(models.Model):
     count = models.BigIntegerField(verbose_name="Count up or downward")
     total_count = models.BigIntegerField(verbose_name="Total count of guilds the bot is on")
 
+    class Meta:
+        indexes = [models.Index(fields=['g_joined', 'timestamp'], name='guildstats_joined_time_idx'),
+                   models.Index(fields=['timestamp'], name='guildstats_timestamp_idx')]
+
     def __repr__(self):
         if self.g_left is None:
             return f"Added {self.g_joined}: {self.timestamp.strftime('%d.%m.%Y')}"
@@ -179,6 +188,9 @@ class UserStats(models.Model):
     timestamp = models.DateTimeField(verbose_name="Timestamp this happened", default=timezone.now)
     total_count = models.BigIntegerField(verbose_name="Total count of users that are stored in the bot")
 
+    class Meta:
+        indexes = [models.Index(fields=['timestamp'], name='userstats_timestamp_idx')]
+
     def __repr__(self):
         return f"{self.u}: {self.timestamp.strftime('%d.%m.%Y')} Count {self.total_count}"
 
@@ -186,6 +198,86 @@ class UserStats(models.Model):
         return self.__repr__()
 
 
+rollup_periods = [("h", "hour"), ("d", "day")]
+
+
+class CommandStatsRollup(models.Model):
+    period = models.CharField(max_length=1, choices=rollup_periods, verbose_name="Length of the bucket")
+    bucket = models.DateTimeField(verbose_name="Start of the bucket")
+    g_id = models.BigIntegerField(verbose_name="Discord ID of the guild, 0 for direct messages")
+    command = models.CharField(max_length=512, verbose_name="Name of the command")
+    count = models.BigIntegerField(verbose_name="Number of invocations in the bucket", default=0)
+
+    class Meta:
+        unique_together = (('period', 'bucket', 'g_id', 'command'))
+        indexes = [models.Index(fields=['period', 'bucket'], name='commandrollup_bucket_idx')]
+
+    def __repr__(self):
+        return f"{self.command} on {self.g_id} {self.bucket}: {self.count}"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class GuildStatsRollup(models.Model):
+    period = models.CharField(max_length=1, choices=rollup_periods, verbose_name="Length of the bucket")
+    bucket = models.DateTimeField(verbose_name="Start of the bucket")
+    joined = models.BigIntegerField(verbose_name="Guilds that added the bot in the bucket", default=0)
+    left = models.BigIntegerField(verbose_name="Guilds that removed the bot in the bucket", default=0)
+    total_count = models.BigIntegerField(verbose_name="Total count of guilds at the end of the bucket", default=0)
+
+    class Meta:
+        unique_together = (('period', 'bucket'))
+
+    def __repr__(self):
+        return f"{self.bucket}: +{self.joined} -{self.left} ({self.total_count})"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class UserStatsRollup(models.Model):
+    period = models.CharField(max_length=1, choices=rollup_periods, verbose_name="Length of the bucket")
+    bucket = models.DateTimeField(verbose_name="Start of the bucket")
+    added = models.BigIntegerField(verbose_name="Users added in the bucket", default=0)
+    total_count = models.BigIntegerField(verbose_name="Total count of users at the end of the bucket", default=0)
+
+    class Meta:
+        unique_together = (('period', 'bucket'))
+
+    def __repr__(self):
+        return f"{self.bucket}: +{self.added} ({self.total_count})"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class RollupWatermark(models.Model):
+    name = models.CharField(max_length=64, verbose_name="Name of the rolled up table", primary_key=True)
+    last_id = models.BigIntegerField(verbose_name="Highest id that is part of the rollup", default=0)
+    updated = models.DateTimeField(verbose_name="Time of the last rollup run", default=timezone.now)
+
+    def __repr__(self):
+        return f"{self.name}: {self.last_id}"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class ImageLink(models.Model):
+    digest = models.CharField(max_length=64, verbose_name="sha256 of the image content", primary_key=True)
+    url = models.URLField(max_length=1024, verbose_name="Attachment url of the uploaded image")
+    channel_id = models.BigIntegerField(verbose_name="Channel the image was uploaded to")
+    message_id = models.BigIntegerField(verbose_name="Message the image is attached to", db_index=True)
+    time_stamp = models.DateTimeField(verbose_name="Time of the upload", default=timezone.now)
+
+    def __repr__(self):
+        return f"{self.digest[:8]}: {self.url}"
+
+    def __str__(self):
+        return self.__repr__()
+
+
 class Error(models.Model):
     g = models.ForeignKey(DBGuild, on_delete=models.CASCADE, verbose_name="Guild where error happened", null=True)
     cmd_string = models.CharField(max_length=2048, verbose_name="Command string that was executed")
@@ -194,8 +286,32 @@ class Error(models.Model):
     time_stamp = models.DateTimeField(verbose_name="Time of error.", default=timezone.now)
     traceback = models.CharField(verbose_name="Traceback of error", default=None, null=True, max_length=15000)
 
+    class Meta:
+        indexes = [models.Index(fields=['time_stamp', 'id'], name='error_time_stamp_idx')]
+
     def __repr__(self):
         return f"{self.error} on {self.g.name}"
 
     def __str__(self):
         return self.__repr__()
+
+
+class ErrorAggregate(models.Model):
+    fingerprint = models.CharField(max_length=40, verbose_name="Hash of error type and normalized traceback",
+                                   unique=True)
+    g = models.ForeignKey(DBGuild, on_delete=models.SET_NULL, verbose_name="Guild of the last occurrence",
+                          null=True)
+    cmd_string = models.CharField(max_length=2048, verbose_name="Command string of the last occurrence")
+    error_type = models.CharField(max_length=256, verbose_name="Error type")
+    error = models.CharField(max_length=5000, verbose_name="Error string of the last occurrence")
+    traceback = models.CharField(verbose_name="Traceback of error", default=None, null=True, max_length=15000)
+    count = models.BigIntegerField(verbose_name="Number of occurrences", default=0)
+    first_seen = models.DateTimeField(verbose_name="Time of the first occurrence", default=timezone.now)
+    last_seen = models.DateTimeField(verbose_name="Time of the last occurrence", default=timezone.now,
+                                     db_index=True)
+
+    def __repr__(self):
+        return f"{self.error_type} x{self.count}"
+
+    def __str__(self):
+        return self.__repr__()
@@ -1,10 +1,15 @@
 import asyncio
 
-from discord import Embed, Message, Reaction, Member, NotFound
+from discord import Embed, Message, NotFound
 from discord.ext.commands import HelpCommand, Command, Cog, Bot
-from typing import Union, List
+from typing import Union, List, Dict, Tuple
 
+from discord_handler.base.cog_interface import ICog
 from discord_handler.helper import emojiList
+from discord_handler.interactions import get_router, seed_reactions
+from discord_handler.permissions import AuthorState
+
+LEVELS = [AuthorState.User, AuthorState.Mod, AuthorState.Owner, AuthorState.BotOwner]
 
 
 class HelpObj():
@@ -82,6 +87,60 @@ class EmbedPaginator():
         self._help_description = value
 
 
+class HelpIndex:
+    """
+    Help tree compiled once per extension (re)load. Holds the visible cogs and commands for every AuthorState
+    and the rendered pages per (level, cog, command), so serving help needs no permission checks per command.
+    """
+
+    def __init__(self):
+        self._cogs: Dict[int, List[Cog]] = {}
+        self._commands: Dict[Tuple[int, str], List[Command]] = {}
+        self._pages: Dict[tuple, Tuple[Embed, Union[Dict[str, HelpObj], None]]] = {}
+        self._compiled = False
+
+    def invalidate(self):
+        self._cogs.clear()
+        self._commands.clear()
+        self._pages.clear()
+        self._compiled = False
+
+    def compile(self, bot: Bot):
+        self.invalidate()
+        cogs = sorted(bot.cogs.values(), key=lambda i: i.qualified_name)
+        for level in LEVELS:
+            visible = []
+            for cog in cogs:
+                if getattr(cog, 'min_perm', AuthorState.User) > level:
+                    continue
+                commands = sorted([i for i in cog.get_commands() if not i.hidden], key=lambda i: i.name)
+                self._commands[(level, cog.qualified_name)] = commands
+                if commands:
+                    visible.append(cog)
+            self._cogs[level] = visible
+        self._compiled = True
+
+    def cogs(self, bot: Bot, level: int) -> List[Cog]:
+        if not self._compiled:
+            self.compile(bot)
+        return self._cogs.get(level, [])
+
+    def commands(self, bot: Bot, level: int, cog: Cog) -> List[Command]:
+        if not self._compiled:
+            self.compile(bot)
+        return self._commands.get((level, cog.qualified_name), [])
+
+    def page(self, key: tuple):
+        return self._pages.get(key)
+
+    def set_page(self, key: tuple, page: Tuple[Embed, Union[Dict[str, HelpObj], None]]):
+        self._pages[key] = page
+        return page
+
+
+help_index = HelpIndex()
+
+
 class CustHelp(HelpCommand):
     def __init__(self, **options):
         self.width = options.pop('width', 130)
@@ -141,12 +200,8 @@ class CustHelp(HelpCommand):
         else:
             self.paginator.add_command(commands)
 
-    async def send_pages(self, bot: Union[None, Bot], command_only=False):
-        """A helper utility to send the page output from :attr:`paginator` to the destination."""
-        if not self.show:
-            return
-
-        destination = self.get_destination()
+    def render_page(self, command_only=False) -> Tuple[Embed, Union[Dict[str, HelpObj], None]]:
+        """Renders the :attr:`paginator` into an embed and the emoji options of the page."""
         e = Embed(title="`Bot Help`", description=self.paginator.help_description)
         options = None
         if command_only:
@@ -168,7 +223,20 @@ class CustHelp(HelpCommand):
                     help_text = "**No help available**"
                 e.add_field(name=f"{page.emoji}" + page.name, value=help_text, inline=False)
                 options[page.emoji] = page
+        self.paginator.clear()
+        return e, options
+
+    async def send_pages(self, bot: Union[None, Bot], command_only=False,
+                         page: Tuple[Embed, Union[Dict[str, HelpObj], None]] = None):
+        """A helper utility to send the page output from :attr:`paginator` to the destination."""
+        if not self.show:
+            return
 
+        destination = self.get_destination()
+        e, options = page if page is not None else self.render_page(command_only)
+        # cached embeds are shared, the prefix dependent footer goes on a copy
+        e = e.copy()
+        if not command_only:
             e.set_footer(text=f"Type {self.clean_prefix}help on any element or click the associated emoji for "
                               f"detailed help.")
 
@@ -176,18 +244,10 @@ class CustHelp(HelpCommand):
             await destination.send(embed=e)
         else:
             msg: Message = await destination.send(embed=e)
-            for i in options.keys():
-                await msg.add_reaction(i)
-
-            def check(reaction: Reaction, user: Member):
-                if user.bot:
-                    return False
-                return reaction.emoji in list(options.keys()) and reaction.message.id == msg.id
-
+            seeding = seed_reactions(msg, list(options.keys()))
             try:
-                reaction, _ = await bot.wait_for('reaction_add', check=check,
-                                                 timeout=120)
-                option = options[reaction.emoji]
+                reaction, _ = await get_router(bot).wait_reaction(msg, options.keys(), timeout=120)
+                option = options[str(reaction.emoji)]
                 self.paginator.clear()
                 await msg.delete()
                 if isinstance(option.obj, Cog):
@@ -198,6 +258,7 @@ class CustHelp(HelpCommand):
             except asyncio.TimeoutError as e:
                 pass
             finally:
+                seeding.cancel()
                 try:
                     await msg.delete()
                 except NotFound:
@@ -207,48 +268,42 @@ class CustHelp(HelpCommand):
         ctx = self.context
         return ctx.channel
 
-    async def send_bot_help(self, mapping):
+    async def get_level(self) -> int:
+        """Resolves the AuthorState of the author once, through the invocation state of the context."""
         ctx = self.context
-        bot = ctx.bot
-
-        no_category = '\u200b{0.no_category}:'.format(self)
-
-        def get_category(command: Command, *, no_category=no_category):
-            cog = command.cog
-            return cog
-            # return cog.qualified_name + ':' if cog is not None else no_category
-
-        filtered = await self.filter_commands(bot.commands, sort=True)
+        for cog in ctx.bot.cogs.values():
+            if isinstance(cog, ICog):
+                invocation = await cog.get_invocation(ctx)
+                return invocation.perm if invocation is not None else 0
+        return AuthorState.User
 
-        # Now we can add the commands to the page.
-        cogs = []
-        for i in bot.commands:
-            cog = get_category(i)
-            if cog is None:
-                continue
-            if await cog.cog_check(ctx):
-                cogs.append(cog)
-        cogs = list(set(cogs))
-        self.add_indented_commands(cogs)
-
-        self.paginator.help_description = "Below you can see all available categories you have access to."
-
-        await self.send_pages(bot)
+    async def send_bot_help(self, mapping):
+        bot = self.context.bot
+        level = await self.get_level()
+        key = ('bot', level)
+        page = help_index.page(key)
+        if page is None:
+            self.add_indented_commands(help_index.cogs(bot, level))
+            self.paginator.help_description = "Below you can see all available categories you have access to."
+            page = help_index.set_page(key, self.render_page())
+        await self.send_pages(bot, page=page)
 
     async def send_command_help(self, command):
-        help_description = f"`{self.clean_prefix}{command.qualified_name}`"
-        self.paginator.help_description = help_description
-        self.paginator.add_command(command)
-        await self.send_pages(None, True)
+        # the signature contains the prefix
+        key = ('command', command.qualified_name, self.clean_prefix)
+        page = help_index.page(key)
+        if page is None:
+            self.paginator.help_description = f"`{self.clean_prefix}{command.qualified_name}`"
+            self.paginator.add_command(command)
+            page = help_index.set_page(key, self.render_page(True))
+        await self.send_pages(None, True, page=page)
 
     async def send_cog_help(self, cog):
-        if cog.description:
-            help_description = f"Available commands:"
-            self.paginator.help_description = help_description
-        else:
+        level = await self.get_level()
+        key = ('cog', level, cog.qualified_name)
+        page = help_index.page(key)
+        if page is None:
             self.paginator.help_description = f"Available commands:"
-
-        filtered = await self.filter_commands(cog.get_commands(), sort=self.sort_commands)
-        self.add_indented_commands(filtered)
-
-        await self.send_pages(cog.bot)
+            self.add_indented_commands(help_index.commands(cog.bot, level, cog))
+            page = help_index.set_page(key, self.render_page())
+        await self.send_pages(cog.bot, page=page)
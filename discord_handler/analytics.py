@@ -0,0 +1,245 @@
+import asyncio
+import datetime
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Awaitable, Callable, Dict, Iterator, Tuple, Union
+
+from discord_handler.db_async import spawn
+
+logger = logging.getLogger(__name__)
+
+PLOT_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'plots')
+ANALYTICS_PROCESSES = 2
+CHUNK_SIZE = 20000
+# rendered charts are reused for this many seconds, the window of a chart moves on after that
+CHART_TTL = 15 * 60
+TOP_COMMANDS = 10
+STACKED_COMMANDS = 5
+
+
+# --- runs in the analytics processes ---
+
+def _init_worker(settings_module: str):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    import django
+    django.setup()
+
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _frames(queryset, fields: Tuple[str, ...]) -> Iterator['pd.DataFrame']:
+    """
+    Streams the rows of queryset as data frames of CHUNK_SIZE rows, so a window never has to fit in memory
+    as model instances. Timestamps are converted to the current time zone, like the rollups.
+    """
+    import pandas as pd
+    from django.utils import timezone
+
+    rows = queryset.values_list(*fields).iterator(chunk_size=CHUNK_SIZE)
+    while True:
+        chunk = list(islice(rows, CHUNK_SIZE))
+        if not chunk:
+            return
+        frame = pd.DataFrame.from_records(chunk, columns=fields)
+        frame['day'] = pd.to_datetime(frame['timestamp'], utc=True) \
+            .dt.tz_convert(timezone.get_current_timezone_name()).dt.floor('D')
+        yield frame
+
+
+def _since(nr_of_days: int) -> datetime.datetime:
+    from django.utils import timezone
+    return timezone.now() - datetime.timedelta(days=nr_of_days)
+
+
+def command_counts(nr_of_days: int) -> 'pd.Series':
+    """
+    Invocations per day and command of the last nr_of_days days.
+    """
+    import pandas as pd
+    from db.models import CommandStats
+
+    parts = [frame.groupby(['day', 'command_id']).size()
+             for frame in _frames(CommandStats.objects.filter(timestamp__gte=_since(nr_of_days)),
+                                  ('timestamp', 'command_id'))]
+    if not parts:
+        return pd.Series(dtype='int64')
+    return pd.concat(parts).groupby(level=['day', 'command_id']).sum()
+
+
+def guild_counts(nr_of_days: int) -> 'pd.DataFrame':
+    """
+    Guilds joined and left per day and the total at the end of the day.
+    """
+    import pandas as pd
+    from db.models import GuildStats
+
+    parts = []
+    for frame in _frames(GuildStats.objects.filter(timestamp__gte=_since(nr_of_days)).order_by('id'),
+                         ('timestamp', 'count', 'total_count')):
+        frame['joined'] = (frame['count'] > 0).astype('int64')
+        frame['left'] = (frame['count'] < 0).astype('int64')
+        parts.append(frame.groupby('day').agg({'joined': 'sum', 'left': 'sum', 'total_count': 'last'}))
+    if not parts:
+        return pd.DataFrame(columns=['joined', 'left', 'total_count'])
+    # chunks are ordered by id, so the last total of a day is the one of the last chunk
+    return pd.concat(parts).groupby(level=0).agg({'joined': 'sum', 'left': 'sum', 'total_count': 'last'})
+
+
+def _save(fig, name: str, nr_of_days: int) -> str:
+    import matplotlib.pyplot as plt
+
+    os.makedirs(PLOT_DIR, exist_ok=True)
+    file = os.path.join(PLOT_DIR, f"{name}_{nr_of_days}_{int(time.time() * 1000)}.png")
+    fig.tight_layout()
+    fig.savefig(file, dpi=100)
+    plt.close(fig)
+    return file
+
+
+def render_commands_per_day(nr_of_days: int) -> str:
+    import matplotlib.pyplot as plt
+
+    counts = command_counts(nr_of_days)
+    fig, ax = plt.subplots(figsize=(10, 5))
+    if counts.empty:
+        ax.text(0.5, 0.5, "No commands in this timeframe", ha='center', va='center')
+    else:
+        per_day = counts.unstack('command_id', fill_value=0)
+        top = per_day.sum().nlargest(STACKED_COMMANDS).index
+        stacked = per_day[top].copy()
+        stacked['other'] = per_day.drop(columns=top).sum(axis=1)
+        stacked.index = stacked.index.strftime('%Y-%m-%d')
+        stacked.plot.bar(stacked=True, ax=ax)
+        ax.legend(title="command")
+        ax.set_ylabel("Commands")
+    ax.set_title(f"Commands per day, last {nr_of_days} days")
+    return _save(fig, 'commands', nr_of_days)
+
+
+def render_top_commands(nr_of_days: int) -> str:
+    import matplotlib.pyplot as plt
+
+    counts = command_counts(nr_of_days)
+    fig, ax = plt.subplots(figsize=(10, 5))
+    if counts.empty:
+        ax.text(0.5, 0.5, "No commands in this timeframe", ha='center', va='center')
+    else:
+        counts.groupby('command_id').sum().nlargest(TOP_COMMANDS).sort_values().plot.barh(ax=ax)
+        ax.set_xlabel("Commands")
+        ax.set_ylabel("")
+    ax.set_title(f"Top commands, last {nr_of_days} days")
+    return _save(fig, 'top', nr_of_days)
+
+
+def render_guild_growth(nr_of_days: int) -> str:
+    import matplotlib.pyplot as plt
+
+    counts = guild_counts(nr_of_days)
+    fig, ax = plt.subplots(figsize=(10, 5))
+    if counts.empty:
+        ax.text(0.5, 0.5, "No guild joins or leaves in this timeframe", ha='center', va='center')
+    else:
+        ax.bar(counts.index, counts['joined'], color='tab:green', label='joined')
+        ax.bar(counts.index, -counts['left'], color='tab:red', label='left')
+        ax.set_ylabel("Guilds per day")
+        total = ax.twinx()
+        total.plot(counts.index, counts['total_count'], color='tab:blue', label='total')
+        total.set_ylabel("Total guilds")
+        ax.legend(loc='upper left')
+        fig.autofmt_xdate()
+    ax.set_title(f"Guild growth, last {nr_of_days} days")
+    return _save(fig, 'guilds', nr_of_days)
+
+
+CHARTS: Dict[str, Callable[[int], str]] = {
+    'commands': render_commands_per_day,
+    'top': render_top_commands,
+    'guilds': render_guild_growth,
+}
+
+
+# --- runs in the bot ---
+
+class ChartEntry:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.file: Union[str, None] = None
+        self.url: Union[str, None] = None
+
+
+class Analytics:
+    """
+    Renders the stats charts in a process pool, so neither the queries nor pandas and matplotlib run on the
+    event loop or block the db threads. Charts are cached per chart, number of days and CHART_TTL window.
+    Concurrent requests for the same chart share one render and one upload.
+    """
+
+    def __init__(self, processes: int = ANALYTICS_PROCESSES, ttl: float = CHART_TTL):
+        self.processes = processes
+        self.ttl = ttl
+        self._pool: Union[ProcessPoolExecutor, None] = None
+        self._cache: Dict[Tuple[str, int, int], ChartEntry] = {}
+        self.renders = 0
+        self.hits = 0
+
+    def get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn instead of fork, the bot process has threads and open db connections
+            self._pool = ProcessPoolExecutor(max_workers=self.processes,
+                                             mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_init_worker,
+                                             initargs=(os.environ.get("DJANGO_SETTINGS_MODULE", "settings"),))
+        return self._pool
+
+    def _expire(self, window: int):
+        # renders still running don't know their file yet and commands may still wait for them, they are expired
+        # by a later call
+        for key in [k for k, v in self._cache.items() if k[2] != window and v.task.done()]:
+            entry = self._cache.pop(key)
+            if entry.file is not None and os.path.exists(entry.file):
+                os.remove(entry.file)
+
+    async def _render(self, entry: ChartEntry, name: str, nr_of_days: int,
+                      publish: Callable[[str], Awaitable[Union[str, None]]]):
+        loop = asyncio.get_event_loop()
+        entry.file = await loop.run_in_executor(self.get_pool(), CHARTS[name], nr_of_days)
+        self.renders += 1
+        entry.url = await publish(entry.file)
+
+    async def chart(self, name: str, nr_of_days: int,
+                    publish: Callable[[str], Awaitable[Union[str, None]]]) -> Tuple[str, Union[str, None]]:
+        """
+        :param name: one of CHARTS
+        :param publish: coroutine function uploading the png and returning its url, i.e. BotOwner.get_image_link
+        :return: path of the png and its url, None if it couldn't be published
+        """
+        if name not in CHARTS:
+            raise KeyError(name)
+
+        window = int(time.time() // self.ttl)
+        self._expire(window)
+        key = (name, nr_of_days, window)
+        entry = self._cache.get(key)
+        if entry is not None and not (entry.task.done() and entry.task.exception() is not None):
+            self.hits += 1
+        else:
+            entry = ChartEntry(None)
+            entry.task = spawn(self._render(entry, name, nr_of_days, publish))
+            self._cache[key] = entry
+
+        # shield, so a cancelled command doesn't cancel the render other commands wait for
+        await asyncio.shield(entry.task)
+        return entry.file, entry.url
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+
+analytics = Analytics()
@@ -5,22 +5,28 @@ from discord import Member, Guild
 from discord.ext.commands.errors import *
 from discord.errors import Forbidden
 
-from discord_handler.helper import add_guild, get_user, send_pm
+from discord_handler.command_stats import command_stats
+from discord_handler.error_aggregator import error_aggregator
+from discord_handler.helper import send_pm, a_add_guild, a_get_guild, a_get_user
+from discord_handler.metrics import metrics
+from discord_handler.permissions import AuthorState, permissions
 
-from db import models
-from db.models import DBGuild, DBUser, Error
+from db.models import DBGuild, DBUser
 import traceback
-from typing import Union, TYPE_CHECKING
+from typing import Union
 
-if TYPE_CHECKING:
-    from discord_handler.cogs.cog_bot_owner import DBotOwner
 
+class Invocation:
+    """
+    State of a single command invocation. Resolved once per Context and shared by cog_check,
+    cog_before_invoke and the command itself, so concurrent commands never see each others state.
+    """
 
-class AuthorState:
-    User = 1
-    Mod = 3
-    Owner = 4
-    BotOwner = 5
+    def __init__(self, g: DBGuild, u: DBUser, m: Union[Member, None], perm: int):
+        self.g = g
+        self.u = u
+        self.m = m
+        self.perm = perm
 
 
 class ICog(Cog):
@@ -29,26 +35,48 @@ class ICog(Cog):
         self.min_perm = min_perm
 
     async def cog_check(self, ctx):
+        # the help command checks the commands of every cog, only the invoked command is measured
+        if ctx.command is not None and ctx.command.cog is self:
+            metrics.start_command(ctx)
         perm = await self.a_perm(ctx)
         return perm >= self.min_perm
 
-    async def notify_error_bot_owner(self, e: Error, ctx: Union[Context, Guild]):
-        bot_owner: 'DBotOwner' = self.bot.get_cog('DBotOwner')
-        if isinstance(ctx, Context):
-            await bot_owner.send_error_notification(e, ctx.guild)
-        elif isinstance(ctx, Guild):
-            await bot_owner.send_error_notification(e, ctx)
-
-    async def cog_command_error(self, ctx: Union[Context, Guild], error: CommandError):
-        g_id = ctx.guild.id if isinstance(ctx, Context) else ctx.id
-        g_name = ctx.guild.name if isinstance(ctx, Context) else ctx.name
+    async def get_invocation(self, ctx: Context) -> Union[Invocation, None]:
+        """
+        Returns the invocation state attached to the context, resolving it on first use.
+        :param ctx: Context of the command
+        :return: Invocation or None if the command was not used on a guild
+        """
+        invocation = getattr(ctx, 'invocation', None)
+        if invocation is not None:
+            return invocation
+
+        if ctx.guild is None:
+            return None
+
+        g = await a_get_guild(ctx.guild)
+        u = await a_get_user(ctx.author, g)
+        m = ctx.author
         try:
-            g = DBGuild.objects.get(g_id=g_id)
-            g.name = g_name
-        except DBGuild.DoesNotExist:
-            g = DBGuild(id=g_id, name=g_name)
+            perm = await self.a_perm_intern(u, m)
+        except AttributeError:
+            m = None
+            perm = AuthorState.User
 
-        g.save()
+        ctx.invocation = Invocation(g, u, m, perm)
+        return ctx.invocation
+
+    async def report_error(self, ctx: Union[Context, Guild, None], cmd_string: str, error_type: str, error: str,
+                           tb: Union[str, None]):
+        """
+        Hands an error to the aggregator, which stores and notifies per fingerprint instead of per error.
+        """
+        guild = ctx.guild if isinstance(ctx, Context) else ctx
+        await error_aggregator.report(guild.id if guild is not None else None, cmd_string, error_type, error, tb)
+
+    async def cog_command_error(self, ctx: Union[Context, Guild], error: CommandError):
+        # commands failing their checks never reach cog_after_invoke
+        metrics.end_command(ctx, failed=True)
 
         if isinstance(error, CheckFailure):
             if isinstance(error, BotMissingPermissions):
@@ -62,12 +90,8 @@ class ICog(Cog):
                 me = guild.me if guild is not None else ctx.bot.user
                 permissions = ctx.channel.permissions_for(me)
 
-                e = Error(g=g, cmd_string=ctx.message.system_content
-                          , error_type=f'{type(error)}', error=f'{error}', traceback=f"Has : "
-                                                                                     f"{permissions}\n\nNeeds: "
-                                                                                     f"{error.missing_perms}")
-                e.save()
-                await self.notify_error_bot_owner(e, ctx)
+                await self.report_error(ctx, ctx.message.system_content, f'{type(error)}', f'{error}',
+                                        f"Has : {permissions}\n\nNeeds: {error.missing_perms}")
             else:
                 await ctx.send('** Error **: You are not allowed to use this command!')
         elif isinstance(error, MissingRequiredArgument):
@@ -100,92 +124,45 @@ class ICog(Cog):
                 await ctx.send(text)
             except Forbidden:
                 try:
-                    await send_pm(self.bot, get_user(ctx.author), text)
+                    await send_pm(self.bot, await a_get_user(ctx.author), text)
                 except Forbidden:
                     pass
 
-                e = Error(g=g, cmd_string=ctx.message.system_content
-                          , error_type=f'{type(error.original)}', error=f'{error}', traceback=traceback.format_exc())
-                e.save()
-                await self.notify_error_bot_owner(e, ctx)
+                await self.report_error(ctx, ctx.message.system_content, f'{type(error.original)}', f'{error}',
+                                        traceback.format_exc())
         elif isinstance(error.original, asyncio.TimeoutError):
             await ctx.send("Timeout")
         else:
-            e = Error(g=g, cmd_string=ctx.message.system_content
-                      , error_type=f'{type(error.original)}', error=f'{error}', traceback=traceback.format_exc())
-            e.save()
-            await self.notify_error_bot_owner(e, ctx)
+            await self.report_error(ctx, ctx.message.system_content, f'{type(error.original)}', f'{error}',
+                                    traceback.format_exc())
             await ctx.send(f'An error has occured. If this persists, please notify the bot owner.')
 
     async def cog_before_invoke(self, ctx: Context):
-        add_guild(ctx)
-        self.g = DBGuild.objects.get(g_id=ctx.guild.id)
-        self.m: Member = ctx.author
-        self.u: DBUser = get_user(ctx.author)
-        try:
-            self.u_perm_state = await self.a_perm_intern(self.u, self.m)
-        except AttributeError:
-            self.m = None
-            self.u_perm_state = AuthorState.User
-
-        try:
-            cog = models.Cog.objects.get(name=ctx.cog.qualified_name)
-        except models.Cog.DoesNotExist:
-            cog = models.Cog(name=ctx.cog.qualified_name)
-            cog.save()
-
-        try:
-            command = models.Command.objects.get(cog=cog, name=ctx.command.name)
-        except models.Command.DoesNotExist:
-            command = models.Command(cog=cog, name=ctx.command.name)
-            command.save()
+        metrics.start_command(ctx)
+        invocation = await self.get_invocation(ctx)
+        command_stats.add(ctx, invocation.g, invocation.u)
 
-        models.CommandStats(g=self.g, command=command, user=self.u, parameters=" ".join(
-            [f"{ctx.command.clean_params[i]}" for i in ctx.command.clean_params.keys()])).save()
+    async def cog_after_invoke(self, ctx: Context):
+        metrics.end_command(ctx)
 
     async def a_perm(self, ctx: Context):
-        if not add_guild(ctx):
+        invocation = await self.get_invocation(ctx)
+        if invocation is None:
             return False
-        g = DBGuild.objects.get(g_id=ctx.guild.id)
-        u = get_user(ctx.author, g)
-        member = ctx.author
-        return await self.a_perm_intern(u, member)
+        return invocation.perm
 
     async def a_perm_intern(self, u: DBUser, member: Member):
-        if await self.is_bot_owner(member):
-            return AuthorState.BotOwner
-        elif await  self.is_admin(member):
-            return AuthorState.Owner
-        elif await self.is_mod(u, member):
-            return AuthorState.Mod
-        else:
-            return AuthorState.User
+        return await permissions.resolve(u, member)
 
     async def is_admin(self, member: Member):
-        return member.guild_permissions.administrator or member.guild_permissions.manage_roles
+        return permissions.is_admin(member)
 
     async def is_bot_owner(self, member: Member):
-        if member is None:
-            return False
-        bot_owner: 'DBotOwner' = self.bot.get_cog('DBotOwner')
-        return member.id in bot_owner.bot_owner_id
+        return permissions.is_bot_owner(member)
 
     async def is_mod(self, u: DBUser, member: Member):
-        if u is not None:
-            mod_role = u.g.m_role()
-            mod_flag = u.g_mod
-            if mod_role is not None and member is not None:
-                role_ids = [i.id for i in member.roles]
-                mod_role = len([i for i in mod_role if i in role_ids]) > 0
-            else:
-                mod_role = False
-
-            mod = mod_flag or mod_role
-        else:
-            mod = False
-
-        return mod or member.guild_permissions.ban_members
+        return await permissions.is_mod(u, member)
 
     @Cog.listener()
     async def on_guild_join(self, guild: Guild):
-        add_guild(guild)
+        await a_add_guild(guild)
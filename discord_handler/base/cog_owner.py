@@ -4,9 +4,11 @@ import re
 from typing import Union, Tuple
 import os
 
-from db.models import DBUser
+from db.models import DBUser, DBGuild
 from discord_handler.base.cog_interface import ICog, AuthorState
+from discord_handler.db_async import run_db
 from discord_handler.helper import get_user
+from discord_handler.prefix_cache import prefix_cache
 
 path = os.path.dirname(os.path.realpath(__file__)) + "/../../"
 
@@ -15,7 +17,10 @@ class BaseOwner(ICog):
     def __init__(self, bot: Bot):
         super().__init__(bot, AuthorState.Owner)
 
-    def get_user(self, ctx: Context, u_id: Union[int, str]) -> Tuple[DBUser, Member]:
+    async def get_user(self, ctx: Context, u_id: Union[int, str]) -> Tuple[DBUser, Member]:
+        return await run_db(self._get_user, ctx, ctx.invocation.g, u_id)
+
+    def _get_user(self, ctx: Context, g: DBGuild, u_id: Union[int, str]) -> Tuple[DBUser, Member]:
 
         m = None
         u_id = int(re.findall(r"\d+", u_id)[0]) if isinstance(u_id, str) else u_id
@@ -26,12 +31,12 @@ class BaseOwner(ICog):
                 break
 
         if m is not None:
-            u = get_user(m, self.g)
+            u = get_user(m, g)
         else:
             try:
-                u = DBUser.objects.get(u_id=u_id, g=self.g)
+                u = DBUser.objects.get(u_id=u_id, g=g)
             except DBUser.DoesNotExist:
-                u = DBUser(u_id=u_id, g=self.g, u_name=m.display_name if m is not None else "")
+                u = DBUser(u_id=u_id, g=g, u_name=m.display_name if m is not None else "")
                 u.save()
 
         return u, m
@@ -41,9 +46,11 @@ class BaseOwner(ICog):
         help="Sets the prefix for the bot"
     )
     async def set_prefix(self, ctx: Context, prefix: str):
-        self.g.prefix = prefix
-        self.g.save()
-        await ctx.send(f"**Prefix has ben set to _{self.g.prefix}_**")
+        g = ctx.invocation.g
+        g.prefix = prefix
+        await run_db(g.save)
+        prefix_cache.set(g.g_id, prefix)
+        await ctx.send(f"**Prefix has ben set to _{g.prefix}_**")
 
     @command(
         name='add_mod',
@@ -55,9 +62,9 @@ class BaseOwner(ICog):
         if isinstance(user_id, Member):
             user_id = user_id.id
 
-        u, m = self.get_user(ctx, user_id)
+        u, m = await self.get_user(ctx, user_id)
         u.g_mod = False
-        u.save()
+        await run_db(u.save)
         await ctx.send(f":white_check_mark:**User {m.mention if m is not None else u.u_name}({u.u_id}) "
                        f"is now a mod!**")
 
@@ -78,8 +85,9 @@ class BaseOwner(ICog):
             await ctx.send(f"Sorry, {role_id} is not available as a role on the guild.")
             return
 
-        self.g.add_m_role(role_id)
-        self.g.save()
+        g = ctx.invocation.g
+        await run_db(g.add_m_role, role_id)
+        await run_db(g.save)
         await ctx.send(f":white_check_mark:**Users with {role.mention}({role.id}) role are now mods**")
 
     @command(
@@ -88,8 +96,9 @@ class BaseOwner(ICog):
         help='Removes **all** moderation roles that are set on the server. You can add new roles using add_mod_role '
     )
     async def rm_mod_role(self, ctx: Context):
-        self.g.mod_role = None
-        self.g.save()
+        g = ctx.invocation.g
+        g.mod_role = None
+        await run_db(g.save)
         await ctx.send(f":red_circle:**Removed mod role**")
 
     @command(
@@ -100,8 +109,8 @@ class BaseOwner(ICog):
              'role, he will still have moderation privileges!'
     )
     async def rm_mod(self, ctx: Context, user_id: Union[int, str]):
-        u, m = self.get_user(ctx, user_id)
+        u, m = await self.get_user(ctx, user_id)
         u.g_mod = False
-        u.save()
+        await run_db(u.save)
         await ctx.send(f":red_circle:**User {m.mention if m is not None else u.u_name}({u.u_id}) "
                        f"is no longer a mod!**")
\ No newline at end of file
@@ -1,23 +1,39 @@
 import json
 
 from discord.ext.commands import Bot, command, Context, Cog
-from discord import DMChannel, Member, File, Guild, TextChannel, Message, Attachment, Embed
-from discord.errors import Forbidden
-from typing import Union
+from discord import File, Guild, Message, Embed, RawMessageDeleteEvent, RawBulkMessageDeleteEvent
+from discord.errors import Forbidden, NotFound
+from typing import Union, Dict, List, Tuple
+from django.db.models import Q
 from django.utils import timezone
 import os
+import asyncio
 import datetime
-from texttable import Texttable
+from functools import partial
+import time
+from aiohttp import web
 from aiohttp.web import Request
 import logging
 
 from db.models import Error, GuildStats
 from discord_handler.base.cog_interface import AuthorState, ICog
-from discord_handler.helper import send_table, get_guild, get_user, send_pm
+from discord_handler.cluster import guild_count
+from discord_handler.error_aggregator import error_aggregator
+from discord_handler.image_cache import DEFAULT_MAX_AGE, image_links
+from discord_handler.notifications import DigestQueue
+from discord_handler.permissions import permissions
+from discord_handler.db_async import run_db
+from discord_handler.interactions import get_router, seed_reactions
+from discord_handler.metrics import metrics, CONTENT_TYPE
+from discord_handler.helper import send_table, send_pm, a_get_guild
 
 logger = logging.getLogger(__name__)
 path = os.path.dirname(os.path.realpath(__file__)) + "/../../"
 
+NEGATIVE_CACHE_TTL = 300
+ERROR_PAGE_SIZE = 5
+ERROR_PAGE_EMOJIS = ['◀', '▶']
+
 
 class BotOwner(ICog):
     def __init__(self, bot: Bot, d: dict):
@@ -27,6 +43,13 @@ class BotOwner(ICog):
         else:
             self.bot_owner_id = None
 
+        permissions.set_bot_owners(self.bot_owner_id)
+        image_links.max_age = d.get('image_link_max_age', DEFAULT_MAX_AGE)
+        error_aggregator.set_notifier(self.notify_error)
+        self.metrics_port = d.get('metrics_port')
+        self.metrics_host = d.get('metrics_host', '127.0.0.1')
+        self._metrics_runner: Union[web.AppRunner, None] = None
+
         if 'bot_owner_server' in d.keys():
             self.bot_owner_server = d['bot_owner_server']
         else:
@@ -62,111 +85,279 @@ class BotOwner(ICog):
         else:
             self.bot_join_leave = None
 
-    async def get_image_link(self, image_path: str, ctx: Context = None) -> Union[str, None]:
+        self._failed_channels: Dict[int, float] = {}
+        self._owner_dm_channels: Dict[int, int] = {}
+
+        self.notifications = DigestQueue(bot, self.send_digest,
+                                         flush_interval=d.get('notification_flush_interval', 10),
+                                         max_backlog=d.get('notification_max_backlog', 1000))
+        self.notifications.set_interval(self.bot_owner_info_channel, d.get('error_flush_interval', 2))
+        self._setup_task = bot.loop.create_task(self.setup())
+
+    async def send_to_channel(self, channel_id: int, content: str = None, embed: Embed = None,
+                              file: File = None) -> dict:
+        """
+        Sends a message by channel id over REST. The bot owner server is only cached by the cluster holding its
+        shard, this works from every cluster and worker.
+        :return: message data
+        """
+        embed = embed.to_dict() if embed is not None else None
+        if file is None:
+            return await self.bot.http.send_message(channel_id, content, embed=embed)
         try:
-            if self.bot_owner_server is None:
-                raise KeyError()
-
-            owner_guild: Guild = [i for i in self.bot.guilds if i.id == self.bot_owner_server][0]
-            owner_channel: TextChannel = [i for i in owner_guild.channels if i.id == self.bot_owner_image_channel][0]
-            if ctx is not None:
-                try:
-                    msg = await owner_channel.send(file=File(image_path),
-                                                   content=f"Image requested by {ctx.author.display_name}, "
-                                                           f"at {ctx.message.created_at},"
-                                                           f"using the command {ctx.command} on {ctx.guild.name}.")
-                except:
-                    msg = await owner_channel.send(file=File(image_path))
-            else:
-                msg = await owner_channel.send(file=File(image_path))
-            att: Attachment = msg.attachments[0]
-            return att.url
-        except (KeyError, Forbidden) as e:
+            return await self.bot.http.send_files(channel_id, files=[file], content=content, embed=embed)
+        finally:
+            file.close()
+
+    def owner_channel_usable(self, channel_id: Union[int, None]) -> bool:
+        """
+        Channels of the bot owner server that could not be sent to are not tried again for NEGATIVE_CACHE_TTL
+        seconds.
+        """
+        return channel_id is not None and self.bot_owner_server is not None and \
+            self._failed_channels.get(channel_id, 0) <= time.monotonic()
+
+    def owner_channel_failed(self, channel_id: int):
+        self._failed_channels[channel_id] = time.monotonic() + NEGATIVE_CACHE_TTL
+
+    async def upload_image(self, image_path: str, ctx: Context = None) -> Union[Tuple[str, int, int], None]:
+        """
+        Uploads the image to the owner image channel.
+        :return: attachment url, channel id and message id, None if there is no image channel
+        """
+        channel_id = self.bot_owner_image_channel
+        if not self.owner_channel_usable(channel_id):
+            return None
+        content = None
+        if ctx is not None:
+            content = f"Image requested by {ctx.author.display_name}, at {ctx.message.created_at}," \
+                      f"using the command {ctx.command} on {ctx.guild.name if ctx.guild is not None else 'a DM'}."
+        try:
+            data = await self.send_to_channel(channel_id, content, file=File(image_path))
+        except (NotFound, Forbidden):
+            self.owner_channel_failed(channel_id)
             return None
+        return data['attachments'][0]['url'], channel_id, int(data['id'])
 
-    @command(
-        name='show_errors',
-        help='Shows all errors that occured in a given timeframe'
-    )
-    async def show_errors(self, ctx: Context, nr_of_days: int):
+    async def get_image_link(self, image_path: str, ctx: Context = None) -> Union[str, None]:
+        """
+        Returns an url of the image. Images are uploaded once per content, see ImageLinkCache.
+        """
+        return await image_links.get(image_path, lambda i: self.upload_image(i, ctx))
+
+    async def warm_image_links(self, image_paths: List[str]) -> Dict[str, Union[str, None]]:
+        """
+        Uploads known assets (i.e. card images) ahead of time, so their first use doesn't wait for an upload.
+        """
+        return await image_links.warm(image_paths, self.upload_image)
+
+    @staticmethod
+    def error_page(since: datetime.datetime, cursor: Union[Tuple[datetime.datetime, int], None]) \
+            -> Tuple[List[Error], bool]:
+        """
+        Loads one page of errors after cursor, using keyset pagination on (time_stamp, id).
+        :return: errors of the page and whether there is a next page
+        """
+        er = Error.objects.select_related('g').filter(time_stamp__gt=since)
+        if cursor is not None:
+            er = er.filter(Q(time_stamp__gt=cursor[0]) | Q(time_stamp=cursor[0], id__gt=cursor[1]))
+        er = list(er.order_by('time_stamp', 'id')[:ERROR_PAGE_SIZE + 1])
+        return er[:ERROR_PAGE_SIZE], len(er) > ERROR_PAGE_SIZE
+
+    def render_error_page(self, er: List[Error], page: int) -> str:
+        from texttable import Texttable
         table = Texttable()
         tabledata = [["Time", "Guild", "CMD string", "Error Type", "Error"]]
-        er = Error.objects.filter(time_stamp__gt=(timezone.now() + datetime.timedelta(-nr_of_days))).order_by(
-            'time_stamp')
         for i in er:
-            i: Error
             in_guild = None
-            for j in ctx.bot.guilds:
-                if j.id == i.g.g_id:
-                    in_guild = j.name
-            tabledata.append(
-                [f'{i.time_stamp.strftime("%Y-%m-%d %H:%M")}', in_guild, i.cmd_string, i.error_type, i.error])
+            if i.g_id is not None:
+                d_g = self.bot.get_guild(i.g_id)
+                in_guild = d_g.name if d_g is not None else i.g.name
+            tabledata.append([f'{i.time_stamp.strftime("%Y-%m-%d %H:%M")}', in_guild, i.cmd_string[:40],
+                              i.error_type[:30], i.error[:80]])
         table.set_deco(Texttable.VLINES | Texttable.HEADER | Texttable.BORDER)
         table.add_rows(tabledata, True)
         table.set_cols_width([16, 10, 20, 15, 40])
-        txt = "```" + table.draw() + "```"
-        await send_table(ctx.send, txt)
+        return f"**Page {page + 1}**```" + table.draw()[:1900] + "```"
 
-    async def send_error_notification(self, e: Error, guild: Guild):
-        text = f":exclamation: An error occured on {guild.name} ({guild.id}): @here:exclamation: \n\n" \
-               f"_cmd string_: {e.cmd_string}\n" \
-               f"_error type_: {e.error_type}\n" \
-               f"_error_: {e.error}\n" \
-               f"_time stamp_: {e.time_stamp}\n" \
-               f"_traceback_: {e.traceback}\n"
+    @command(
+        name='show_errors',
+        help='Shows all errors that occured in a given timeframe'
+    )
+    async def show_errors(self, ctx: Context, nr_of_days: int):
+        since = timezone.now() + datetime.timedelta(-nr_of_days)
+        cursors = [None]
+        er, has_next = await run_db(self.error_page, since, None)
+        if len(er) == 0:
+            await ctx.send("No errors in this timeframe.")
+            return
 
-        await self.send_update(text, self.bot_owner_info_channel, guild, True)
+        msg: Message = await ctx.send(self.render_error_page(er, 0))
+        if not has_next:
+            return
+
+        seeding = seed_reactions(msg, ERROR_PAGE_EMOJIS)
+
+        while True:
+            try:
+                reaction, user = await get_router(self.bot).wait_reaction(msg, ERROR_PAGE_EMOJIS, ctx.author.id,
+                                                                          timeout=120)
+            except asyncio.TimeoutError:
+                break
+
+            try:
+                await msg.remove_reaction(reaction.emoji, user)
+            except Forbidden:
+                pass
+
+            if str(reaction.emoji) == ERROR_PAGE_EMOJIS[1] and has_next:
+                cursors.append((er[-1].time_stamp, er[-1].id))
+            elif str(reaction.emoji) == ERROR_PAGE_EMOJIS[0] and len(cursors) > 1:
+                cursors.pop()
+            else:
+                continue
+
+            er, has_next = await run_db(self.error_page, since, cursors[-1])
+            await msg.edit(content=self.render_error_page(er, len(cursors) - 1))
+
+        seeding.cancel()
+        try:
+            await msg.clear_reactions()
+        except Forbidden:
+            pass
+
+    async def send_error_notification(self, e: Error, guild: Union[Guild, None], occurrences: int = None):
+        where = f"{guild.name} ({guild.id})" if guild is not None else "no guild"
+        if occurrences is None:
+            text = f":exclamation: An error occured on {where}: @here:exclamation: \n\n"
+        else:
+            text = f":exclamation: Error rate went up: {occurrences} times in the last " \
+                   f"{error_aggregator.interval}s, last on {where}: @here:exclamation: \n\n"
+        text += f"_cmd string_: {e.cmd_string}\n" \
+                f"_error type_: {e.error_type}\n" \
+                f"_error_: {e.error}\n" \
+                f"_time stamp_: {e.time_stamp}\n" \
+                f"_traceback_: {e.traceback}\n"
+
+        await self.notify(text, self.bot_owner_info_channel, guild, True)
+
+    async def notify_error(self, e: Error, g_id: Union[int, None], occurrences: Union[int, None]):
+        await self.send_error_notification(e, self.bot.get_guild(g_id) if g_id is not None else None, occurrences)
 
     @Cog.listener()
     async def on_guild_join(self, guild: Guild):
         text = f"✅{guild.me.mention} was added by `{guild.name}({guild.id})`. Member count: `{guild.member_count}`✅"
         await self.send_update(text, self.bot_join_leave, guild)
 
-        g = get_guild(guild)
-        GuildStats(g_joined=g, count=1, total_count=len(self.bot.guilds)).save()
+        g = await a_get_guild(guild)
+        await run_db(GuildStats(g_joined=g, count=1, total_count=guild_count(self.bot)).save)
 
     @Cog.listener()
     async def on_guild_remove(self, guild: Guild):
         text = f"❌{guild.me.mention} was removed from `{guild.name}({guild.id})`. Member count: `{guild.member_count}`❌"
         await self.send_update(text, self.bot_join_leave, guild)
-        g = get_guild(guild)
+        g = await a_get_guild(guild)
 
         try:
-            related_guild_stat = GuildStats.objects.filter(g_joined=g).order_by('timestamp').last()
+            related_guild_stat = await run_db(GuildStats.objects.filter(g_joined=g).order_by('timestamp').last)
         except:
             related_guild_stat = None
 
-        GuildStats(g_left=g, related_object=related_guild_stat, count=-1, total_count=len(self.bot.guilds)).save()
+        await run_db(GuildStats(g_left=g, related_object=related_guild_stat, count=-1,
+                                total_count=guild_count(self.bot)).save)
 
     async def send_update(self, text: str, channel: int, guild: Union[Guild, None], always_send=False,
                           embed: Embed = None):
-        try:
-            if self.bot_owner_server is None or channel is None:
-                raise KeyError()
+        if guild is not None and guild.id == self.bot_owner_server and not always_send:
+            return
 
-            if guild is not None and guild.id == self.bot_owner_server and not always_send:
+        if self.owner_channel_usable(channel):
+            try:
+                await send_table(partial(self.send_to_channel, channel), text, False, embed=embed)
                 return
+            except (NotFound, Forbidden):
+                self.owner_channel_failed(channel)
+        await self.send_to_owners(text)
+
+    async def send_to_owners(self, text: str):
+        """
+        Sends the text to every bot owner as a DM, if there is no owner channel to send it to.
+        """
+        for bot_owner in self.bot_owner_id or []:
+            try:
+                dm_id = self._owner_dm_channels.get(bot_owner)
+                if dm_id is None:
+                    dm_id = int((await self.bot.http.start_private_message(bot_owner))['id'])
+                    self._owner_dm_channels[bot_owner] = dm_id
+                await send_table(partial(self.send_to_channel, dm_id), text, False)
+            except (NotFound, Forbidden):
+                pass
+
+    async def notify(self, text: str, channel: int, guild: Union[Guild, None], always_send=False,
+                     embed: Embed = None):
+        """
+        Queues a notification for the next digest of the channel instead of sending it right away.
+        """
+        if guild is not None and guild.id == self.bot_owner_server and not always_send:
+            return
+        self.notifications.enqueue(channel, text, embed)
 
-            owner_guild: Guild = [i for i in self.bot.guilds if i.id == self.bot_owner_server][0]
-            owner_channel: TextChannel = [i for i in owner_guild.channels if i.id == channel][0]
-            await send_table(owner_channel.send, text, False, embed=embed)
-        except (KeyError, Forbidden) as e:
-            if self.bot_owner_id is not None:
-                for bot_owner in self.bot_owner_id:
-                    u: Member = self.bot.get_user(bot_owner)
-                    if u is not None:
-                        dm_channel: DMChannel = await u.create_dm()
-                        try:
-                            await send_table(dm_channel.send, text, False)
-                        except Forbidden:
-                            pass
+    async def send_digest(self, text: str, channel: int, embed: Embed = None):
+        await self.send_update(text, channel, None, True, embed=embed)
+
+    async def setup(self):
+        """
+        Loads the state of this process once the bot is ready. Not part of on_ready, in split mode only the
+        first worker dispatches it.
+        """
+        await self.bot.wait_until_ready()
+        await self.start_metrics_server()
+        await run_db(error_aggregator.load)
+        await run_db(image_links.load)
 
     @Cog.listener()
-    async def on_ready(self):
-        pass
+    async def on_raw_message_delete(self, payload: RawMessageDeleteEvent):
+        if payload.channel_id == self.bot_owner_image_channel:
+            await image_links.invalidate([payload.message_id])
+
+    @Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: RawBulkMessageDeleteEvent):
+        if payload.channel_id == self.bot_owner_image_channel:
+            await image_links.invalidate(payload.message_ids)
 
     async def handle_upvote(self, data):
         pass
 
-    async def handle(self, request: Request):
-        pass
+    async def handle(self, request: Request) -> web.Response:
+        return web.Response(body=metrics.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+    async def start_metrics_server(self):
+        """
+        Serves the metrics on /metrics if metrics_port is set in the secret file. Clusters listen on metrics_port
+        plus their cluster id.
+        """
+        if self.metrics_port is None or self._metrics_runner is not None:
+            return
+        cluster = getattr(self.bot, 'cluster', None)
+        port = self.metrics_port + (cluster.cluster_id if cluster is not None else 0)
+
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.metrics_host, port).start()
+        except OSError:
+            logger.exception(f"Can't serve the metrics on {self.metrics_host}:{port}")
+            await runner.cleanup()
+            return
+        self._metrics_runner = runner
+        metrics.start()
+        logger.info(f"Serving metrics on {self.metrics_host}:{port}/metrics")
+
+    def cog_unload(self):
+        self._setup_task.cancel()
+        metrics.stop()
+        if self._metrics_runner is not None:
+            asyncio.ensure_future(self._metrics_runner.cleanup())
+            self._metrics_runner = None
@@ -0,0 +1,327 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from typing import Callable, Dict, List, Tuple, Union
+
+from discord.ext.commands import Bot
+
+from discord_handler.wire import read_message, write_message
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CLUSTER_SOCKET = "/tmp/dbot_cluster.sock"
+# discord allows max_concurrency identifies per 5 seconds
+IDENTIFY_INTERVAL = 5
+
+
+def shard_ranges(shard_count: int, clusters: int) -> List[List[int]]:
+    """
+    Splits the shards into contiguous ranges, one per cluster, that differ by at most one shard in size.
+    """
+    clusters = min(clusters, shard_count)
+    size, rest = divmod(shard_count, clusters)
+    ranges = []
+    start = 0
+    for i in range(clusters):
+        end = start + size + (1 if i < rest else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+class ClusterProcess:
+    def __init__(self, cluster_id: int, shard_ids: List[int]):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.process: Union[multiprocessing.Process, None] = None
+        self.started = 0.0
+        self.restarts = 0
+        self.restart_delay = 0.0
+        self.restart_at: Union[float, None] = None
+
+
+class ClusterSupervisor:
+    """
+    Launches one process per cluster, each running an AutoShardedBot over a contiguous shard range, and restarts
+    crashed clusters with exponential backoff. It also is the aggregation channel of the clusters: they report
+    their guild count over a Unix socket and get the counts of all clusters back, and they ask it for identify
+    slots, so the clusters together respect the identify rate limit of discord.
+    """
+
+    def __init__(self, target: Callable, clusters: int, shard_count: int, socket_path: str = DEFAULT_CLUSTER_SOCKET,
+                 args: Tuple = (), restart_delay: float = 5, max_restart_delay: float = 300,
+                 stable_after: float = 60, max_concurrency: int = 1):
+        """
+        :param target: picklable function taking cluster_id, shard_ids, shard_count, socket_path and args,
+        runs one cluster
+        :param stable_after: a cluster running this long resets its restart backoff
+        :param max_concurrency: identify buckets of the bot, see /gateway/bot
+        """
+        self.target = target
+        self.shard_count = shard_count
+        self.socket_path = socket_path
+        self.args = args
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stable_after = stable_after
+        self.max_concurrency = max_concurrency
+        self.clusters = [ClusterProcess(i, shards) for i, shards in enumerate(shard_ranges(shard_count, clusters))]
+        self.counts: Dict[int, int] = {}
+        self.reports = 0
+        self._writers: Dict[int, asyncio.StreamWriter] = {}
+        self._locks: Dict[asyncio.StreamWriter, asyncio.Lock] = {}
+        self._next_identify: Dict[int, float] = {}
+        self._server: Union[asyncio.AbstractServer, None] = None
+        self._closing = False
+        self._context = multiprocessing.get_context('spawn')
+
+    @property
+    def total_guilds(self) -> int:
+        return sum(self.counts.values())
+
+    def start_cluster(self, cluster: ClusterProcess):
+        cluster.process = self._context.Process(
+            target=self.target, name=f"cluster-{cluster.cluster_id}",
+            args=(cluster.cluster_id, cluster.shard_ids, self.shard_count, self.socket_path) + tuple(self.args))
+        cluster.process.start()
+        cluster.started = time.monotonic()
+        cluster.restart_at = None
+        logger.info(f"Started cluster {cluster.cluster_id} (shards {cluster.shard_ids[0]}-{cluster.shard_ids[-1]}, "
+                    f"pid {cluster.process.pid})")
+
+    async def start(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._accept, path=self.socket_path)
+        for cluster in self.clusters:
+            self.start_cluster(cluster)
+
+    def check(self):
+        """
+        Restarts dead clusters once their backoff passed.
+        """
+        now = time.monotonic()
+        for cluster in self.clusters:
+            if self._closing or cluster.process is None or cluster.process.is_alive():
+                continue
+            if cluster.restart_at is None:
+                if now - cluster.started > self.stable_after:
+                    cluster.restart_delay = self.restart_delay
+                else:
+                    cluster.restart_delay = min(max(cluster.restart_delay * 2, self.restart_delay),
+                                                self.max_restart_delay)
+                cluster.restart_at = now + cluster.restart_delay
+                logger.warning(f"Cluster {cluster.cluster_id} exited with {cluster.process.exitcode}, restarting "
+                               f"in {cluster.restart_delay}s")
+            elif cluster.restart_at <= now:
+                cluster.restarts += 1
+                self.start_cluster(cluster)
+
+    async def run(self):
+        await self.start()
+        try:
+            while not self._closing:
+                self.check()
+                await asyncio.sleep(1)
+        finally:
+            await self.close()
+
+    async def close(self):
+        self._closing = True
+        for cluster in self.clusters:
+            if cluster.process is not None and cluster.process.is_alive():
+                cluster.process.terminate()
+        for cluster in self.clusters:
+            if cluster.process is not None:
+                await asyncio.get_event_loop().run_in_executor(None, cluster.process.join, 30)
+        if self._server is not None:
+            self._server.close()
+
+    async def _send(self, writer: asyncio.StreamWriter, message: dict):
+        lock = self._locks.setdefault(writer, asyncio.Lock())
+        try:
+            async with lock:
+                await write_message(writer, message)
+        except ConnectionError:
+            pass
+
+    async def _broadcast(self):
+        message = {'op': 'counts', 'counts': {str(k): v for k, v in self.counts.items()}}
+        for writer in list(self._writers.values()):
+            await self._send(writer, message)
+
+    async def _identify(self, writer: asyncio.StreamWriter, msg: dict):
+        bucket = msg['shard'] % self.max_concurrency
+        now = time.monotonic()
+        at = max(now, self._next_identify.get(bucket, 0))
+        self._next_identify[bucket] = at + IDENTIFY_INTERVAL
+        await asyncio.sleep(at - now)
+        await self._send(writer, {'op': 'identify_ok', 'shard': msg['shard']})
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        hello = await read_message(reader)
+        if hello is None or hello.get('op') != 'hello':
+            writer.close()
+            return
+        cluster_id = int(hello['cluster'])
+        self._writers[cluster_id] = writer
+        await self._send(writer, {'op': 'counts', 'counts': {str(k): v for k, v in self.counts.items()}})
+
+        while True:
+            msg = await read_message(reader)
+            if msg is None:
+                break
+            op = msg.get('op')
+            if op == 'stats':
+                self.reports += 1
+                self.counts[cluster_id] = msg['guilds']
+                await self._broadcast()
+            elif op == 'identify':
+                asyncio.ensure_future(self._identify(writer, msg))
+
+        if self._writers.get(cluster_id) is writer:
+            self._writers.pop(cluster_id)
+        self._locks.pop(writer, None)
+        writer.close()
+
+
+class ClusterClient:
+    """
+    Connection of a cluster to the supervisor. Reports the guild count of the cluster whenever it changes and
+    keeps the last known counts of the other clusters.
+    """
+
+    def __init__(self, bot: Bot, cluster_id: int, socket_path: str = DEFAULT_CLUSTER_SOCKET,
+                 reconnect_delay: float = 1, max_reconnect_delay: float = 30, connect_timeout: float = 30):
+        """
+        :param connect_timeout: how long a shard waits for the supervisor before it identifies without a slot
+        """
+        self.bot = bot
+        self.cluster_id = cluster_id
+        self.socket_path = socket_path
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connect_timeout = connect_timeout
+        self.counts: Dict[int, int] = {}
+        self._writer: Union[asyncio.StreamWriter, None] = None
+        self._connected = asyncio.Event()
+        self._write_lock = asyncio.Lock()
+        self._identify: Dict[int, asyncio.Future] = {}
+        self._task: Union[asyncio.Task, None] = None
+        for event in ['on_ready', 'on_shard_ready', 'on_guild_join', 'on_guild_remove']:
+            bot.add_listener(self.report, event)
+
+    def guild_count(self) -> int:
+        """
+        Guilds of the whole bot: the live count of this cluster plus the last reported count of the others.
+        """
+        return len(self.bot.guilds) + sum(v for k, v in self.counts.items() if k != self.cluster_id)
+
+    def start(self):
+        self._task = asyncio.ensure_future(self.run())
+
+    async def _write(self, message: dict):
+        if self._writer is None:
+            raise ConnectionError("Not connected to the supervisor")
+        async with self._write_lock:
+            await write_message(self._writer, message)
+
+    async def report(self, *args):
+        try:
+            await self._write({'op': 'stats', 'guilds': len(self.bot.guilds)})
+        except ConnectionError:
+            pass
+
+    async def identify_slot(self, shard_id: int, initial: bool = False):
+        """
+        Waits until the supervisor allows the shard to identify. The first shard starts together with the
+        connection to the supervisor, so it waits up to connect_timeout for the connection. Without a supervisor
+        every shard but the first waits the default interval, like discord.py does.
+        """
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            if not self._connected.is_set():
+                try:
+                    await asyncio.wait_for(self._connected.wait(), max(deadline - time.monotonic(), 0.001))
+                except asyncio.TimeoutError:
+                    logger.warning(f"No connection to the supervisor, shard {shard_id} identifies without a slot")
+                    if not initial:
+                        await asyncio.sleep(IDENTIFY_INTERVAL)
+                    return
+
+            future = self._identify[shard_id] = asyncio.get_event_loop().create_future()
+            try:
+                await self._write({'op': 'identify', 'shard': shard_id})
+                await future
+                return
+            except ConnectionError:
+                # lost the supervisor, asks again once reconnected
+                continue
+            finally:
+                self._identify.pop(shard_id, None)
+
+    async def run(self):
+        delay = self.reconnect_delay
+        while not self.bot.is_closed():
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.socket_path)
+            except (ConnectionError, FileNotFoundError):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+
+            delay = self.reconnect_delay
+            self._writer = writer
+            try:
+                await self._write({'op': 'hello', 'cluster': self.cluster_id, 'pid': os.getpid()})
+                self._connected.set()
+                if self.bot.is_ready():
+                    await self.report()
+                while True:
+                    msg = await read_message(reader)
+                    if msg is None:
+                        break
+                    if msg.get('op') == 'counts':
+                        self.counts = {int(k): v for k, v in msg['counts'].items()}
+                    elif msg.get('op') == 'identify_ok':
+                        future = self._identify.get(msg['shard'])
+                        if future is not None and not future.done():
+                            future.set_result(None)
+            except ConnectionError:
+                pass
+            finally:
+                self._writer = None
+                self._connected.clear()
+                for future in self._identify.values():
+                    if not future.done():
+                        future.set_exception(ConnectionError())
+                writer.close()
+
+
+class ClusterMixin:
+    """
+    AutoShardedBot running as one cluster of a ClusterSupervisor.
+    """
+
+    def __init__(self, *args, cluster_id: int = 0, cluster_socket: str = DEFAULT_CLUSTER_SOCKET, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cluster = ClusterClient(self, cluster_id, cluster_socket)
+
+    async def start(self, *args, **kwargs):
+        self.cluster.start()
+        await super().start(*args, **kwargs)
+
+    async def before_identify_hook(self, shard_id, *, initial=False):
+        await self.cluster.identify_slot(shard_id, initial)
+
+
+def guild_count(bot: Bot) -> int:
+    """
+    Number of guilds of the whole bot, across all clusters when running as a cluster.
+    """
+    cluster: Union[ClusterClient, None] = getattr(bot, 'cluster', None)
+    if cluster is not None:
+        return cluster.guild_count()
+    return len(bot.guilds)
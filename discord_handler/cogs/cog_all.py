@@ -1,17 +1,26 @@
-import json
 import os
 
-import inflect
 from discord.ext.commands import Bot
 
+from config import load_config
 from discord_handler.base.cog_interface import ICog, AuthorState
 
 path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..')
 
-with open(os.path.join(path, 'secret.json'), 'r') as f:
-    d = json.load(f)
+d = load_config()
 
-p = inflect.engine()
+_inflect_engine = None
+
+
+def get_inflect():
+    """
+    The inflect engine, imported on first use, importing inflect takes longer than loading this cog.
+    """
+    global _inflect_engine
+    if _inflect_engine is None:
+        import inflect
+        _inflect_engine = inflect.engine()
+    return _inflect_engine
 
 
 class IntroEndedException(Exception):
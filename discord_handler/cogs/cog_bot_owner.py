@@ -1,8 +1,17 @@
 import os
 
+from discord import Embed, File
 from discord.ext.commands import Bot, command, Context, ExtensionNotLoaded, Cog
 
+from discord_handler.CustHelp import help_index
+from discord_handler.analytics import analytics, CHARTS
 from discord_handler.base.cogs_bot_owner import BotOwner
+from discord_handler.helper import send_table
+from discord_handler.error_aggregator import error_aggregator
+from discord_handler.event_recorder import EventRecorder
+from discord_handler.upsert import upsert_stats, snapshots
+from discord_handler.db_async import pool_stats, pool_size, run_db
+from discord_handler.rollup import command_usage, guild_growth, user_growth
 
 path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'plots')
 
@@ -17,6 +26,7 @@ class DBotOwner(BotOwner):
         for i in extension_list:
             bot.load_extension(i)
         self.extension_list = extension_list
+        self.recorder = EventRecorder(bot)
 
     @command(
         name='reload',
@@ -25,6 +35,7 @@ class DBotOwner(BotOwner):
     async def reload_extension(self, ctx: Context, *, name: str):
         try:
             self.bot.reload_extension(name)
+            help_index.invalidate()
             await ctx.send(f"Reloaded {name}")
         except ExtensionNotLoaded:
             await ctx.send(f"**Can't load {name}**")
@@ -42,4 +53,107 @@ class DBotOwner(BotOwner):
                 await ctx.send(f"Reloading {i}")
             except ExtensionNotLoaded:
                 await ctx.send(f"**Can't load {i}**")
-        await ctx.send("Done")
\ No newline at end of file
+        help_index.invalidate()
+        await ctx.send("Done")
+
+    @command(
+        name='write_stats',
+        help='Shows how many db writes the upsert layer saved'
+    )
+    async def write_stats(self, ctx: Context):
+        text = "\n".join(f"{key}: {value}" for key, value in upsert_stats.as_dict().items())
+        text += f"\nwrite_amplification_saved: {upsert_stats.write_amplification_saved:.1%}"
+        text += f"\ncached rows: {len(snapshots)}"
+        await ctx.send(f"```{text}```")
+
+    @command(
+        name='db_stats',
+        help='Shows how many db connections were opened, reused or failed'
+    )
+    async def db_stats(self, ctx: Context):
+        text = "\n".join(f"{key}: {value}" for key, value in pool_stats.as_dict().items())
+        text += f"\nreuse_ratio: {pool_stats.reuse_ratio:.1%}"
+        text += f"\npool size: {pool_size()}"
+        await ctx.send(f"```{text}```")
+
+    @command(
+        name='usage_stats',
+        help='Shows the most used commands of the last days, from the daily rollup'
+    )
+    async def usage_stats(self, ctx: Context, nr_of_days: int = 7, nr_of_commands: int = 10):
+        usage = await run_db(command_usage, nr_of_days, nr_of_commands)
+        if len(usage) == 0:
+            await ctx.send("No commands in this timeframe.")
+            return
+        text = "\n".join(f"{name}: {total} times on {guilds} guilds" for name, total, guilds in usage)
+        await send_table(ctx.send, "```" + text + "```")
+
+    @command(
+        name='growth_stats',
+        help='Shows guilds joined and left and the user growth per day, from the daily rollup'
+    )
+    async def growth_stats(self, ctx: Context, nr_of_days: int = 14):
+        guilds = {i.bucket: i for i in await run_db(guild_growth, nr_of_days)}
+        users = {i.bucket: i for i in await run_db(user_growth, nr_of_days)}
+        if len(guilds) == 0 and len(users) == 0:
+            await ctx.send("No stats in this timeframe.")
+            return
+        text = ""
+        for day in sorted(guilds.keys() | users.keys()):
+            text += f"{day.strftime('%Y-%m-%d')}:"
+            if day in guilds:
+                text += f" guilds +{guilds[day].joined} -{guilds[day].left} ({guilds[day].total_count})"
+            if day in users:
+                text += f" users +{users[day].added} ({users[day].total_count})"
+            text += "\n"
+        await send_table(ctx.send, "```" + text + "```")
+
+    @command(
+        name='plot_stats',
+        help=f'Plots the usage of the bot over the last days. Charts: {", ".join(CHARTS.keys())}'
+    )
+    async def plot_stats(self, ctx: Context, chart: str = 'commands', nr_of_days: int = 30):
+        if chart not in CHARTS:
+            await ctx.send(f"Unknown chart {chart}, use one of {', '.join(CHARTS.keys())}")
+            return
+        async with ctx.typing():
+            file, url = await analytics.chart(chart, nr_of_days, self.get_image_link)
+        if url is not None:
+            await ctx.send(embed=Embed(title=f"{chart}, last {nr_of_days} days").set_image(url=url))
+        else:
+            await ctx.send(file=File(file))
+
+    @command(
+        name='record_events',
+        help='Records the gateway events of the next seconds (at most limit events) for the replay benchmark'
+    )
+    async def record_events(self, ctx: Context, seconds: int = 60, limit: int = None):
+        if self.recorder.running:
+            await ctx.send(f"Already recording to {self.recorder.path}")
+            return
+        path = await self.recorder.start(seconds=seconds, limit=limit)
+        await ctx.send(f"Recording to {path} for {seconds}s")
+
+    @command(
+        name='record_stop',
+        help='Stops the running event recording'
+    )
+    async def record_stop(self, ctx: Context):
+        if not self.recorder.running:
+            await ctx.send("Not recording.")
+            return
+        recorded = await self.recorder.stop()
+        await ctx.send(f"Recorded {recorded} events to {self.recorder.path}")
+
+    @command(
+        name='error_stats',
+        help='Shows the most frequent errors since the last restart, grouped by fingerprint'
+    )
+    async def error_stats(self, ctx: Context, nr_of_errors: int = 10):
+        records = sorted(error_aggregator.records.values(), key=lambda i: i.count, reverse=True)[:nr_of_errors]
+        if len(records) == 0:
+            await ctx.send("No errors since the last restart.")
+            return
+        text = "\n".join(f"{i.fingerprint[:8]} x{i.count} (last {i.last_seen.strftime('%Y-%m-%d %H:%M')}): "
+                         f"{i.error_type} {i.error[:80]}" for i in records)
+        await send_table(ctx.send, "```" + text + "```")
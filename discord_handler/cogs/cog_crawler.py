@@ -1,16 +1,25 @@
+import logging
 import os
 import traceback
 
 from discord import Guild
 from discord.ext import tasks
-from discord.ext.commands import Bot
+from discord.ext.commands import Bot, command, Context, Cog
 
 from discord_handler.base.cog_interface import ICog, AuthorState
-from discord_handler.helper import get_guild
-from db import models
+from discord_handler.db_async import run_db
+from discord_handler.guild_scheduler import GuildScheduler
+from discord_handler.helper import send_table
+from discord_handler.reconcile import reconciler
+from discord_handler.rollup import rollups
 
+logger = logging.getLogger(__name__)
 path = os.path.dirname(os.path.realpath(__file__)) + "/../../"
 
+DUMMY_TASK_INTERVAL = 30 * 60
+DUMMY_TASK_CONCURRENCY = 10
+ROLLUP_INTERVAL = 5 * 60
+
 
 class Crawler(ICog):
     """
@@ -19,27 +28,78 @@ class Crawler(ICog):
 
     def __init__(self, bot: Bot):
         super().__init__(bot, AuthorState.BotOwner)
+        self.dummy_scheduler = GuildScheduler(self.dummy_guild_task, DUMMY_TASK_INTERVAL, DUMMY_TASK_CONCURRENCY,
+                                              on_error=self.on_dummy_task_error)
         self.dummy_task.start()
+        self.rollup_task.start()
+
+    def cog_unload(self):
+        self.dummy_task.cancel()
+        self.rollup_task.cancel()
+        self.dummy_scheduler.cancel()
 
-    @tasks.loop(minutes=30)
+    @tasks.loop(seconds=DUMMY_TASK_INTERVAL)
     async def dummy_task(self):
-        for d_g in self.bot.guilds:
-            d_g: Guild
-            try:
-                pass
-                #Some function can be called here for every guild
-            except Exception as e:
-                d_g = self.bot.guilds[0]
-                f = models.Error(g=get_guild(d_g)
-                                 , cmd_string=f"Dummy task error {d_g.name}", error_type=f'{type(e)}', error=f'{e}',
-                                 traceback=traceback.format_exc())
-                f.save()
-                await self.notify_error_bot_owner(f, d_g)
+        self.dummy_scheduler.schedule(self.bot.guilds)
 
     @dummy_task.before_loop
     async def before_dummy_task(self):
         await self.bot.wait_until_ready()
 
+    @Cog.listener()
+    async def on_ready(self):
+        try:
+            await reconciler.sync(self.bot.guilds)
+        except Exception as e:
+            await self.report_error(None, "Db sync on ready", f'{type(e)}', f'{e}', traceback.format_exc())
+
+    @Cog.listener()
+    async def on_guild_join(self, d_g: Guild):
+        try:
+            await reconciler.sync([d_g])
+        except Exception as e:
+            await self.report_error(d_g, f"Db sync on join {d_g.name}", f'{type(e)}', f'{e}', traceback.format_exc())
+
+    @tasks.loop(seconds=ROLLUP_INTERVAL)
+    async def rollup_task(self):
+        try:
+            processed = await run_db(rollups.run)
+            logger.debug(f"Rolled up stats: {processed}")
+        except Exception as e:
+            await self.report_error(None, "Stats rollup", f'{type(e)}', f'{e}', traceback.format_exc())
+
+    async def dummy_guild_task(self, d_g: Guild):
+        pass
+        #Some function can be called here for every guild
+
+    async def on_dummy_task_error(self, d_g: Guild, e: Exception):
+        await self.report_error(d_g, f"Dummy task error {d_g.name}", f'{type(e)}', f'{e}', traceback.format_exc())
+
+    @command(
+        name='crawler_stats',
+        help='Shows the slowest and most failing guilds of the crawler tasks'
+    )
+    async def crawler_stats(self, ctx: Context, nr_of_guilds: int = 10):
+        scheduler = self.dummy_scheduler
+        stats = sorted(scheduler.stats.items(), key=lambda i: (i[1].failures, i[1].avg_duration),
+                       reverse=True)[:nr_of_guilds]
+        text = f"rounds: {scheduler.rounds}, scheduled: {scheduler.scheduled}, running: {scheduler.running}\n"
+        for g_id, i in stats:
+            d_g = self.bot.get_guild(g_id)
+            name = d_g.name if d_g is not None else g_id
+            text += f"{name}: runs {i.runs}, failures {i.failures}, skipped {i.skipped}, " \
+                    f"avg {i.avg_duration:.2f}s, last {i.last_duration:.2f}s\n"
+        await send_table(ctx.send, "```" + text + "```")
+
+    @command(
+        name='sync_db',
+        help='Syncs guilds, channels, roles and members of the gateway cache into the db'
+    )
+    async def sync_db(self, ctx: Context):
+        async with ctx.typing():
+            stats = await reconciler.sync(self.bot.guilds)
+        await send_table(ctx.send, "```" + stats.report() + "```")
+
 
 def setup(bot):
     bot.add_cog(Crawler(bot))
@@ -13,6 +13,7 @@ from discord.ext.commands import Bot, Cog, Context
 from discord_handler.cogs.cog_crawler import Crawler
 from db import models
 from discord_handler.base.cog_interface import ICog, AuthorState
+from discord_handler.permissions import permissions
 from discord_handler.helper import get_user, get_guild, get_channel, yes_no, CustCtx
 
 if TYPE_CHECKING:
@@ -43,7 +44,7 @@ class Listener(ICog):
         text += f"Command: **{ctx.message.content}**"
 
         bot_owner: 'DBotOwner' = self.bot.get_cog('DBotOwner')
-        await bot_owner.send_update(text, bot_owner.bot_owner_dm_channel, ctx.guild)
+        await bot_owner.notify(text, bot_owner.bot_owner_dm_channel, ctx.guild)
 
     @Cog.listener()
     async def on_raw_reaction_add(self, payload: RawReactionActionEvent):
@@ -77,44 +78,30 @@ class Listener(ICog):
             #now everything is prepared
 
         except Exception as e:
-            f = models.Error(g=models.DBGuild.objects.get(g_id=d_g.id)
-                             , cmd_string="on raw reaction error", error_type=f'{type(e)}', error=f'{e}',
-                             traceback=traceback.format_exc())
-            f.save()
-            await self.notify_error_bot_owner(f, d_g)
+            await self.report_error(d_g, "on raw reaction error", f'{type(e)}', f'{e}', traceback.format_exc())
 
     @Cog.listener()
     async def on_member_update(self, before: Member, after: Member):
+        if before.roles != after.roles or before.guild_permissions != after.guild_permissions:
+            permissions.invalidate_member(after.guild.id, after.id)
         try:
             pass
         except Exception as e:
-            f = models.Error(g=models.DBGuild.objects.get(g_id=after.guild.id)
-                             , cmd_string="on member update", error_type=f'{type(e)}', error=f'{e}',
-                             traceback=traceback.format_exc())
-            f.save()
-            await self.notify_error_bot_owner(f, after.guild)
+            await self.report_error(after.guild, "on member update", f'{type(e)}', f'{e}', traceback.format_exc())
 
     @Cog.listener()
     async def on_member_join(self, member: Member):
         try:
             pass
         except Exception as e:
-            f = models.Error(g=models.DBGuild.objects.get(g_id=member.guild.id)
-                             , cmd_string="on member join", error_type=f'{type(e)}', error=f'{e}',
-                             traceback=traceback.format_exc())
-            f.save()
-            await self.notify_error_bot_owner(f, member.guild)
+            await self.report_error(member.guild, "on member join", f'{type(e)}', f'{e}', traceback.format_exc())
 
     @Cog.listener()
     async def on_member_remove(self, member: Member):
         try:
             pass
         except Exception as e:
-            f = models.Error(g=models.DBGuild.objects.get(g_id=member.guild.id)
-                             , cmd_string="on member.leave", error_type=f'{type(e)}', error=f'{e}',
-                             traceback=traceback.format_exc())
-            f.save()
-            await self.notify_error_bot_owner(f, member.guild)
+            await self.report_error(member.guild, "on member.leave", f'{type(e)}', f'{e}', traceback.format_exc())
 
     @Cog.listener()
     async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState):
@@ -125,11 +112,7 @@ class Listener(ICog):
         try:
             pass
         except Exception as e:
-            f = models.Error(g=get_guild(d_g)
-                             , cmd_string="on member ban error", error_type=f'{type(e)}', error=f'{e}',
-                             traceback=traceback.format_exc())
-            f.save()
-            await self.notify_error_bot_owner(f, d_g)
+            await self.report_error(d_g, "on member ban error", f'{type(e)}', f'{e}', traceback.format_exc())
 
 def setup(bot):
     bot.add_cog(Listener(bot))
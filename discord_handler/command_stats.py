@@ -0,0 +1,160 @@
+import asyncio
+import logging
+from typing import Dict, List, Tuple, Union
+
+from discord.ext.commands import Context
+from django.db import DataError, IntegrityError, transaction
+from django.utils import timezone
+
+from db import models
+from db.models import DBGuild, DBUser
+from discord_handler.db_async import run_db, spawn
+
+logger = logging.getLogger(__name__)
+
+
+class CommandStatsWriter:
+    """
+    Write behind buffer for the command telemetry. Stats are collected in memory and written with a single
+    bulk_create once max_size rows are buffered or every interval seconds, so the analytics write is never
+    on the critical path of a command.
+    """
+
+    def __init__(self, max_size: int = 200, interval: float = 10):
+        self.max_size = max_size
+        self.interval = interval
+        self._buffer: List[Tuple[str, str, Union[int, None], Union[int, None], str, object]] = []
+        self._commands: Dict[Tuple[str, str], models.Command] = {}
+        self._lock = asyncio.Lock()
+        self._task: Union[asyncio.Task, None] = None
+        self._pending_flush: Union[asyncio.Task, None] = None
+        self.written = 0
+        self.flushes = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def add(self, ctx: Context, g: Union[DBGuild, None], u: Union[DBUser, None]):
+        """
+        Buffers the stats of a command invocation. Needs to be called from within the event loop.
+        """
+        parameters = " ".join([f"{ctx.command.clean_params[i]}" for i in ctx.command.clean_params.keys()])
+        self._buffer.append((ctx.cog.qualified_name, ctx.command.name, g.g_id if g is not None else None,
+                             u.id if u is not None else None, parameters, timezone.now()))
+
+        if self._task is None or self._task.done():
+            self._task = spawn(self._flush_loop())
+
+        if len(self._buffer) >= self.max_size and (self._pending_flush is None or self._pending_flush.done()):
+            self._pending_flush = spawn(self.flush())
+            self._pending_flush.add_done_callback(self._flushed)
+
+    @staticmethod
+    def _flushed(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Failed to flush command stats", exc_info=task.exception())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush command stats")
+
+    async def flush(self):
+        async with self._lock:
+            if not self._buffer:
+                return
+            rows, self._buffer = self._buffer, []
+            try:
+                await run_db(self._write, rows)
+            except (IntegrityError, DataError):
+                # a single bad row, i.e. of a deleted guild, fails the whole batch
+                failed, dropped = await run_db(self._write_each, rows)
+                self.dropped += dropped
+                self.written += len(rows) - len(failed) - dropped
+                if failed:
+                    self._keep(failed)
+                    raise
+            except Exception:
+                self._keep(rows)
+                raise
+            else:
+                self.written += len(rows)
+            self.flushes += 1
+
+    def _keep(self, rows):
+        """
+        Keeps rows that failed for the next try, but never grows the buffer without bound.
+        """
+        self._buffer = rows + self._buffer
+        limit = self.max_size * 10
+        if len(self._buffer) > limit:
+            lost = len(self._buffer) - limit
+            self._buffer = self._buffer[-limit:]
+            self.dropped += lost
+            logger.warning(f"Command stats buffer full, dropped the {lost} oldest rows")
+
+    async def drain(self):
+        """
+        Stops the timer and writes everything that is still buffered. Called on shutdown.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def get_command(self, cog_name: str, command_name: str) -> models.Command:
+        """
+        Resolves the Cog/Command rows once and caches them for the lifetime of the process.
+        """
+        key = (cog_name, command_name)
+        command = self._commands.get(key)
+        if command is not None:
+            return command
+
+        try:
+            cog = models.Cog.objects.get(name=cog_name)
+        except models.Cog.DoesNotExist:
+            cog = models.Cog(name=cog_name)
+            cog.save()
+
+        try:
+            command = models.Command.objects.get(cog=cog, name=command_name)
+        except models.Command.DoesNotExist:
+            command = models.Command(cog=cog, name=command_name)
+            command.save()
+
+        self._commands[key] = command
+        return command
+
+    def _write_each(self, rows) -> Tuple[list, int]:
+        """
+        Writes rows one by one, the rows the db rejects are dropped and logged.
+        :return: the rows not written because the db failed, and the number of rows dropped
+        """
+        dropped = 0
+        for nr, row in enumerate(rows):
+            try:
+                with transaction.atomic():
+                    self._write([row])
+            except (IntegrityError, DataError):
+                logger.warning(f"Dropped command stats of {row[0]}.{row[1]} (guild {row[2]}, user {row[3]})",
+                               exc_info=True)
+                dropped += 1
+            except Exception:
+                logger.exception("Failed to write command stats")
+                return rows[nr:], dropped
+        return [], dropped
+
+    def _write(self, rows):
+        models.CommandStats.objects.bulk_create([
+            models.CommandStats(g_id=g_id, command=self.get_command(cog_name, command_name), user_id=u_id,
+                                parameters=parameters, timestamp=timestamp)
+            for cog_name, command_name, g_id, u_id, parameters, timestamp in rows
+        ])
+
+
+command_stats = CommandStatsWriter()
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from functools import partial
+from typing import Callable, Dict, Union
+
+from django.conf import settings
+from django.db import close_old_connections, connections, DEFAULT_DB_ALIAS, OperationalError, InterfaceError
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+DB_THREADS = 8
+# a connection idle for longer than this is checked with a cheap query before it is used again
+HEALTH_CHECK_AFTER = 30
+RECONNECT_ATTEMPTS = 4
+RECONNECT_DELAY = 0.5
+MAX_RECONNECT_DELAY = 5
+
+_executor: ThreadPoolExecutor = None
+_local = threading.local()
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+        self.failed = 0
+        self.stale = 0
+        self.broken = 0
+
+    def incr(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self) -> Dict[str, int]:
+        return {'opened': self.opened, 'reused': self.reused, 'failed': self.failed, 'stale': self.stale,
+                'broken': self.broken}
+
+    @property
+    def reuse_ratio(self) -> float:
+        total = self.opened + self.reused
+        return self.reused / total if total else 0.0
+
+
+pool_stats = PoolStats()
+
+
+class DbUsage:
+    """
+    Queries and seconds spent in the db threads by the jobs of one unit of work, i.e. a command. Set it in
+    db_usage and every run_db call of the task adds to it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jobs = 0
+        self.queries = 0
+        self.duration = 0.0
+
+    def add(self, queries: int, duration: float):
+        with self._lock:
+            self.jobs += 1
+            self.queries += queries
+            self.duration += duration
+
+
+db_usage: 'ContextVar[Union[DbUsage, None]]' = ContextVar('db_usage', default=None)
+
+
+def spawn(coro) -> asyncio.Task:
+    """
+    asyncio.ensure_future for background work started from within a command. Tasks copy the context they are
+    created in, so without this the db queries of i.e. a buffer flush would count into the command.
+    """
+    token = db_usage.set(None)
+    try:
+        return asyncio.ensure_future(coro)
+    finally:
+        db_usage.reset(token)
+
+
+def _count_query(execute, sql, params, many, context):
+    _local.queries = getattr(_local, 'queries', 0) + 1
+    return execute(sql, params, many, context)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    pool_stats.incr('opened')
+    # fired again on every reconnect of the same connection object
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+connection_created.connect(_on_connection_created, dispatch_uid='db_async_connection_created')
+
+
+def pool_size() -> int:
+    """
+    Number of db threads, settings.DB_THREADS if set. Django keeps one connection per thread, and with
+    CONN_MAX_AGE the connection is kept between jobs, so this is also the size of the connection pool.
+    """
+    return getattr(settings, 'DB_THREADS', DB_THREADS)
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Bounded thread pool the ORM runs on. Django keeps one connection per thread, so the pool size is also
+    the maximum number of open db connections of the bot.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=pool_size(), thread_name_prefix='db')
+    return _executor
+
+
+def _checkout():
+    """
+    Prepares the connection of the current thread for a job. Drops it if it is too old or broken, checks it if
+    it was idle for a while and (re)connects with backoff. Connecting is safe to retry, the job itself is not.
+    """
+    # same as django does around a request: drop connections that are broken or older than CONN_MAX_AGE
+    close_old_connections()
+    connection = connections[DEFAULT_DB_ALIAS]
+    if connection.connection is not None:
+        if time.monotonic() - getattr(_local, 'last_used', 0) > HEALTH_CHECK_AFTER and not connection.is_usable():
+            pool_stats.incr('stale')
+            connection.close()
+        else:
+            pool_stats.incr('reused')
+
+    delay = RECONNECT_DELAY
+    for attempt in range(RECONNECT_ATTEMPTS):
+        try:
+            connection.ensure_connection()
+            return
+        except (OperationalError, InterfaceError):
+            pool_stats.incr('failed')
+            if attempt == RECONNECT_ATTEMPTS - 1:
+                raise
+            logger.warning(f"Failed to connect to the db, retrying in {delay}s")
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+
+def _run(fun: Callable, *args, **kwargs):
+    _checkout()
+    try:
+        return fun(*args, **kwargs)
+    except (OperationalError, InterfaceError):
+        connection = connections[DEFAULT_DB_ALIAS]
+        if connection.connection is not None and not connection.is_usable():
+            # the next job of this thread reconnects
+            pool_stats.incr('broken')
+            connection.close()
+        raise
+    finally:
+        _local.last_used = time.monotonic()
+        close_old_connections()
+
+
+def _run_measured(usage: DbUsage, fun: Callable, *args, **kwargs):
+    queries = getattr(_local, 'queries', 0)
+    start = time.perf_counter()
+    try:
+        return _run(fun, *args, **kwargs)
+    finally:
+        usage.add(getattr(_local, 'queries', 0) - queries, time.perf_counter() - start)
+
+
+async def run_db(fun: Callable, *args, **kwargs):
+    """
+    Runs a blocking db function on the db thread pool, without blocking the event loop.
+    :param fun: function doing the ORM work
+    :return: return value of fun
+    """
+    loop = asyncio.get_event_loop()
+    usage = db_usage.get()
+    if usage is None:
+        return await loop.run_in_executor(get_executor(), partial(_run, fun, *args, **kwargs))
+    return await loop.run_in_executor(get_executor(), partial(_run_measured, usage, fun, *args, **kwargs))
+
+
+def shutdown():
+    """
+    Closes the connection of every db thread and stops the pool. Connections are thread bound, so each
+    worker has to close its own one. The barrier makes sure every worker picks up exactly one close job.
+    """
+    global _executor
+    if _executor is None:
+        return
+
+    threads = _executor._max_workers
+    barrier = threading.Barrier(threads)
+
+    def close():
+        try:
+            barrier.wait(timeout=5)
+        except threading.BrokenBarrierError:
+            pass
+        connections.close_all()
+
+    for _ in range(threads):
+        _executor.submit(close)
+    _executor.shutdown(wait=True)
+    _executor = None
@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import logging
+import re
+from typing import Callable, Dict, Set, Union
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from db.models import DBGuild, Error, ErrorAggregate
+from discord_handler.db_async import run_db, spawn
+
+logger = logging.getLogger(__name__)
+
+_address = re.compile(r"0x[0-9a-fA-F]+")
+_frame = re.compile(r'^\s*File "(.+)", line (\d+), in (.+)$')
+
+
+def fingerprint(error_type: str, traceback: Union[str, None]) -> str:
+    """
+    Hash of the error type and the frames of the traceback. Error messages and memory addresses are left
+    out, so the same broken code path always gets the same fingerprint.
+    """
+    frames = []
+    for line in (traceback or "").splitlines():
+        match = _frame.match(line)
+        if match is not None:
+            frames.append(f"{match.group(1)}:{match.group(2)}:{match.group(3)}")
+    text = _address.sub("0x", error_type) + "\n" + "\n".join(frames)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class ErrorRecord:
+    def __init__(self, fp: str, g_id: Union[int, None], cmd_string: str, error_type: str, error: str,
+                 traceback: Union[str, None]):
+        self.fingerprint = fp
+        self.g_id = g_id
+        self.cmd_string = cmd_string
+        self.error_type = error_type
+        self.error = error
+        self.traceback = traceback
+        self.count = 0
+        self.pending = 0
+        self.last_rate = 0
+        self.first_seen = timezone.now()
+        self.last_seen = self.first_seen
+
+    def to_error(self) -> Error:
+        return Error(g_id=self.g_id, cmd_string=self.cmd_string[:2048], error_type=self.error_type[:256],
+                     error=self.error[:5000], traceback=self.traceback[:15000] if self.traceback else None,
+                     time_stamp=self.last_seen)
+
+
+class ErrorAggregator:
+    """
+    Aggregates errors by fingerprint instead of writing a row and sending a notification per exception.
+    Counts are kept in memory and upserted into ErrorAggregate every interval seconds. The bot owner is
+    notified for new fingerprints and whenever the rate of a fingerprint grows by rate_factor.
+    """
+
+    def __init__(self, interval: float = 60, rate_factor: float = 10, min_rate: int = 10):
+        self.interval = interval
+        self.rate_factor = rate_factor
+        self.min_rate = min_rate
+        self.records: Dict[str, ErrorRecord] = {}
+        self._known: Set[str] = set()
+        self._new: Set[str] = set()
+        self._notify: Union[Callable, None] = None
+        self._task: Union[asyncio.Task, None] = None
+        self.reported = 0
+        self.notifications = 0
+
+    def set_notifier(self, notify: Callable):
+        """
+        :param notify: coroutine function taking an Error, the guild id and the occurrences since the last
+        flush (None for new errors)
+        """
+        self._notify = notify
+
+    def load(self):
+        """
+        Loads the fingerprints already stored, so a restart doesn't notify about every known error again.
+        """
+        self._known |= set(ErrorAggregate.objects.values_list('fingerprint', flat=True))
+
+    async def report(self, g_id: Union[int, None], cmd_string: str, error_type: str, error: str,
+                     traceback: Union[str, None]):
+        fp = fingerprint(error_type, traceback)
+        record = self.records.get(fp)
+        if record is None:
+            record = self.records[fp] = ErrorRecord(fp, g_id, cmd_string, error_type, error, traceback)
+        else:
+            record.g_id, record.cmd_string, record.error, record.traceback = g_id, cmd_string, error, traceback
+            record.last_seen = timezone.now()
+        record.count += 1
+        record.pending += 1
+        self.reported += 1
+
+        if self._task is None or self._task.done():
+            self._task = spawn(self._flush_loop())
+
+        if fp not in self._known:
+            self._known.add(fp)
+            self._new.add(fp)
+            await self._send(record.to_error(), g_id, None)
+
+    async def _send(self, e: Error, g_id: Union[int, None], occurrences: Union[int, None]):
+        if self._notify is None:
+            return
+        self.notifications += 1
+        try:
+            await self._notify(e, g_id, occurrences)
+        except Exception:
+            logger.exception("Failed to send error notification")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush error aggregates")
+
+    async def flush(self):
+        pending = [i for i in self.records.values() if i.pending > 0]
+        if not pending:
+            return
+        counts = {i.fingerprint: i.pending for i in pending}
+        new = {i for i in self._new}
+        for i in pending:
+            i.pending = 0
+        self._new -= new
+
+        try:
+            await run_db(self._write, pending, counts, new)
+        except Exception:
+            # counted again by the next flush
+            for i in pending:
+                i.pending += counts[i.fingerprint]
+            self._new |= new
+            raise
+
+        for i in pending:
+            rate = counts[i.fingerprint]
+            if i.fingerprint not in new and rate >= self.min_rate and rate >= i.last_rate * self.rate_factor:
+                await self._send(i.to_error(), i.g_id, rate)
+            i.last_rate = rate
+
+    @staticmethod
+    def _write(records, counts: Dict[str, int], new: Set[str]):
+        """
+        Upserts the aggregates with INSERT ... ON CONFLICT (fingerprint) DO UPDATE, so clusters flushing the
+        same fingerprint at the same time add up their counts instead of failing on the unique key.
+        """
+        g_ids = {i.g_id for i in records if i.g_id is not None}
+        meta = ErrorAggregate._meta
+        qn = connection.ops.quote_name
+        table = qn(meta.db_table)
+        fields = [meta.get_field(i) for i in ('fingerprint', 'g', 'cmd_string', 'error_type', 'error', 'traceback',
+                                               'count', 'first_seen', 'last_seen')]
+        updates = [f"{qn('count')} = {table}.{qn('count')} + EXCLUDED.{qn('count')}"] + \
+                  [f"{qn(meta.get_field(i).column)} = EXCLUDED.{qn(meta.get_field(i).column)}"
+                   for i in ('g', 'cmd_string', 'error', 'last_seen')]
+        sql = f"INSERT INTO {table} ({', '.join(qn(f.column) for f in fields)}) " \
+              f"VALUES ({', '.join(['%s'] * len(fields))}) " \
+              f"ON CONFLICT ({qn(meta.get_field('fingerprint').column)}) DO UPDATE SET {', '.join(updates)}"
+
+        with transaction.atomic():
+            existing = set(DBGuild.objects.filter(g_id__in=g_ids).values_list('g_id', flat=True))
+            rows = []
+            samples = []
+            for i in records:
+                g_id = i.g_id if i.g_id in existing else None
+                values = [i.fingerprint, g_id, i.cmd_string[:2048], i.error_type[:256], i.error[:5000],
+                          i.traceback[:15000] if i.traceback else None, counts[i.fingerprint], i.first_seen,
+                          i.last_seen]
+                rows.append([f.get_db_prep_save(v, connection) for f, v in zip(fields, values)])
+                if i.fingerprint in new:
+                    # one full sample row per new fingerprint, so show_errors still lists it
+                    e = i.to_error()
+                    e.g_id = g_id
+                    samples.append(e)
+            with connection.cursor() as cursor:
+                cursor.executemany(sql, rows)
+            Error.objects.bulk_create(samples)
+
+    async def drain(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+error_aggregator = ErrorAggregator()
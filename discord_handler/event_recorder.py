@@ -0,0 +1,166 @@
+"""
+Records gateway dispatches to a file the replay benchmark (benchmarks/bench_replay.py) can feed back into the bot.
+
+The file is gzip compressed JSON lines. The first line is a header, every other line one dispatch:
+
+    {"version": 1, "events": ["MESSAGE_CREATE", ...], "started": "2021-01-01T00:00:00+00:00"}
+    [0.0132, "MESSAGE_CREATE", {...raw payload of the dispatch...}]
+
+The first value of a dispatch is the offset in seconds since the start of the recording.
+"""
+import asyncio
+import datetime
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Iterable, Iterator, List, Tuple, Union
+
+from discord.ext.commands import Bot
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+RECORDED_EVENTS = frozenset({
+    'MESSAGE_CREATE', 'MESSAGE_UPDATE', 'MESSAGE_DELETE', 'MESSAGE_REACTION_ADD', 'MESSAGE_REACTION_REMOVE',
+    'GUILD_MEMBER_ADD', 'GUILD_MEMBER_REMOVE', 'GUILD_MEMBER_UPDATE', 'VOICE_STATE_UPDATE', 'TYPING_START',
+})
+RECORDING_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'recordings')
+FLUSH_INTERVAL = 1
+FLUSH_SIZE = 1000
+
+Event = Tuple[float, str, dict]
+
+
+def _header(events: Iterable[str]) -> str:
+    return json.dumps({'version': VERSION, 'events': sorted(events),
+                       'started': datetime.datetime.now(datetime.timezone.utc).isoformat()})
+
+
+def write_events(path: str, events: Iterable[Event], recorded: Iterable[str] = RECORDED_EVENTS):
+    """
+    Writes a complete recording, i.e. a synthesized one.
+    """
+    with gzip.open(path, 'wt') as f:
+        f.write(_header(recorded) + "\n")
+        for i in events:
+            f.write(json.dumps(i, separators=(',', ':')) + "\n")
+
+
+def read_events(path: str) -> Iterator[Event]:
+    with gzip.open(path, 'rt') as f:
+        header = json.loads(f.readline())
+        if header.get('version') != VERSION:
+            raise ValueError(f"Unsupported recording version {header.get('version')}")
+        for line in f:
+            t, event, d = json.loads(line)
+            yield t, event, d
+
+
+class EventRecorder:
+    """
+    Appends the dispatches of the event types in events to a recording. The socket_response listener is only
+    registered while recording, otherwise it would cost a task per gateway message. Lines are buffered and
+    written off the loop every FLUSH_INTERVAL seconds.
+    """
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.path: Union[str, None] = None
+        self.events = RECORDED_EVENTS
+        self.recorded = 0
+        self.limit: Union[int, None] = None
+        self._start = 0.0
+        self._file = None
+        self._buffer: List[str] = []
+        self._task: Union[asyncio.Task, None] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._file is not None
+
+    async def on_socket_response(self, msg: dict):
+        if msg.get('op') != 0 or msg.get('t') not in self.events or self._file is None:
+            return
+        # stop() runs as a task, events can arrive before it closed the file
+        if self.limit is not None and self.recorded >= self.limit:
+            return
+        self._buffer.append(json.dumps([round(time.monotonic() - self._start, 4), msg['t'], msg['d']],
+                                       separators=(',', ':')))
+        self.recorded += 1
+        if self.limit is not None and self.recorded >= self.limit:
+            asyncio.ensure_future(self.stop())
+        elif len(self._buffer) >= FLUSH_SIZE:
+            asyncio.ensure_future(self.flush())
+
+    async def start(self, path: str = None, seconds: float = None, limit: int = None,
+                    events: Iterable[str] = RECORDED_EVENTS) -> str:
+        """
+        :param seconds: stops the recording after this many seconds
+        :param limit: stops the recording after this many dispatches
+        :return: path of the recording
+        """
+        if self.running:
+            raise RuntimeError(f"Already recording to {self.path}")
+        if path is None:
+            os.makedirs(RECORDING_DIR, exist_ok=True)
+            path = os.path.join(RECORDING_DIR, f"events_{int(time.time())}.jsonl.gz")
+
+        self.path = path
+        self.events = frozenset(events)
+        self.limit = limit
+        self.recorded = 0
+        loop = asyncio.get_event_loop()
+        self._file = await loop.run_in_executor(None, gzip.open, path, 'wt')
+        self._buffer = [_header(self.events)]
+        self._start = time.monotonic()
+        self._task = asyncio.ensure_future(self._flush_loop(seconds))
+        self.bot.add_listener(self.on_socket_response, 'on_socket_response')
+        logger.info(f"Recording gateway events to {path}")
+        return path
+
+    async def _flush_loop(self, seconds: Union[float, None]):
+        end = time.monotonic() + seconds if seconds is not None else None
+        while end is None or time.monotonic() < end:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush()
+        asyncio.ensure_future(self.stop())
+
+    async def flush(self):
+        # one write at a time, so the lines stay in order
+        async with self._lock:
+            if not self._buffer or self._file is None:
+                return
+            lines, self._buffer = self._buffer, []
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self._file.write, "\n".join(lines) + "\n")
+
+    @staticmethod
+    def _close(file, lines: List[str]):
+        if lines:
+            file.write("\n".join(lines) + "\n")
+        file.close()
+
+    async def stop(self) -> int:
+        """
+        Stops the recording and closes the file.
+        :return: number of dispatches recorded
+        """
+        if not self.running:
+            return self.recorded
+        self.bot.remove_listener(self.on_socket_response, 'on_socket_response')
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+        self._task = None
+
+        async with self._lock:
+            if self._file is None:
+                return self.recorded
+            file, self._file = self._file, None
+            lines, self._buffer = self._buffer, []
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self._close, file, lines)
+        logger.info(f"Recorded {self.recorded} gateway events to {self.path}")
+        return self.recorded
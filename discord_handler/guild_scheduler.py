@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import random
+import time
+import traceback
+from typing import Callable, Dict, Iterable, Set, Union
+
+from discord import Guild
+
+logger = logging.getLogger(__name__)
+
+
+class GuildRunStats:
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_duration = 0.0
+        self.total_duration = 0.0
+        self.last_error: Union[str, None] = None
+
+    @property
+    def avg_duration(self) -> float:
+        return self.total_duration / self.runs if self.runs else 0.0
+
+
+class GuildScheduler:
+    """
+    Runs a per guild job once every interval. The guilds of a round are spread over the interval with
+    jitter instead of being walked one after the other, and at most concurrency jobs run at the same time.
+    A guild whose previous job is still running when its turn comes is skipped for the round, so one slow guild
+    can't pile up. Waiting for the slot or the semaphore doesn't count as running.
+    """
+
+    def __init__(self, job: Callable, interval: float, concurrency: int = 10, on_error: Callable = None):
+        """
+        :param job: coroutine function taking the guild
+        :param interval: length of a round in seconds
+        :param concurrency: number of jobs that may run at the same time
+        :param on_error: coroutine function taking the guild and the exception, called when a job fails
+        """
+        self.job = job
+        self.interval = interval
+        self.concurrency = concurrency
+        self.on_error = on_error
+        self.stats: Dict[int, GuildRunStats] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._running: Set[int] = set()
+        self._semaphore: Union[asyncio.Semaphore, None] = None
+        self.rounds = 0
+
+    def get_stats(self, g_id: int) -> GuildRunStats:
+        stats = self.stats.get(g_id)
+        if stats is None:
+            stats = self.stats[g_id] = GuildRunStats()
+        return stats
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    @property
+    def scheduled(self) -> int:
+        return len(self._tasks)
+
+    def schedule(self, guilds: Iterable[Guild]) -> int:
+        """
+        Schedules one round over guilds and returns right away.
+        :return: number of guilds scheduled
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        guilds = list(guilds)
+        self.rounds += 1
+        if not guilds:
+            return 0
+
+        slot = self.interval / len(guilds)
+        scheduled = 0
+        for nr, guild in enumerate(guilds):
+            delay = nr * slot + random.uniform(0, slot)
+            task = asyncio.ensure_future(self._run(guild, delay))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            scheduled += 1
+        return scheduled
+
+    async def _run(self, guild: Guild, delay: float):
+        await asyncio.sleep(delay)
+        async with self._semaphore:
+            stats = self.get_stats(guild.id)
+            if guild.id in self._running:
+                stats.skipped += 1
+                return
+            self._running.add(guild.id)
+            start = time.monotonic()
+            try:
+                await self.job(guild)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                stats.failures += 1
+                stats.last_error = traceback.format_exc()
+                if self.on_error is not None:
+                    try:
+                        await self.on_error(guild, e)
+                    except Exception:
+                        logger.exception(f"Failed to report error of guild {guild.id}")
+                else:
+                    logger.exception(f"Job failed for guild {guild.id}")
+            finally:
+                self._running.discard(guild.id)
+                duration = time.monotonic() - start
+                stats.runs += 1
+                stats.last_duration = duration
+                stats.total_duration += duration
+
+    def cancel(self):
+        for task in list(self._tasks):
+            task.cancel()
+        self._tasks.clear()
+        self._running.clear()
+
+    async def wait(self):
+        """
+        Waits until every job of the scheduled rounds is done.
+        """
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
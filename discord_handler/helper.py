@@ -4,13 +4,15 @@ from datetime import timedelta
 from typing import Union, List, Tuple, TYPE_CHECKING
 
 import pytz
-from discord import Guild, Embed, Member, DMChannel, Message, Reaction, TextChannel, Forbidden, HTTPException, Role, \
-    VoiceChannel
+from discord import Guild, Embed, Member, DMChannel, Message, TextChannel, Forbidden, HTTPException, Role, VoiceChannel
 from discord.ext.commands import Context, Bot
-from django.db import IntegrityError
 from django.utils import timezone
 
 from db.models import DBGuild, DBUser, DBChannel, DBRole
+from discord_handler.db_async import run_db
+from discord_handler.interactions import get_router, seed_reactions
+from discord_handler.prefix_cache import prefix_cache, DM_PREFIX
+from discord_handler.upsert import upsert
 
 if TYPE_CHECKING:
     from discord_handler.cogs.cog_bot_owner import DBotOwner
@@ -54,10 +56,7 @@ def add_guild(ctx: Union[Context, Guild]):
     except:
         return False
     g_name = ctx.guild.name if isinstance(ctx, Context) else ctx.name
-    try:
-        DBGuild.objects.get(g_id=g_id)
-    except DBGuild.DoesNotExist:
-        DBGuild(g_id=g_id, name=g_name).save()
+    upsert(DBGuild, {'g_id': g_id}, defaults={'name': g_name})
 
     return True
 
@@ -79,73 +78,64 @@ async def send_pm(bot: Bot, u: DBUser, text: str, embed: Embed = None):
         raise e
     finally:
         bot_owner: 'DBotOwner' = bot.get_cog('DBotOwner')
-        await bot_owner.send_update(f'Sent to user {u.u_name}({u.u_id})\n\n;;' + text, bot_owner.dms_id,
-                                    None, embed=embed)
+        await bot_owner.notify(f'Sent to user {u.u_name}({u.u_id})\n\n;;' + text, bot_owner.dms_id,
+                               None, embed=embed)
 
 
 def get_guild(guild: Guild) -> DBGuild:
-    try:
-        g = DBGuild.objects.get(g_id=guild.id)
-    except DBGuild.DoesNotExist:
-        g = DBGuild(g_id=guild.id, name=guild.name)
+    return upsert(DBGuild, {'g_id': guild.id}, {'name': guild.name})
 
-    g.name = guild.name
-    g.save()
-    return g
 
-
-def get_channel(channel: Union[VoiceChannel, TextChannel]):
+def get_channel(channel: Union[VoiceChannel, TextChannel]) -> DBChannel:
     g = get_guild(channel.guild)
-
-    try:
-        ch_obj = DBChannel.objects.get(channel_id=channel.id, g=g)
-    except DBChannel.DoesNotExist:
-        ch_obj = DBChannel(channel_id=channel.id, channel_name=channel.name, g=g)
-
-    ch_obj.channel_name = channel.name
-    ch_obj.save()
+    ch_obj = upsert(DBChannel, {'g_id': g.g_id, 'channel_id': channel.id}, {'channel_name': channel.name})
+    ch_obj.g = g
     return ch_obj
 
 
-def get_role(role: Role):
-    g = DBGuild.objects.get(g_id=role.guild.id)
-    try:
-        dbrole = DBRole.objects.get(g=g, role_id=role.id)
-    except DBRole.DoesNotExist:
-        dbrole = DBRole(g=g, role_id=role.id)
-
-    dbrole.role_name = role.name
-    dbrole.role_color_r = role.color.r
-    dbrole.role_color_g = role.color.g
-    dbrole.role_color_b = role.color.b
-    dbrole.save()
+def get_role(role: Role) -> DBRole:
+    g = get_guild(role.guild)
+    dbrole = upsert(DBRole, {'g_id': g.g_id, 'role_id': role.id}, {
+        'role_name': role.name,
+        'role_color_r': role.color.r,
+        'role_color_g': role.color.g,
+        'role_color_b': role.color.b,
+    })
+    dbrole.g = g
     return dbrole
 
 
 def get_user(member: Member, g: DBGuild = None) -> DBUser:
     if g is None:
-        g = DBGuild.objects.get(g_id=member.guild.id)
+        g = get_guild(member.guild)
+
+    u = upsert(DBUser, {'u_id': member.id, 'g_id': g.g_id}, {
+        'u_name': member.display_name,
+        'is_bot': member.bot,
+        'avatar_url': str(member.avatar_url),
+    })
+    u.g = g
+    return u
 
-    try:
-        u = DBUser.objects.get(u_id=member.id, g=g)
-        u.d_name = member.display_name
-        u.is_bot = member.bot
-        u.avatar_url = member.avatar_url
-        u.save()
-    except DBUser.DoesNotExist:
-        try:
-            u = DBUser(u_id=member.id, u_name=member.display_name, g=g,
-                       is_bot=member.bot,
-                       avatar_url=member.avatar_url)
-            u.save()
-        except IntegrityError:
-            u = DBUser.objects.get(u_id=member.id, g=g)
-            u.d_name = member.display_name
-            u.is_bot = member.bot
-            u.avatar_url = member.avatar_url
-            u.save()
 
-    return u
+async def a_add_guild(ctx: Union[Context, Guild]):
+    return await run_db(add_guild, ctx)
+
+
+async def a_get_guild(guild: Guild) -> DBGuild:
+    return await run_db(get_guild, guild)
+
+
+async def a_get_channel(channel: Union[VoiceChannel, TextChannel]) -> DBChannel:
+    return await run_db(get_channel, channel)
+
+
+async def a_get_role(role: Role) -> DBRole:
+    return await run_db(get_role, role)
+
+
+async def a_get_user(member: Member, g: DBGuild = None) -> DBUser:
+    return await run_db(get_user, member, g)
 
 
 async def send_table(send_fun: callable, txt: str, add_raw=True, embed: Embed = None):
@@ -189,17 +179,14 @@ def pretty_time(time: int):
 
 
 async def get_pre(_, message: Message):
-    if not isinstance(message.author, Member):
-        return ";"
+    if message.guild is None:
+        return DM_PREFIX
 
-    author_g_id = message.author.guild.id
-    try:
-        g = DBGuild.objects.get(g_id=author_g_id)
-    except DBGuild.DoesNotExist:
-        g = DBGuild(g_id=author_g_id, name=message.author.guild.name)
-        g.save()
+    prefix = prefix_cache.get(message.guild.id)
+    if prefix is None:
+        prefix = await run_db(prefix_cache.fetch, message.guild)
 
-    return g.prefix
+    return prefix
 
 
 def convert_str_date(time_string: str):
@@ -241,27 +228,18 @@ async def choose_option(ctx: Context, text: str, options: List[object], check_fu
     else:
         msg: Message = await ctx.send(text, embed=embed)
 
-    for key in option_dict.keys():
-        await msg.add_reaction(key)
-
-    def default_check(reaction: Reaction, user: Member):
-        if user.bot:
-            return False
-
-        if ctx.author is not None and ctx.channel is not None:
-            return reaction.emoji in emojiList and user == ctx.author and reaction.message.id == msg.id
-        else:
-            return reaction.emoji in emojiList and reaction.message.id == msg.id
-
-    check = default_check if check_fun is None else check_fun
+    seeding = seed_reactions(msg, list(option_dict.keys()))
+    # like get_response: custom checks decide on the user themselves, so they get the reactions of everyone
+    user_id = ctx.author.id if check_fun is None and ctx.author is not None and ctx.channel is not None else None
 
     try:
-        reaction, _ = await ctx.bot.wait_for('reaction_add', check=check,
-                                             timeout=120)
+        reaction, _ = await get_router(ctx.bot).wait_reaction(msg, option_dict.keys(), user_id, check_fun,
+                                                              timeout=120)
     except asyncio.TimeoutError as e:
         await ctx.send("Sorry you timed out.")
         raise e
     finally:
+        seeding.cancel()
         await msg.delete()
     if mapping_list is None:
         return option_dict[reaction.emoji]
@@ -275,17 +253,23 @@ async def get_response(ctx: Context, text: str, check_fun: callable = None, conv
     msg: Message = await send_obj.send(text)
 
     def default_check(message: Message):
-        if not must_contain_file:
-            return message.author == ctx.author and message.channel == ctx.channel
-        else:
-            return message.author == ctx.author and message.channel == ctx.channel and len(message.attachments) == 1
+        return not must_contain_file or len(message.attachments) == 1
 
+    # custom checks decide on the author and the channel themselves, so they get every message, like wait_for did.
+    # Otherwise the answer is expected in the channel the question was sent to
     check = default_check if check_fun is None else check_fun
+    author_id = ctx.author.id if check_fun is None else None
+    if check_fun is not None:
+        channel_id = None
+    elif msg is not None:
+        channel_id = msg.channel.id
+    else:
+        channel_id = ctx.channel.id if ctx.channel is not None else None
     tries = 0
     while True:
         try:
-            message_answer: Message = await ctx.bot.wait_for('message', check=check,
-                                                             timeout=timeout)
+            message_answer: Message = await get_router(ctx.bot).wait_message(channel_id, author_id, check,
+                                                                             timeout=timeout)
             if conversion_fun is not None:
                 try:
                     answer = conversion_fun(message_answer.content)
@@ -312,20 +296,15 @@ async def yes_no(text: str, ctx: Context, skip=False, embed: Embed = None, timeo
         msg = await ctx.send(text)
     else:
         msg = await ctx.send(text, embed=embed)
-    await msg.add_reaction('✅')
-    await msg.add_reaction('❌')
     em_list = ['✅', '❌']
     if skip:
-        await msg.add_reaction('⏩')
         em_list.append('⏩')
-    await asyncio.sleep(0.5)
-
-    def r_check(reaction: Reaction, user: Member):
-        return reaction.message.id == msg.id and user == ctx.author and str(reaction.emoji) in em_list
+    seeding = seed_reactions(msg, em_list)
 
     try:
-        reaction, _ = await ctx.bot.wait_for('reaction_add', check=r_check, timeout=timeout)
+        reaction, _ = await get_router(ctx.bot).wait_reaction(msg, em_list, ctx.author.id, timeout=timeout)
     except asyncio.TimeoutError:
+        seeding.cancel()
         try:
             await msg.clear_reactions()
         except Forbidden:
@@ -336,6 +315,7 @@ async def yes_no(text: str, ctx: Context, skip=False, embed: Embed = None, timeo
             return None
         return False
 
+    seeding.cancel()
     if reaction.emoji == '⏩':
         return None
 
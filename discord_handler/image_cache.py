@@ -0,0 +1,160 @@
+import asyncio
+import datetime
+import hashlib
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Tuple, Union
+
+from django.utils import timezone
+
+from db.models import ImageLink
+from discord_handler.db_async import run_db
+
+logger = logging.getLogger(__name__)
+
+WARM_CONCURRENCY = 2
+# discord signs attachment urls, they stop working after 24 hours
+DEFAULT_MAX_AGE = 20 * 60 * 60
+# links cached in memory are checked against ImageLink again after this many seconds, so a link another process
+# dropped is not served forever
+MEMORY_TTL = 5 * 60
+
+
+def file_digest(image_path: str) -> str:
+    h = hashlib.sha256()
+    with open(image_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ImageLinkCache:
+    """
+    Maps the sha256 of an image to the attachment url of its upload, in memory and in ImageLink, so the same
+    image is only uploaded once. Links are dropped when their message is deleted, concurrent requests for the
+    same image share one upload.
+    """
+
+    def __init__(self, max_age: Union[float, None] = DEFAULT_MAX_AGE, memory_ttl: float = MEMORY_TTL):
+        """
+        :param max_age: seconds after which an upload is done again, None to keep links until their message is
+        deleted
+        :param memory_ttl: seconds a link is served from memory before ImageLink is checked again
+        """
+        self.max_age = max_age
+        self.memory_ttl = memory_ttl
+        self._links: Dict[str, Tuple[ImageLink, float]] = {}
+        self._messages: Dict[int, str] = {}
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.uploads = 0
+        self.invalidated = 0
+
+    def _valid(self, link: ImageLink) -> bool:
+        return self.max_age is None or timezone.now() - link.time_stamp < datetime.timedelta(seconds=self.max_age)
+
+    def _remember(self, link: ImageLink):
+        self._links[link.digest] = (link, time.monotonic() + self.memory_ttl)
+        self._messages[link.message_id] = link.digest
+
+    def _forget(self, digest: str):
+        link, _ = self._links.pop(digest)
+        if self._messages.get(link.message_id) == digest:
+            del self._messages[link.message_id]
+
+    async def _lookup(self, digest: str) -> Union[ImageLink, None]:
+        entry = self._links.get(digest)
+        if entry is not None and entry[1] > time.monotonic():
+            link = entry[0]
+        else:
+            if entry is not None:
+                self._forget(digest)
+            link = await run_db(ImageLink.objects.filter(digest=digest).first)
+            if link is not None:
+                self._remember(link)
+        return link if link is not None and self._valid(link) else None
+
+    async def get(self, image_path: str, upload: Callable[[str], Awaitable[Union[Tuple[str, int, int], None]]]) \
+            -> Union[str, None]:
+        """
+        Returns the url of the image, uploading it only if its content wasn't uploaded before.
+        :param upload: coroutine function uploading the file, returning url, channel id and message id or None
+        :return: attachment url, None if the upload wasn't possible
+        """
+        loop = asyncio.get_event_loop()
+        digest = await loop.run_in_executor(None, file_digest, image_path)
+
+        link = await self._lookup(digest)
+        if link is not None:
+            self.hits += 1
+            return link.url
+
+        future = self._in_flight.get(digest)
+        if future is not None:
+            self.hits += 1
+            return await asyncio.shield(future)
+
+        future = self._in_flight[digest] = loop.create_future()
+        try:
+            result = await upload(image_path)
+            url = None
+            if result is not None:
+                self.uploads += 1
+                url, channel_id, message_id = result
+                link = ImageLink(digest=digest, url=url, channel_id=channel_id, message_id=message_id)
+                await run_db(link.save)
+                self._remember(link)
+            future.set_result(url)
+            return url
+        except BaseException as e:
+            future.set_exception(e)
+            # retrieved here, so waiters are optional
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[digest]
+
+    async def warm(self, image_paths: Iterable[str],
+                   upload: Callable[[str], Awaitable[Union[Tuple[str, int, int], None]]],
+                   concurrency: int = WARM_CONCURRENCY) -> Dict[str, Union[str, None]]:
+        """
+        Uploads known assets ahead of time, i.e. on startup. Images that are cached already are skipped.
+        :return: url per path, None for images that failed
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        image_paths = list(image_paths)
+
+        async def one(image_path: str) -> Union[str, None]:
+            async with semaphore:
+                try:
+                    return await self.get(image_path, upload)
+                except Exception:
+                    logger.exception(f"Failed to pre-upload {image_path}")
+                    return None
+
+        urls = await asyncio.gather(*[one(i) for i in image_paths])
+        return dict(zip(image_paths, urls))
+
+    async def invalidate(self, message_ids: Iterable[int]):
+        """
+        Drops the links of deleted messages, their attachment urls stop working.
+        """
+        message_ids = list(message_ids)
+        for i in message_ids:
+            digest = self._messages.pop(i, None)
+            if digest is not None and digest in self._links and self._links[digest][0].message_id == i:
+                del self._links[digest]
+        # the link might have been stored by another process, so the db is always checked
+        deleted, _ = await run_db(ImageLink.objects.filter(message_id__in=message_ids).delete)
+        self.invalidated += deleted
+
+    def load(self):
+        """
+        Loads the stored links. Blocking, use it from the db thread pool.
+        """
+        links: List[ImageLink] = list(ImageLink.objects.all())
+        for i in links:
+            self._remember(i)
+
+
+image_links = ImageLinkCache()
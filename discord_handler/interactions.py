@@ -0,0 +1,168 @@
+import asyncio
+import heapq
+import itertools
+from typing import Callable, Collection, Dict, List, Tuple, Union
+
+from discord import Message, Reaction, Member, User, Forbidden, NotFound, HTTPException
+from discord.ext.commands import Bot
+
+
+SEED_DEPTH = 4
+
+
+class PendingInteraction:
+    def __init__(self, key, future: asyncio.Future, expires: float, check: Callable = None,
+                 emojis: Collection[str] = None, user_id: int = None):
+        self.key = key
+        self.future = future
+        self.expires = expires
+        self.check = check
+        self.emojis = emojis
+        self.user_id = user_id
+
+
+class InteractionRouter:
+    """
+    Single dispatcher for everything that waits on a reaction or a text reply. Pending prompts are indexed by
+    message id or by (channel id, author id), so an event is matched with a few dict lookups instead of running
+    every pending wait_for check. Like wait_for, an event resolves every prompt it matches. Timeouts share one
+    timer on the earliest expiry.
+    """
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._reactions: Dict[int, List[PendingInteraction]] = {}
+        self._messages: Dict[Tuple[Union[int, None], Union[int, None]], List[PendingInteraction]] = {}
+        self._expiry: List[Tuple[float, int, PendingInteraction]] = []
+        self._counter = itertools.count()
+        self._timer: Union[asyncio.TimerHandle, None] = None
+        self._timer_at = None
+        bot.add_listener(self.on_reaction_add, 'on_reaction_add')
+        bot.add_listener(self.on_message, 'on_message')
+
+    def __len__(self):
+        return sum(len(i) for i in self._reactions.values()) + sum(len(i) for i in self._messages.values())
+
+    def _add(self, index: dict, key, timeout: float, **kwargs) -> PendingInteraction:
+        loop = asyncio.get_event_loop()
+        pending = PendingInteraction(key, loop.create_future(), loop.time() + timeout, **kwargs)
+        index.setdefault(key, []).append(pending)
+        pending.future.add_done_callback(lambda _: self._remove(index, pending))
+        heapq.heappush(self._expiry, (pending.expires, next(self._counter), pending))
+        self._schedule()
+        return pending
+
+    @staticmethod
+    def _remove(index: dict, pending: PendingInteraction):
+        waiting = index.get(pending.key)
+        if waiting is None:
+            return
+        try:
+            waiting.remove(pending)
+        except ValueError:
+            pass
+        if not waiting:
+            index.pop(pending.key, None)
+
+    def _schedule(self):
+        while self._expiry and self._expiry[0][2].future.done():
+            heapq.heappop(self._expiry)
+        if not self._expiry:
+            return
+        expires = self._expiry[0][0]
+        if self._timer is not None and self._timer_at <= expires:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_at = expires
+        self._timer = asyncio.get_event_loop().call_at(expires, self._expire)
+
+    def _expire(self):
+        self._timer = None
+        now = asyncio.get_event_loop().time()
+        while self._expiry and self._expiry[0][0] <= now:
+            _, _, pending = heapq.heappop(self._expiry)
+            if not pending.future.done():
+                pending.future.set_exception(asyncio.TimeoutError())
+        self._schedule()
+
+    async def wait_reaction(self, message: Message, emojis: Collection[str] = None, user_id: int = None,
+                            check: Callable = None, timeout: float = 120) -> Tuple[Reaction, Union[Member, User]]:
+        """
+        Waits for a reaction on message. Reactions of bots are ignored.
+        :param emojis: Only these emojis are accepted, any if None
+        :param user_id: Only reactions of this user are accepted, any if None
+        :param check: Additional check taking reaction and user
+        :return: reaction and user, raises asyncio.TimeoutError
+        """
+        pending = self._add(self._reactions, message.id, timeout, check=check, emojis=emojis, user_id=user_id)
+        return await pending.future
+
+    async def wait_message(self, channel_id: Union[int, None], author_id: Union[int, None], check: Callable = None,
+                           timeout: float = 120) -> Message:
+        """
+        Waits for a message in a channel.
+        :param channel_id: Only messages of this channel are accepted, any if None
+        :param author_id: Only messages of this author are accepted, any if None
+        :param check: Additional check taking the message
+        :return: message, raises asyncio.TimeoutError
+        """
+        pending = self._add(self._messages, (channel_id, author_id), timeout, check=check)
+        return await pending.future
+
+    async def on_reaction_add(self, reaction: Reaction, user: Union[Member, User]):
+        waiting = self._reactions.get(reaction.message.id)
+        if not waiting or user.bot:
+            return
+        for pending in list(waiting):
+            if pending.future.done():
+                continue
+            if pending.emojis is not None and str(reaction.emoji) not in pending.emojis:
+                continue
+            if pending.user_id is not None and pending.user_id != user.id:
+                continue
+            if pending.check is not None and not pending.check(reaction, user):
+                continue
+            pending.future.set_result((reaction, user))
+
+    async def on_message(self, message: Message):
+        channel_id, author_id = message.channel.id, message.author.id
+        for key in ((channel_id, author_id), (channel_id, None), (None, author_id), (None, None)):
+            waiting = self._messages.get(key)
+            if not waiting:
+                continue
+            for pending in list(waiting):
+                if pending.future.done():
+                    continue
+                if pending.check is not None and not pending.check(message):
+                    continue
+                pending.future.set_result(message)
+
+
+def get_router(bot: Bot) -> InteractionRouter:
+    router = getattr(bot, 'interaction_router', None)
+    if router is None:
+        router = bot.interaction_router = InteractionRouter(bot)
+    return router
+
+
+def seed_reactions(message: Message, emojis: Collection[str], depth: int = SEED_DEPTH) -> asyncio.Task:
+    """
+    Adds the reactions of a prompt in the background, so the prompt accepts input as soon as the message is
+    posted. Up to depth requests are in flight; discord.py queues them on the reaction route bucket in the
+    order they were started, so the reactions still show up in order.
+    Cancel the returned task once the prompt is answered.
+    """
+    semaphore = asyncio.Semaphore(depth)
+
+    async def add(emoji: str):
+        async with semaphore:
+            await message.add_reaction(emoji)
+
+    async def seed():
+        try:
+            await asyncio.gather(*[add(i) for i in emojis])
+        except (Forbidden, NotFound, HTTPException):
+            pass
+
+    return asyncio.ensure_future(seed())
@@ -0,0 +1,272 @@
+"""
+Metrics of the bot in the Prometheus text format, served by BotOwner.handle. Counters and histograms are plain
+dicts updated on the event loop, the cache and pool counters that already exist are read when scraped.
+"""
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from contextvars import Token
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+
+from discord.errors import HTTPException
+from discord.ext.commands import Context
+
+from discord_handler.db_async import DbUsage, db_usage, pool_stats
+from discord_handler.image_cache import image_links
+from discord_handler.permissions import permissions
+from discord_handler.prefix_cache import prefix_cache
+from discord_handler.upsert import upsert_stats
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+LAG_INTERVAL = 0.5
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # counters without labels exist from the start
+        self.values: Dict[tuple, float] = {} if self.labels else {(): 0}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labels, key)} {value}" for key, value in self.values.items()]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # per label values: observations per bucket (not cumulative), the last one is +Inf, sum and count
+        self.values: Dict[tuple, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels):
+        data = self.values.get(labels)
+        if data is None:
+            data = self.values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        data[0][bisect_left(self.buckets, value)] += 1
+        data[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {total[0]}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """
+    Read when scraped.
+    :param collect: returns the value per label values
+    """
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], collect: Callable[[], Dict[tuple, float]],
+                 type: str = 'gauge'):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+        self.type = type
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines += [f"{self.name}{_labels(self.labels, key)} {value}" for key, value in self.collect().items()]
+        return lines
+
+
+class CommandTimer:
+    __slots__ = ('start', 'usage', 'token')
+
+    def __init__(self, usage: DbUsage, token: Token):
+        self.start = time.perf_counter()
+        self.usage = usage
+        self.token = token
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    discord.py retries 429 responses itself and only logs them, so they are counted from its log records.
+    """
+
+    def __init__(self, registry: 'Metrics'):
+        super().__init__()
+        self.registry = registry
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.msg, str):
+            if record.msg.startswith('We are being rate limited'):
+                self.registry.rate_limited.inc()
+            elif record.msg.startswith('Global rate limit has been hit'):
+                self.registry.global_rate_limited.inc()
+        return True
+
+
+class Metrics:
+    def __init__(self):
+        self.command_duration = Histogram('dbot_command_duration_seconds', 'Latency of commands from their checks '
+                                          'to their after invoke hook', ('cog', 'command'))
+        self.command_errors = Counter('dbot_command_errors_total', 'Commands that raised', ('cog', 'command'))
+        self.command_queries = Counter('dbot_command_db_queries_total', 'Db queries of commands', ('cog', 'command'))
+        self.command_db_time = Counter('dbot_command_db_seconds_total', 'Seconds commands spent in the db threads',
+                                       ('cog', 'command'))
+        self.events = Counter('dbot_gateway_events_total', 'Events dispatched by discord.py', ('event',))
+        self.listener_calls = Counter('dbot_listener_calls_total', 'Event handlers started, per event and listener',
+                                      ('event', 'listener'))
+        self.rest_duration = Histogram('dbot_rest_request_duration_seconds', 'Latency of REST requests including '
+                                       'rate limit waits', ('method', 'route', 'status'))
+        self.rate_limited = Counter('dbot_rest_rate_limited_total', 'REST responses with status 429')
+        self.global_rate_limited = Counter('dbot_rest_global_rate_limited_total', '429 responses of the global '
+                                           'rate limit')
+        self.loop_lag = Histogram('dbot_event_loop_lag_seconds', f'How late the event loop wakes up a sleep of '
+                                  f'{LAG_INTERVAL}s', buckets=LAG_BUCKETS)
+        self.caches: Dict[str, Callable[[], Tuple[int, int]]] = {
+            'prefix': lambda: (prefix_cache.hits, prefix_cache.misses),
+            'permissions': lambda: (permissions.hits, permissions.misses),
+            'snapshots': lambda: (upsert_stats.cache_hits, upsert_stats.calls - upsert_stats.cache_hits),
+            'image_links': lambda: (image_links.hits, image_links.uploads),
+        }
+        self.rate_limit_filter = RateLimitFilter(self)
+        self._lag_task: Union[asyncio.Task, None] = None
+
+    def _collect(self) -> list:
+        caches = {name: fun() for name, fun in self.caches.items()}
+        return [
+            self.command_duration, self.command_errors, self.command_queries, self.command_db_time, self.events,
+            self.listener_calls, self.rest_duration, self.rate_limited, self.global_rate_limited, self.loop_lag,
+            Gauge('dbot_cache_hits_total', 'Cache hits', ('cache',),
+                  lambda: {(name,): hits for name, (hits, _) in caches.items()}, 'counter'),
+            Gauge('dbot_cache_misses_total', 'Cache misses', ('cache',),
+                  lambda: {(name,): misses for name, (_, misses) in caches.items()}, 'counter'),
+            Gauge('dbot_cache_hit_ratio', 'Share of lookups answered by the cache', ('cache',),
+                  lambda: {(name,): hits / (hits + misses) if hits + misses else 0.0
+                           for name, (hits, misses) in caches.items()}),
+            Gauge('dbot_db_connections_total', 'Db connection checkouts by outcome', ('outcome',),
+                  lambda: {(key,): value for key, value in pool_stats.as_dict().items()}, 'counter'),
+        ]
+
+    def render(self) -> str:
+        lines = []
+        for i in self._collect():
+            lines += i.render()
+        return "\n".join(lines) + "\n"
+
+    def start_command(self, ctx: Context):
+        """
+        Starts timing the command of ctx and counting its db queries. Further calls for the same context are
+        ignored.
+        """
+        if getattr(ctx, 'metrics_timer', None) is not None:
+            return
+        usage = DbUsage()
+        ctx.metrics_timer = CommandTimer(usage, db_usage.set(usage))
+
+    def end_command(self, ctx: Context, failed: bool = False):
+        """
+        Records the command of ctx, once. Called from cog_after_invoke and cog_command_error.
+        :param failed: counts the command as an error even if ctx.command_failed isn't set (yet)
+        """
+        timer: Union[CommandTimer, None] = getattr(ctx, 'metrics_timer', None)
+        if timer is None:
+            return
+        ctx.metrics_timer = None
+        try:
+            db_usage.reset(timer.token)
+        except ValueError:
+            # ended from another task than the one that started it
+            db_usage.set(None)
+        labels = (ctx.cog.qualified_name if ctx.cog is not None else '', ctx.command.qualified_name)
+        self.command_duration.observe(time.perf_counter() - timer.start, *labels)
+        self.command_queries.inc(*labels, amount=timer.usage.queries)
+        self.command_db_time.inc(*labels, amount=timer.usage.duration)
+        if failed or ctx.command_failed:
+            self.command_errors.inc(*labels)
+
+    def timed_request(self, request: Callable) -> Callable:
+        """
+        Wraps HTTPClient.request, labelled by the route template so the ids don't end up in the labels.
+        """
+
+        async def timed(route, **kwargs):
+            start = time.perf_counter()
+            status = 'ok'
+            try:
+                return await request(route, **kwargs)
+            except HTTPException as e:
+                status = str(e.status)
+                raise
+            except Exception:
+                status = 'error'
+                raise
+            finally:
+                self.rest_duration.observe(time.perf_counter() - start, route.method, route.path, status)
+
+        return timed
+
+    async def _watch_loop_lag(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.loop_lag.observe(max(time.perf_counter() - start - LAG_INTERVAL, 0.0))
+
+    def start(self):
+        """
+        Starts measuring the event loop lag.
+        """
+        if self._lag_task is None or self._lag_task.done():
+            self._lag_task = asyncio.ensure_future(self._watch_loop_lag())
+
+    def stop(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+
+
+metrics = Metrics()
+
+
+class MetricsMixin:
+    """
+    Bot counting its events and event handlers and timing its REST requests.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.http.request = metrics.timed_request(self.http.request)
+        logging.getLogger('discord.http').addFilter(metrics.rate_limit_filter)
+
+    def dispatch(self, event_name, *args, **kwargs):
+        metrics.events.inc(event_name)
+        super().dispatch(event_name, *args, **kwargs)
+
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        metrics.listener_calls.inc(event_name, getattr(coro, '__qualname__', event_name))
+        return super()._schedule_event(coro, event_name, *args, **kwargs)
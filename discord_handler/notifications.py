@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Tuple, Union
+
+from discord import Embed
+from discord.ext.commands import Bot
+
+from discord_handler.db_async import spawn
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = "\n\n"
+
+
+class DigestQueue:
+    """
+    Background pipeline for owner notifications. Events are queued per channel and sent as periodic digest
+    messages, so command logs, dm logs and errors don't spend the REST budget of user facing replies.
+    Every channel has a bounded backlog; when it is full the oldest events are dropped and counted.
+    """
+
+    def __init__(self, bot: Bot, send_fun: Callable, flush_interval: float = 10, max_backlog: int = 1000,
+                 max_length: int = 1900):
+        self.bot = bot
+        self.send_fun = send_fun
+        self.flush_interval = flush_interval
+        self.max_backlog = max_backlog
+        self.max_length = max_length
+        self._intervals: Dict[int, float] = {}
+        self._queues: Dict[int, Deque[Tuple[str, Union[Embed, None]]]] = {}
+        self._next_flush: Dict[int, float] = {}
+        self._task: Union[asyncio.Task, None] = None
+        self.queued = 0
+        self.sent_messages = 0
+        self.total_dropped = 0
+        # dropped events per channel that were not reported in a digest yet
+        self.dropped: Dict[int, int] = {}
+
+    def set_interval(self, channel: int, interval: float):
+        self._intervals[channel] = interval
+
+    def backlog(self, channel: int = None) -> int:
+        if channel is not None:
+            return len(self._queues.get(channel, ()))
+        return sum(len(i) for i in self._queues.values())
+
+    def enqueue(self, channel: int, text: str, embed: Embed = None):
+        queue = self._queues.get(channel)
+        if queue is None:
+            queue = self._queues[channel] = deque()
+            self._next_flush[channel] = time.monotonic() + self._intervals.get(channel, self.flush_interval)
+
+        if len(queue) >= self.max_backlog:
+            queue.popleft()
+            self.dropped[channel] = self.dropped.get(channel, 0) + 1
+            self.total_dropped += 1
+        queue.append((text, embed))
+        self.queued += 1
+
+        if self._task is None or self._task.done():
+            self._task = spawn(self._run())
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            due = [i for i, t in self._next_flush.items() if t <= now and self._queues.get(i)]
+            for channel in due:
+                try:
+                    await self.flush(channel)
+                except Exception:
+                    logger.exception(f"Failed to send notification digest to {channel}")
+                self._next_flush[channel] = time.monotonic() + self._intervals.get(channel, self.flush_interval)
+
+            if not any(self._queues.values()):
+                self._task = None
+                return
+            await asyncio.sleep(max(0.1, min(self._next_flush.values()) - time.monotonic()))
+
+    async def _wait_for_capacity(self):
+        # never send while discord has the whole bot globally rate limited, user replies go first
+        global_over: asyncio.Event = getattr(self.bot.http, '_global_over', None)
+        if global_over is not None and not global_over.is_set():
+            await global_over.wait()
+
+    async def flush(self, channel: int):
+        """
+        Sends everything queued for a channel. Texts are merged into as few messages as possible, entries
+        with an embed are sent on their own.
+        """
+        queue = self._queues.get(channel)
+        while queue:
+            text, embed = queue.popleft()
+            if embed is None:
+                dropped = self.dropped.pop(channel, 0)
+                if dropped:
+                    text = f"_{dropped} notifications were dropped_{SEPARATOR}{text}"
+                while queue and queue[0][1] is None and \
+                        len(text) + len(SEPARATOR) + len(queue[0][0]) <= self.max_length:
+                    text += SEPARATOR + queue.popleft()[0]
+
+            await self._wait_for_capacity()
+            await self.send_fun(text, channel, embed)
+            self.sent_messages += 1
+
+    async def drain(self):
+        """
+        Sends all pending digests right away. Called on shutdown.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for channel in list(self._queues.keys()):
+            try:
+                await self.flush(channel)
+            except Exception:
+                logger.exception(f"Failed to drain notifications of {channel}")
@@ -0,0 +1,158 @@
+import asyncio
+import time
+from typing import Callable, Dict, FrozenSet, Iterable, Tuple, Union
+
+from discord import Member
+from django.db.models.signals import post_save, post_delete
+
+from db.models import DBUser, ModRole
+from discord_handler.db_async import run_db
+
+
+class AuthorState:
+    User = 1
+    Mod = 3
+    Owner = 4
+    BotOwner = 5
+
+
+class PermissionEngine:
+    """
+    Resolves the AuthorState of a member. Keeps the mod role ids of every guild as a set, invalidated
+    whenever a ModRole changes, and memoizes the resolved state of each member for ttl seconds, per guild so a
+    guild is invalidated at once. Holds at most max_size members, expired ones are pruned first.
+    """
+
+    def __init__(self, ttl: float = 30, max_size: int = 100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.bot_owner_ids: FrozenSet[int] = frozenset()
+        self._mod_roles: Dict[int, FrozenSet[int]] = {}
+        self._memo: Dict[int, Dict[int, Tuple[int, float]]] = {}
+        self._size = 0
+        self._loop: Union[asyncio.AbstractEventLoop, None] = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self._size
+
+    def set_bot_owners(self, ids: Union[Iterable[int], None]):
+        self.bot_owner_ids = frozenset(ids or [])
+
+    async def mod_roles(self, g_id: int) -> FrozenSet[int]:
+        roles = self._mod_roles.get(g_id)
+        if roles is None:
+            roles = frozenset(await run_db(lambda: list(
+                ModRole.objects.filter(g_id=g_id).values_list('role__role_id', flat=True))))
+            self._mod_roles[g_id] = roles
+        return roles
+
+    def invalidate_guild(self, g_id: int):
+        self._mod_roles.pop(g_id, None)
+        self._size -= len(self._memo.pop(g_id, ()))
+
+    def invalidate_member(self, g_id: int, member_id: int):
+        guild = self._memo.get(g_id)
+        if guild is not None and guild.pop(member_id, None) is not None:
+            self._size -= 1
+
+    def call_on_loop(self, fun: Callable, *args):
+        """
+        Runs an invalidation on the event loop. The signals fire on the db threads, while resolve uses the memo
+        on the loop.
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            fun(*args)
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            fun(*args)
+        else:
+            loop.call_soon_threadsafe(fun, *args)
+
+    def prune(self):
+        """
+        Drops the expired members, then whole guilds in insertion order until a quarter of max_size is free.
+        """
+        now = time.monotonic()
+        for g_id in list(self._memo.keys()):
+            guild = self._memo[g_id]
+            for member_id in [k for k, v in guild.items() if v[1] <= now]:
+                del guild[member_id]
+            if not guild:
+                del self._memo[g_id]
+        self._size = sum(len(i) for i in self._memo.values())
+        while self._memo and self._size > self.max_size * 3 // 4:
+            self._size -= len(self._memo.pop(next(iter(self._memo))))
+
+    def is_bot_owner(self, member: Union[Member, None]) -> bool:
+        return member is not None and member.id in self.bot_owner_ids
+
+    @staticmethod
+    def is_admin(member: Member) -> bool:
+        return member.guild_permissions.administrator or member.guild_permissions.manage_roles
+
+    async def is_mod(self, u: Union[DBUser, None], member: Member) -> bool:
+        if u is not None:
+            if u.g_mod:
+                return True
+            mod_roles = await self.mod_roles(u.g_id)
+            if mod_roles and member is not None and not mod_roles.isdisjoint(i.id for i in member.roles):
+                return True
+
+        return member.guild_permissions.ban_members
+
+    async def resolve(self, u: Union[DBUser, None], member: Member) -> int:
+        """
+        Returns the AuthorState of the member, memoized for ttl seconds.
+        """
+        self._loop = asyncio.get_event_loop()
+        g_id = member.guild.id
+        guild = self._memo.get(g_id)
+        memo = guild.get(member.id) if guild is not None else None
+        now = time.monotonic()
+        if memo is not None and memo[1] > now:
+            self.hits += 1
+            return memo[0]
+        self.misses += 1
+
+        if self.is_bot_owner(member):
+            state = AuthorState.BotOwner
+        elif self.is_admin(member):
+            state = AuthorState.Owner
+        elif await self.is_mod(u, member):
+            state = AuthorState.Mod
+        else:
+            state = AuthorState.User
+
+        guild = self._memo.get(g_id)
+        if guild is None:
+            guild = self._memo[g_id] = {}
+        if member.id not in guild:
+            if self._size >= self.max_size:
+                self.prune()
+                guild = self._memo.setdefault(g_id, {})
+            self._size += 1
+        guild[member.id] = (state, now + self.ttl)
+        return state
+
+
+permissions = PermissionEngine()
+
+
+def _on_mod_role_change(sender, instance: ModRole, **kwargs):
+    permissions.call_on_loop(permissions.invalidate_guild, instance.g_id)
+
+
+def _on_user_save(sender, instance: DBUser, **kwargs):
+    permissions.call_on_loop(permissions.invalidate_member, instance.g_id, instance.u_id)
+
+
+post_save.connect(_on_mod_role_change, sender=ModRole, dispatch_uid='permissions_mod_role_save')
+post_delete.connect(_on_mod_role_change, sender=ModRole, dispatch_uid='permissions_mod_role_delete')
+post_save.connect(_on_user_save, sender=DBUser, dispatch_uid='permissions_user_save')
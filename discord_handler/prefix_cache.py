@@ -0,0 +1,92 @@
+from typing import Dict, Set, Union
+
+from discord import Guild, Message
+
+from db.models import DBGuild
+
+DM_PREFIX = ";"
+DEFAULT_PREFIX = DBGuild._meta.get_field('prefix').default
+
+
+class PrefixCache:
+    """
+    Process wide cache of the guild prefixes. It is loaded in bulk on startup, updated by set_prefix and
+    filled lazily for guilds that were not seen before.
+    """
+
+    def __init__(self):
+        self._prefixes: Dict[int, str] = {}
+        self._first_chars: Set[str] = {DEFAULT_PREFIX[0]}
+        self.hits = 0
+        self.misses = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._prefixes)
+
+    def __contains__(self, g_id: int):
+        return g_id in self._prefixes
+
+    def load(self):
+        """
+        Loads the prefixes of all guilds with a single query.
+        """
+        self._prefixes = dict(DBGuild.objects.values_list('g_id', 'prefix'))
+        self._first_chars = {DEFAULT_PREFIX[0]} | {i[0] for i in self._prefixes.values() if i}
+
+    def get(self, g_id: int) -> Union[str, None]:
+        prefix = self._prefixes.get(g_id)
+        if prefix is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return prefix
+
+    def set(self, g_id: int, prefix: str):
+        self._prefixes[g_id] = prefix
+        if prefix:
+            self._first_chars.add(prefix[0])
+
+    def invalidate(self, g_id: int):
+        self._prefixes.pop(g_id, None)
+
+    def fetch(self, guild: Guild) -> str:
+        """
+        Loads the prefix of a guild that is not cached yet, creating the guild if necessary.
+        :param guild: Guild object
+        :return: prefix of the guild
+        """
+        try:
+            prefix = DBGuild.objects.values_list('prefix', flat=True).get(g_id=guild.id)
+        except DBGuild.DoesNotExist:
+            prefix = DBGuild.objects.create(g_id=guild.id, name=guild.name).prefix
+
+        self.set(guild.id, prefix)
+        return prefix
+
+    def may_be_command(self, message: Message) -> bool:
+        """
+        Cheap check done before any db work. Returns False if the message can't start with the prefix
+        of its guild. Guilds that are not cached yet are checked against the first characters of all
+        known prefixes.
+        """
+        if message.guild is None:
+            return True
+
+        content = message.content
+        if not content:
+            self.dropped += 1
+            return False
+
+        prefix = self._prefixes.get(message.guild.id)
+        if prefix is not None:
+            possible = content.startswith(prefix)
+        else:
+            possible = content[0] in self._first_chars
+
+        if not possible:
+            self.dropped += 1
+        return possible
+
+
+prefix_cache = PrefixCache()
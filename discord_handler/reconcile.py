@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, List, Set, Tuple, Type
+
+from discord import Guild
+from django.db import connection, models, transaction
+
+from db.models import DBGuild, DBUser, DBChannel, DBRole
+from discord_handler.db_async import run_db
+from discord_handler.upsert import NATURAL_KEYS, snapshots
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ROWS = 5000
+BATCH_SIZE = 1000
+# guilds first, the other tables reference them
+MODELS: List[Type[models.Model]] = [DBGuild, DBChannel, DBRole, DBUser]
+# fields that follow the discord state, the same the get_* helpers keep up to date
+SYNC_FIELDS: Dict[Type[models.Model], Tuple[str, ...]] = {
+    DBGuild: ('name',),
+    DBChannel: ('channel_name',),
+    DBRole: ('role_name', 'role_color_r', 'role_color_g', 'role_color_b'),
+    DBUser: ('u_name', 'is_bot', 'avatar_url'),
+}
+# rows of a synced guild missing from the gateway cache are deleted. Channels and roles always come complete with
+# GUILD_CREATE. Members are kept: the member list is only complete for chunked guilds, and CommandStats rows
+# cascade with their DBUser
+PRUNED: List[Type[models.Model]] = [DBChannel, DBRole]
+
+
+class SyncStats:
+    def __init__(self):
+        self.examined: Dict[str, int] = {i.__name__: 0 for i in MODELS}
+        self.inserted: Dict[str, int] = {i.__name__: 0 for i in MODELS}
+        self.updated: Dict[str, int] = {i.__name__: 0 for i in MODELS}
+        self.deleted: Dict[str, int] = {i.__name__: 0 for i in MODELS}
+        self.guilds = 0
+        self.duration = 0.0
+
+    @property
+    def rows_examined(self) -> int:
+        return sum(self.examined.values())
+
+    @property
+    def rows_written(self) -> int:
+        return sum(self.inserted.values()) + sum(self.updated.values()) + sum(self.deleted.values())
+
+    def report(self) -> str:
+        duration = self.duration or float('inf')
+        text = f"{self.guilds} guilds in {self.duration:.2f}s, {self.rows_examined} rows examined " \
+               f"({self.rows_examined / duration:.0f}/s), {self.rows_written} written " \
+               f"({self.rows_written / duration:.0f}/s)\n"
+        for i in MODELS:
+            name = i.__name__
+            text += f"{name}: examined {self.examined[name]}, inserted {self.inserted[name]}, " \
+                    f"updated {self.updated[name]}, deleted {self.deleted[name]}\n"
+        return text
+
+
+def guild_rows(guild: Guild) -> Dict[Type[models.Model], List[dict]]:
+    """
+    Plain copy of the state of a guild in the gateway cache. Needs to run on the event loop, the cache
+    changes while the db threads work.
+    """
+    return {
+        DBGuild: [{'g_id': guild.id, 'name': guild.name}],
+        DBChannel: [{'g_id': guild.id, 'channel_id': i.id, 'channel_name': i.name} for i in guild.channels],
+        DBRole: [{'g_id': guild.id, 'role_id': i.id, 'role_name': i.name, 'role_color_r': i.color.r,
+                  'role_color_g': i.color.g, 'role_color_b': i.color.b} for i in guild.roles],
+        DBUser: [{'g_id': guild.id, 'u_id': i.id, 'u_name': i.display_name, 'is_bot': i.bot,
+                  'avatar_url': str(i.avatar_url)} for i in guild.members],
+    }
+
+
+def apply(model: Type[models.Model], rows: List[dict]) -> Tuple[int, int]:
+    """
+    Diffs rows against the db and writes the difference with bulk_create(ignore_conflicts=True), an
+    INSERT ... ON CONFLICT DO NOTHING, and bulk_update. Afterwards the rows are loaded into the snapshot cache
+    of the upsert layer, so the get_* helpers don't query them again. Blocking, use it from the db thread pool.
+    :return: rows inserted and updated
+    """
+    keys = NATURAL_KEYS[model]
+    fields = SYNC_FIELDS[model]
+
+    def lookup() -> Dict[tuple, models.Model]:
+        # one query per chunk, filtering on every key column gives a superset of the rows of the chunk
+        return {tuple(getattr(i, k) for k in keys): i
+                for i in model.objects.filter(**{f"{k}__in": {r[k] for r in rows} for k in keys})}
+
+    existing = lookup()
+    new, changed = [], []
+    for row in rows:
+        obj = existing.get(tuple(row[k] for k in keys))
+        if obj is None:
+            new.append(model(**row))
+        elif any(getattr(obj, f) != row[f] for f in fields):
+            for f in fields:
+                setattr(obj, f, row[f])
+            changed.append(obj)
+
+    with transaction.atomic():
+        if new:
+            # bulk_create doesn't cap a given batch size at what the backend supports, bulk_update does
+            batch_size = min(BATCH_SIZE, connection.ops.bulk_batch_size(model._meta.concrete_fields, new))
+            model.objects.bulk_create(new, batch_size=batch_size, ignore_conflicts=True)
+            existing = lookup()
+        if changed:
+            model.objects.bulk_update(changed, fields, batch_size=BATCH_SIZE)
+
+    # bulk writes send no post_save, so the snapshots are updated here
+    wanted = {tuple(row[k] for k in keys) for row in rows}
+    for key, obj in existing.items():
+        if key in wanted:
+            snapshots.put(obj)
+    return len(new), len(changed)
+
+
+def prune(model: Type[models.Model], g_ids: Set[int], rows: List[dict]) -> int:
+    """
+    Deletes the rows of the guilds g_ids that are not in rows, i.e. deleted channels and roles. rows has to hold
+    every row of these guilds. Blocking, use it from the db thread pool.
+    :return: rows deleted
+    """
+    keys = NATURAL_KEYS[model]
+    wanted = {tuple(row[k] for k in keys) for row in rows}
+    stale = [pk for pk, *key in model.objects.filter(g_id__in=g_ids).values_list('pk', *keys)
+             if tuple(key) not in wanted]
+    deleted = 0
+    for i in range(0, len(stale), BATCH_SIZE):
+        # a queryset delete sends post_delete, so the snapshots and the caches of other workers follow
+        deleted += model.objects.filter(pk__in=stale[i:i + BATCH_SIZE]).delete()[1].get(model._meta.label, 0)
+    return deleted
+
+
+def _chunks(rows: List[dict], size: int) -> Iterable[List[dict]]:
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+class Reconciler:
+    """
+    Brings DBGuild, DBChannel, DBRole and DBUser in line with the gateway cache in chunks of about CHUNK_ROWS
+    rows, instead of creating the rows one by one the first time they are used, and deletes the channels and
+    roles that no longer exist. Members that left are kept, see PRUNED. Runs on on_ready for all guilds and on
+    on_guild_join for the new one.
+    """
+
+    def __init__(self, chunk_rows: int = CHUNK_ROWS):
+        self.chunk_rows = chunk_rows
+        self.last: SyncStats = None
+        self._lock = asyncio.Lock()
+
+    async def _flush(self, pending: Dict[Type[models.Model], List[dict]], g_ids: Set[int], stats: SyncStats):
+        for model in MODELS:
+            for chunk in _chunks(pending[model], self.chunk_rows):
+                inserted, updated = await run_db(apply, model, chunk)
+                stats.examined[model.__name__] += len(chunk)
+                stats.inserted[model.__name__] += inserted
+                stats.updated[model.__name__] += updated
+            if model in PRUNED and g_ids:
+                stats.deleted[model.__name__] += await run_db(prune, model, g_ids, pending[model])
+            pending[model] = []
+        g_ids.clear()
+
+    async def sync(self, guilds: Iterable[Guild]) -> SyncStats:
+        """
+        Syncs the guilds. Concurrent calls run one after the other.
+        :return: rows examined and written
+        """
+        async with self._lock:
+            stats = SyncStats()
+            start = time.perf_counter()
+            pending: Dict[Type[models.Model], List[dict]] = {i: [] for i in MODELS}
+            # guilds of pending, the rows of a guild are always flushed together
+            g_ids: Set[int] = set()
+            nr_of_rows = 0
+            for guild in list(guilds):
+                if guild.unavailable:
+                    continue
+                for model, rows in guild_rows(guild).items():
+                    pending[model] += rows
+                    nr_of_rows += len(rows)
+                g_ids.add(guild.id)
+                stats.guilds += 1
+                if nr_of_rows >= self.chunk_rows:
+                    await self._flush(pending, g_ids, stats)
+                    nr_of_rows = 0
+            await self._flush(pending, g_ids, stats)
+
+            stats.duration = time.perf_counter() - start
+            self.last = stats
+            logger.info(f"Synced the db with the gateway cache: {stats.report()}")
+            return stats
+
+
+reconciler = Reconciler()
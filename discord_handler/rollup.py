@@ -0,0 +1,182 @@
+import datetime
+import logging
+from typing import Callable, Dict, List, Tuple, Type
+
+from django.db import connection, models, transaction
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from db.models import CommandStats, GuildStats, UserStats, CommandStatsRollup, GuildStatsRollup, UserStatsRollup, \
+    RollupWatermark
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_BATCH = 20000
+# rows written less than this ago are left for the next run, so transactions that got a lower id but commit
+# later are not skipped by the watermark
+SETTLE_TIME = 60
+HOURLY_RETENTION = 30
+PERIODS = [("h", TruncHour), ("d", TruncDay)]
+
+
+class RollupJob:
+    """
+    Rolls up one append only stats table into hourly and daily buckets. The id of the last processed row is
+    kept as watermark in RollupWatermark, so every run only reads new rows. Counts of a bucket are added to
+    what is already stored, values in latest are overwritten by the newer batch.
+    """
+
+    def __init__(self, source: Type[models.Model], target: Type[models.Model], keys: Tuple[str, ...],
+                 sums: Tuple[str, ...], aggregate: Callable, latest: Tuple[str, ...] = (),
+                 written: str = 'timestamp'):
+        """
+        :param aggregate: function taking the source queryset of the batch and a Trunc function, returning
+        one dict per bucket with the keys, sums and latest fields of target (without period)
+        :param written: field set when the row is inserted, the settle time is measured on it
+        """
+        self.name = source._meta.db_table
+        self.source = source
+        self.target = target
+        self.keys = ('period',) + keys
+        self.sums = sums
+        self.latest = latest
+        self.aggregate = aggregate
+        self.written = written
+
+    def run_batch(self, batch_size: int = ROLLUP_BATCH) -> int:
+        """
+        Rolls up the next batch of rows. Blocking, use it from the db thread pool.
+        :return: number of source rows processed
+        """
+        with transaction.atomic():
+            # serializes concurrent runs of several processes on the watermark row
+            RollupWatermark.objects.get_or_create(name=self.name)
+            watermark = RollupWatermark.objects.select_for_update().get(name=self.name)
+
+            settled = timezone.now() - datetime.timedelta(seconds=SETTLE_TIME)
+            # every row below a settled row got its id before that row was inserted, so it is either visible by
+            # now or its transaction is open for longer than SETTLE_TIME
+            pending = self.source.objects.filter(id__gt=watermark.last_id, **{f'{self.written}__lt': settled})
+            last = list(pending.order_by('id').values_list('id', flat=True)[batch_size - 1:batch_size])
+            upper = last[0] if last else pending.aggregate(upper=Max('id'))['upper']
+            if upper is None:
+                return 0
+
+            rows = self.source.objects.filter(id__gt=watermark.last_id, id__lte=upper)
+            for period, trunc in PERIODS:
+                self.upsert([dict(i, period=period) for i in self.aggregate(rows, trunc)])
+
+            processed = rows.count()
+            watermark.last_id = upper
+            watermark.updated = timezone.now()
+            watermark.save()
+        return processed
+
+    def upsert(self, buckets: List[dict]):
+        if not buckets:
+            return
+        meta = self.target._meta
+        qn = connection.ops.quote_name
+        table = qn(meta.db_table)
+        fields = [meta.get_field(i) for i in self.keys + self.sums + self.latest]
+        updates = [f"{qn(i)} = {table}.{qn(i)} + EXCLUDED.{qn(i)}" for i in self.sums] + \
+                  [f"{qn(i)} = EXCLUDED.{qn(i)}" for i in self.latest]
+        sql = f"INSERT INTO {table} ({', '.join(qn(f.column) for f in fields)}) " \
+              f"VALUES ({', '.join(['%s'] * len(fields))}) " \
+              f"ON CONFLICT ({', '.join(qn(meta.get_field(i).column) for i in self.keys)}) " \
+              f"DO UPDATE SET {', '.join(updates)}"
+        params = [[f.get_db_prep_save(i[f.name], connection) for f in fields] for i in buckets]
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+
+
+def _latest_total(rows, buckets: List[dict]) -> List[dict]:
+    """
+    Sets total_count of every bucket to the one of its last row.
+    """
+    last_ids = {i.pop('last_id'): i for i in buckets}
+    for row_id, total_count in rows.filter(id__in=last_ids.keys()).values_list('id', 'total_count'):
+        last_ids[row_id]['total_count'] = total_count
+    return buckets
+
+
+def aggregate_commands(rows, trunc) -> List[dict]:
+    buckets = rows.annotate(bucket=trunc('timestamp')).values('bucket', 'g_id', 'command_id') \
+        .annotate(count=Count('id')).order_by()
+    return [{'bucket': i['bucket'], 'g_id': i['g_id'] or 0, 'command': i['command_id'], 'count': i['count']}
+            for i in buckets]
+
+
+def aggregate_guilds(rows, trunc) -> List[dict]:
+    buckets = rows.annotate(bucket=trunc('timestamp')).values('bucket') \
+        .annotate(joined=Count('id', filter=Q(count__gt=0)), left=Count('id', filter=Q(count__lt=0)),
+                  last_id=Max('id')).order_by()
+    return _latest_total(rows, list(buckets))
+
+
+def aggregate_users(rows, trunc) -> List[dict]:
+    buckets = rows.annotate(bucket=trunc('timestamp')).values('bucket') \
+        .annotate(added=Count('id'), last_id=Max('id')).order_by()
+    return _latest_total(rows, list(buckets))
+
+
+class Rollups:
+    def __init__(self):
+        self.jobs = [
+            RollupJob(CommandStats, CommandStatsRollup, ('bucket', 'g_id', 'command'), ('count',),
+                      aggregate_commands, written='created'),
+            RollupJob(GuildStats, GuildStatsRollup, ('bucket',), ('joined', 'left'), aggregate_guilds,
+                      ('total_count',)),
+            RollupJob(UserStats, UserStatsRollup, ('bucket',), ('added',), aggregate_users, ('total_count',)),
+        ]
+        self.runs = 0
+        self.processed: Dict[str, int] = {i.name: 0 for i in self.jobs}
+
+    def run(self, batch_size: int = ROLLUP_BATCH) -> Dict[str, int]:
+        """
+        Brings all rollups up to date, batch by batch, and drops hourly buckets older than HOURLY_RETENTION
+        days. Blocking, use it from the db thread pool.
+        :return: rows processed per source table
+        """
+        processed = {}
+        for job in self.jobs:
+            processed[job.name] = 0
+            while True:
+                nr = job.run_batch(batch_size)
+                processed[job.name] += nr
+                if nr < batch_size:
+                    break
+            self.processed[job.name] += processed[job.name]
+
+        expired = timezone.now() - datetime.timedelta(days=HOURLY_RETENTION)
+        for job in self.jobs:
+            job.target.objects.filter(period='h', bucket__lt=expired).delete()
+        self.runs += 1
+        return processed
+
+
+rollups = Rollups()
+
+
+def _since(nr_of_days: int) -> datetime.datetime:
+    # buckets are truncated in the current time zone
+    return timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(nr_of_days - 1)
+
+
+def command_usage(nr_of_days: int, nr_of_commands: int = 10) -> List[Tuple[str, int, int]]:
+    """
+    Most used commands of the last nr_of_days days from the daily rollup.
+    :return: command name, invocations and number of guilds
+    """
+    rows = CommandStatsRollup.objects.filter(period='d', bucket__gte=_since(nr_of_days)).values('command') \
+        .annotate(total=Sum('count'), guilds=Count('g_id', distinct=True)).order_by('-total')[:nr_of_commands]
+    return [(i['command'], i['total'], i['guilds']) for i in rows]
+
+
+def guild_growth(nr_of_days: int) -> List[GuildStatsRollup]:
+    return list(GuildStatsRollup.objects.filter(period='d', bucket__gte=_since(nr_of_days)).order_by('bucket'))
+
+
+def user_growth(nr_of_days: int) -> List[UserStatsRollup]:
+    return list(UserStatsRollup.objects.filter(period='d', bucket__gte=_since(nr_of_days)).order_by('bucket'))
@@ -0,0 +1,673 @@
+import asyncio
+import base64
+import io
+import itertools
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Set, Tuple, Union
+
+import aiohttp
+from discord import File, HTTPException, Forbidden, NotFound, DiscordServerError
+from discord.http import HTTPClient, Route
+from django.db.models.signals import post_save, post_delete
+
+from db.models import DBGuild, DBUser, ModRole
+from discord_handler.permissions import permissions
+from discord_handler.prefix_cache import prefix_cache
+from discord_handler.upsert import SnapshotCache, snapshots
+from discord_handler.wire import FrameTooLarge, encode, read_message, write_message
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = "/tmp/dbot.sock"
+
+# routed events that may be shed when a worker falls behind, state changing events are never dropped
+DROPPABLE = {'MESSAGE_CREATE', 'MESSAGE_UPDATE', 'TYPING_START', 'MESSAGE_REACTION_ADD',
+             'MESSAGE_REACTION_REMOVE'}
+# guild events that are not kept for the state replay of a (re)connecting worker
+NOT_REPLAYED = {'PRESENCE_UPDATE', 'TYPING_START', 'GUILD_MEMBERS_CHUNK', 'GUILD_BAN_ADD', 'GUILD_BAN_REMOVE',
+                'INVITE_CREATE', 'INVITE_DELETE', 'WEBHOOKS_UPDATE', 'GUILD_INTEGRATIONS_UPDATE'}
+# events of the entities of a guild, the replay keeps their last state per entity
+REPLAY_FAMILIES = {
+    'CHANNEL_CREATE': 'channel', 'CHANNEL_UPDATE': 'channel', 'CHANNEL_DELETE': 'channel',
+    'GUILD_ROLE_CREATE': 'role', 'GUILD_ROLE_UPDATE': 'role', 'GUILD_ROLE_DELETE': 'role',
+    'GUILD_MEMBER_ADD': 'member', 'GUILD_MEMBER_UPDATE': 'member', 'GUILD_MEMBER_REMOVE': 'member',
+}
+CREATE_EVENTS = {'CHANNEL_CREATE', 'GUILD_ROLE_CREATE', 'GUILD_MEMBER_ADD'}
+DELETE_EVENTS = {'CHANNEL_DELETE', 'GUILD_ROLE_DELETE', 'GUILD_MEMBER_REMOVE'}
+# dispatched by the ready task of discord.py once the guilds of a READY arrived
+READY_EVENTS = {'ready', 'guild_available', 'guild_join'}
+
+
+def is_routed(t: str) -> bool:
+    """
+    Events only handled by the worker of their channel. They don't change the cache of the other workers, all
+    other events with a channel_id (voice states, pins, invites, channel updates) do and are broadcast.
+    """
+    return t.startswith('MESSAGE_') or t == 'TYPING_START'
+
+
+def replay_key(t: str, d: dict) -> tuple:
+    """
+    Entity of a guild event, only the last state of an entity is replayed.
+    """
+    family = REPLAY_FAMILIES.get(t)
+    if family == 'channel':
+        return family, d.get('id')
+    if family == 'role':
+        return family, d['role'].get('id') if 'role' in d else d.get('role_id')
+    if family == 'member':
+        return family, d.get('user', {}).get('id')
+    if t == 'VOICE_STATE_UPDATE':
+        return t, d.get('user_id')
+    # GUILD_UPDATE and GUILD_EMOJIS_UPDATE carry the full state, discord.py ignores the events not handled here
+    return t,
+
+
+class ReplayEntry:
+    """
+    Events replayed for one entity of a guild: the last update, after the create or delete if the entity is
+    not the one of the GUILD_CREATE.
+    """
+    __slots__ = ('in_snapshot', 'events')
+
+    def __init__(self, in_snapshot: bool):
+        self.in_snapshot = in_snapshot
+        self.events: List[Tuple[str, dict]] = []
+
+    def add(self, t: str, d: dict) -> bool:
+        """
+        :return: False if nothing is left to replay, the entity was created and deleted after the snapshot
+        """
+        if t in DELETE_EVENTS:
+            self.events = [(t, d)]
+            return self.in_snapshot
+        if t in CREATE_EVENTS:
+            # rejoining members and the like keep the delete of the entity of the snapshot
+            self.events = [i for i in self.events if i[0] in DELETE_EVENTS] + [(t, d)]
+        else:
+            self.events = [i for i in self.events if i[0] in CREATE_EVENTS or i[0] in DELETE_EVENTS] + [(t, d)]
+        return True
+
+
+class WorkerLink:
+    """
+    Connection of the gateway to one worker. Dispatches are queued in a bounded backlog and sent with at
+    most max_in_flight unacked frames, control frames (pings, http results) go first and ignore the window.
+    """
+
+    def __init__(self, worker_id: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 max_in_flight: int, max_backlog: int):
+        self.worker_id = worker_id
+        self.reader = reader
+        self.writer = writer
+        self.max_in_flight = max_in_flight
+        self.max_backlog = max_backlog
+        self.backlog: Deque[bytes] = deque()
+        self.control: Deque[bytes] = deque()
+        self.in_flight = 0
+        self.last_pong = time.monotonic()
+        self.worker_backlog = 0
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._task: Union[asyncio.Task, None] = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._send_loop())
+
+    def push(self, frame: bytes, droppable: bool = False) -> bool:
+        if droppable and len(self.backlog) >= self.max_backlog:
+            self.dropped += 1
+            return False
+        self.backlog.append(frame)
+        self._wakeup.set()
+        return True
+
+    def push_control(self, frame: bytes):
+        self.control.append(frame)
+        self._wakeup.set()
+
+    def ack(self):
+        self.in_flight = max(0, self.in_flight - 1)
+        self._wakeup.set()
+
+    async def _send_loop(self):
+        try:
+            while not self.closed:
+                if not self.control and (not self.backlog or self.in_flight >= self.max_in_flight):
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                while self.control:
+                    self.writer.write(self.control.popleft())
+                while self.backlog and self.in_flight < self.max_in_flight:
+                    self.writer.write(self.backlog.popleft())
+                    self.in_flight += 1
+                    self.sent += 1
+                await self.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    def close(self):
+        self.closed = True
+        self._wakeup.set()
+        if self._task is not None:
+            self._task.cancel()
+        self.writer.close()
+
+
+class GatewayBridge:
+    """
+    Gateway side of the split mode. Every raw gateway event is forwarded to the workers over a Unix socket:
+    message and typing events go to one worker chosen by the channel id, so all messages of a channel are
+    handled in order by the same worker, everything else changes the cache and is broadcast, so every worker
+    keeps its cache, and is dispatched on the first worker only. (Re)connecting workers get the READY, the
+    GUILD_CREATE of every guild and the last state of every entity changed since. The REST requests of the
+    workers are executed with the http client of the gateway. The wire format is documented in
+    discord_handler.wire.
+    """
+
+    def __init__(self, bot, socket_path: str = DEFAULT_SOCKET, max_in_flight: int = 256, max_backlog: int = 10000,
+                 health_interval: float = 5, health_timeout: float = 15):
+        self.bot = bot
+        self.socket_path = socket_path
+        self.max_in_flight = max_in_flight
+        self.max_backlog = max_backlog
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.links: Dict[int, WorkerLink] = {}
+        self._order: List[WorkerLink] = []
+        self._seq = itertools.count(1)
+        self._ready: Union[dict, None] = None
+        self._guilds: Dict[int, dict] = {}
+        self._guild_events: Dict[int, 'OrderedDict[tuple, ReplayEntry]'] = {}
+        self._server: Union[asyncio.AbstractServer, None] = None
+        self._health_task: Union[asyncio.Task, None] = None
+        self.forwarded = 0
+        self.unrouted = 0
+        self.http_requests = 0
+        self.invalidations = 0
+        self.too_large = 0
+
+    @property
+    def dropped(self) -> int:
+        return sum(i.dropped for i in self.links.values())
+
+    async def start(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._accept, path=self.socket_path)
+        self._health_task = asyncio.ensure_future(self._health_loop())
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+        for link in list(self.links.values()):
+            link.close()
+        self.links.clear()
+        self._order = []
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def _frame(self, t: str, d, dispatch: bool) -> bytes:
+        return encode({'op': 'dispatch', 'seq': next(self._seq), 't': t, 'd': d, 'dispatch': dispatch})
+
+    def _record(self, t: str, d):
+        if t == 'READY':
+            self._ready = d
+            self._guilds.clear()
+            self._guild_events.clear()
+        elif t == 'GUILD_CREATE':
+            self._guilds[int(d['id'])] = d
+            self._guild_events[int(d['id'])] = OrderedDict()
+        elif t == 'GUILD_DELETE':
+            if not d.get('unavailable'):
+                self._guilds.pop(int(d['id']), None)
+                self._guild_events.pop(int(d['id']), None)
+        elif t not in NOT_REPLAYED and not is_routed(t) and isinstance(d, dict):
+            g_id = d.get('guild_id') if t != 'GUILD_UPDATE' else d.get('id')
+            events = self._guild_events.get(int(g_id)) if g_id is not None else None
+            if events is None:
+                return
+            key = replay_key(t, d)
+            entry = events.get(key)
+            if entry is None:
+                entry = events[key] = ReplayEntry(t not in CREATE_EVENTS)
+            if entry.add(t, d):
+                events.move_to_end(key)
+            else:
+                events.pop(key)
+
+    def forward(self, msg: dict):
+        """
+        Forwards a raw gateway payload. Called synchronously for every received payload, so the order of the
+        gateway is kept.
+        """
+        if msg.get('op') != 0 or msg.get('t') is None:
+            return
+        t, d = msg['t'], msg['d']
+        self._record(t, d)
+        if not self._order:
+            self.unrouted += 1
+            return
+        # called from the websocket loop of discord.py, an exception here would end the connection
+        try:
+            channel_id = d.get('channel_id') if isinstance(d, dict) and is_routed(t) else None
+            if channel_id is not None:
+                link = self._order[int(channel_id) % len(self._order)]
+                link.push(self._frame(t, d, True), t in DROPPABLE)
+            else:
+                first = self._frame(t, d, True)
+                rest = self._frame(t, d, False) if len(self._order) > 1 else None
+                for nr, link in enumerate(self._order):
+                    link.push(first if nr == 0 else rest)
+        except FrameTooLarge as e:
+            self._too_large(t, e)
+            return
+        self.forwarded += 1
+
+    def _too_large(self, t: str, e: FrameTooLarge):
+        self.too_large += 1
+        logger.warning(f"Dropped {t}: {e}")
+
+    def _replay(self, link: WorkerLink):
+        if self._ready is None:
+            return
+        replay = [('READY', self._ready)]
+        for g_id, d in self._guilds.items():
+            replay.append(('GUILD_CREATE', d))
+            replay += [i for entry in self._guild_events[g_id].values() for i in entry.events]
+        for t, d in replay:
+            try:
+                link.push(self._frame(t, d, False))
+            except FrameTooLarge as e:
+                self._too_large(t, e)
+
+    def _add(self, link: WorkerLink):
+        old = self.links.get(link.worker_id)
+        if old is not None:
+            old.close()
+        self.links[link.worker_id] = link
+        self._order = [self.links[i] for i in sorted(self.links.keys())]
+
+    def _remove(self, link: WorkerLink):
+        link.close()
+        if self.links.get(link.worker_id) is link:
+            self.links.pop(link.worker_id)
+            self._order = [self.links[i] for i in sorted(self.links.keys())]
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        hello = await read_message(reader)
+        if hello is None or hello.get('op') != 'hello':
+            writer.close()
+            return
+        link = WorkerLink(int(hello['worker']), reader, writer, self.max_in_flight, self.max_backlog)
+        logger.info(f"Worker {link.worker_id} connected (pid {hello.get('pid')})")
+        self._replay(link)
+        self._add(link)
+        link.start()
+
+        while not link.closed:
+            msg = await read_message(reader)
+            if msg is None:
+                break
+            op = msg.get('op')
+            if op == 'ack':
+                link.ack()
+            elif op == 'pong':
+                link.last_pong = time.monotonic()
+                link.worker_backlog = msg.get('backlog', 0)
+            elif op == 'http':
+                asyncio.ensure_future(self._http(link, msg))
+            elif op == 'invalidate':
+                self.invalidate(link, msg)
+
+        logger.warning(f"Worker {link.worker_id} disconnected")
+        self._remove(link)
+
+    def invalidate(self, origin: WorkerLink, msg: dict):
+        """
+        Relays a cache invalidation of a worker to all other workers.
+        """
+        self.invalidations += 1
+        frame = encode(msg)
+        for link in self._order:
+            if link is not origin:
+                link.push_control(frame)
+
+    async def _http(self, link: WorkerLink, msg: dict):
+        self.http_requests += 1
+        route = Route.__new__(Route)
+        route.method, route.path, route.url = msg['method'], msg['path'], msg['url']
+        route.channel_id, route.guild_id = msg.get('channel_id'), msg.get('guild_id')
+
+        form, files = None, None
+        if msg.get('form') is not None:
+            form, files = [], []
+            for i in msg['form']:
+                i = dict(i)
+                if i.pop('b64', False):
+                    f = File(io.BytesIO(base64.b64decode(i['value'])), i.get('filename'))
+                    files.append(f)
+                    i['value'] = f.fp
+                form.append(i)
+
+        try:
+            data = await self.bot.http.request(route, files=files, form=form, **msg.get('kwargs', {}))
+            result = {'op': 'http_result', 'id': msg['id'], 'data': data}
+        except HTTPException as e:
+            result = {'op': 'http_error', 'id': msg['id'], 'status': e.status,
+                      'reason': getattr(e.response, 'reason', ''), 'message': {'code': e.code, 'message': e.text}}
+        except Exception as e:
+            result = {'op': 'http_error', 'id': msg['id'], 'status': 500, 'reason': f'{type(e).__name__}',
+                      'message': f'{e}'}
+        if link.closed:
+            return
+        try:
+            frame = encode(result)
+        except FrameTooLarge as e:
+            self._too_large(f"the result of {msg['method']} {msg['path']}", e)
+            frame = encode({'op': 'http_error', 'id': msg['id'], 'status': 500, 'reason': 'FrameTooLarge',
+                            'message': f'{e}'})
+        link.push_control(frame)
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            now = time.monotonic()
+            for link in list(self.links.values()):
+                if now - link.last_pong > self.health_timeout:
+                    logger.warning(f"Worker {link.worker_id} missed its health checks, disconnecting")
+                    self._remove(link)
+                else:
+                    link.push_control(encode({'op': 'ping', 'nonce': now}))
+
+
+class GatewayMixin:
+    """
+    Bot holding the gateway connection in split mode. Runs no commands, forwards every event to the workers.
+    """
+
+    def __init__(self, *args, socket_path: str = DEFAULT_SOCKET, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bridge = GatewayBridge(self, socket_path)
+
+    async def start(self, *args, **kwargs):
+        await self.bridge.start()
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        await self.bridge.close()
+        await super().close()
+
+    def dispatch(self, event_name, *args, **kwargs):
+        if event_name == 'socket_response':
+            self.bridge.forward(args[0])
+        super().dispatch(event_name, *args, **kwargs)
+
+    async def process_commands(self, message):
+        # commands run on the workers, the gateway has no prefixes loaded
+        return
+
+
+class _Response:
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+
+class BridgeHTTPClient(HTTPClient):
+    """
+    Http client of a worker, every request is executed by the gateway. A worker never logs in, CDN downloads
+    (Attachment.read, Asset.read) need no token and use a session of the worker.
+    """
+
+    def __init__(self, worker: 'Worker', loop=None):
+        super().__init__(loop=loop)
+        self.worker = worker
+        self._cdn_session: Union[aiohttp.ClientSession, None] = None
+
+    async def request(self, route, *, files=None, form=None, **kwargs):
+        return await self.worker.http(route, form, kwargs)
+
+    async def get_from_cdn(self, url):
+        if self._cdn_session is None or self._cdn_session.closed:
+            self._cdn_session = aiohttp.ClientSession(connector=self.connector)
+        async with self._cdn_session.get(url) as resp:
+            if resp.status == 200:
+                return await resp.read()
+            elif resp.status == 404:
+                raise NotFound(resp, 'asset not found')
+            elif resp.status == 403:
+                raise Forbidden(resp, 'cannot retrieve asset')
+            else:
+                raise HTTPException(resp, 'failed to get asset')
+
+    async def close(self):
+        if self._cdn_session is not None:
+            await self._cdn_session.close()
+        await super().close()
+
+
+class WorkerMixin:
+    """
+    Bot running the cogs in split mode. Gets its events from the gateway process instead of a websocket.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dispatch_enabled = True
+        # dispatch flag of the last READY, discord.py dispatches the ready events later from its ready task
+        self.ready_dispatch = True
+        self.active_events: Set[asyncio.Task] = set()
+
+    def dispatch(self, event_name, *args, **kwargs):
+        if not self.dispatch_enabled:
+            return
+        if event_name in READY_EVENTS and not self.ready_dispatch and self._connection._ready_task is not None:
+            return
+        super().dispatch(event_name, *args, **kwargs)
+
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        task = super()._schedule_event(coro, event_name, *args, **kwargs)
+        self.active_events.add(task)
+        task.add_done_callback(self.active_events.discard)
+        return task
+
+
+class Worker:
+    """
+    Worker side of the split mode. Applies the forwarded events to the discord.py state of the bot, so the
+    cogs run as usual, and sends the REST requests of the bot to the gateway. Backpressure: a dispatch is only
+    acked once fewer than max_active event handlers are running, so a slow worker fills its window on the
+    gateway instead of queueing without limit.
+    """
+
+    def __init__(self, bot, socket_path: str = DEFAULT_SOCKET, worker_id: int = 0, max_active: int = 200,
+                 reconnect_delay: float = 1, max_reconnect_delay: float = 30):
+        self.bot = bot
+        self.socket_path = socket_path
+        self.worker_id = worker_id
+        self.max_active = max_active
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self._writer: Union[asyncio.StreamWriter, None] = None
+        self._write_lock = asyncio.Lock()
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self.applied = 0
+
+        bot.http = BridgeHTTPClient(self, loop=bot.loop)
+        bot._connection.http = bot.http
+        # set by login on a connected bot, a worker never logs in
+        bot._connection.is_bot = True
+
+        # rows cached by every worker, a change made by one worker is sent to the others
+        for model in (DBGuild, DBUser, ModRole):
+            post_save.connect(self._on_change, sender=model, dispatch_uid=f'split_save_{model.__name__}')
+            post_delete.connect(self._on_change, sender=model, dispatch_uid=f'split_delete_{model.__name__}')
+
+    def _on_change(self, sender, instance, raw=False, **kwargs):
+        # runs on a db thread
+        if raw:
+            return
+        if sender is DBGuild:
+            msg = {'op': 'invalidate', 'cache': 'guild', 'g_id': instance.g_id}
+        elif sender is DBUser:
+            msg = {'op': 'invalidate', 'cache': 'user', 'g_id': instance.g_id, 'u_id': instance.u_id}
+        else:
+            msg = {'op': 'invalidate', 'cache': 'mod_roles', 'g_id': instance.g_id}
+        self.bot.loop.call_soon_threadsafe(self._send_invalidation, msg)
+
+    def _send_invalidation(self, msg: dict):
+        async def send():
+            try:
+                await self._write(msg)
+            except ConnectionError:
+                logger.warning(f"Gateway not connected, the other workers keep the cached {msg['cache']} "
+                               f"{msg['g_id']}")
+
+        asyncio.ensure_future(send())
+
+    @staticmethod
+    def invalidate(msg: dict):
+        """
+        Drops a row another worker changed from the caches of this worker.
+        """
+        g_id = msg['g_id']
+        if msg['cache'] == 'guild':
+            prefix_cache.invalidate(g_id)
+            snapshots.discard(SnapshotCache.key(DBGuild, {'g_id': g_id}))
+        elif msg['cache'] == 'user':
+            snapshots.discard(SnapshotCache.key(DBUser, {'u_id': msg['u_id'], 'g_id': g_id}))
+            permissions.invalidate_member(g_id, msg['u_id'])
+        elif msg['cache'] == 'mod_roles':
+            permissions.invalidate_guild(g_id)
+
+    async def _write(self, message: dict):
+        if self._writer is None:
+            raise ConnectionError("Not connected to the gateway")
+        async with self._write_lock:
+            await write_message(self._writer, message)
+
+    async def http(self, route: Route, form: Union[list, None], kwargs: dict):
+        message = {'op': 'http', 'id': next(self._ids), 'method': route.method, 'path': route.path,
+                   'url': route.url, 'channel_id': route.channel_id, 'guild_id': route.guild_id,
+                   'kwargs': kwargs, 'form': None}
+        if form is not None:
+            message['form'] = []
+            for i in form:
+                i = dict(i)
+                if not isinstance(i['value'], (str, bytes)):
+                    i['value'] = base64.b64encode(i['value'].read()).decode()
+                    i['b64'] = True
+                message['form'].append(i)
+
+        future = asyncio.get_event_loop().create_future()
+        self._pending[message['id']] = future
+        try:
+            await self._write(message)
+        except ConnectionError:
+            self._pending.pop(message['id'], None)
+            raise HTTPException(_Response(503, 'Gateway not connected'), 'Gateway not connected')
+        return await future
+
+    def _resolve(self, msg: dict):
+        future = self._pending.pop(msg['id'], None)
+        if future is None or future.done():
+            return
+        if msg['op'] == 'http_result':
+            future.set_result(msg['data'])
+            return
+        response = _Response(msg['status'], msg.get('reason', ''))
+        if response.status == 403:
+            error = Forbidden(response, msg['message'])
+        elif response.status == 404:
+            error = NotFound(response, msg['message'])
+        elif response.status >= 500:
+            error = DiscordServerError(response, msg['message'])
+        else:
+            error = HTTPException(response, msg['message'])
+        future.set_exception(error)
+
+    def apply(self, msg: dict):
+        parser = self.bot._connection.parsers.get(msg['t'])
+        if parser is None:
+            return
+        self.bot.dispatch_enabled = msg['dispatch']
+        if msg['t'] == 'READY':
+            self.bot.ready_dispatch = msg['dispatch']
+        try:
+            parser(msg['d'])
+        except Exception:
+            logger.exception(f"Failed to parse {msg['t']}")
+        finally:
+            self.bot.dispatch_enabled = True
+        self.applied += 1
+
+    async def _apply_loop(self, dispatches: asyncio.Queue):
+        while True:
+            msg = await dispatches.get()
+            self.apply(msg)
+            while len(self.bot.active_events) >= self.max_active:
+                await asyncio.wait(list(self.bot.active_events), return_when=asyncio.FIRST_COMPLETED)
+            await self._write({'op': 'ack', 'seq': msg['seq']})
+
+    async def _session(self, reader: asyncio.StreamReader):
+        # dispatches are applied by a separate task, so http results are still read while the acks wait for
+        # running handlers, which may themselves be waiting for an http result
+        dispatches = asyncio.Queue()
+        applier = asyncio.ensure_future(self._apply_loop(dispatches))
+        try:
+            while True:
+                msg = await read_message(reader)
+                if msg is None:
+                    return
+                op = msg.get('op')
+                if op == 'dispatch':
+                    dispatches.put_nowait(msg)
+                elif op == 'ping':
+                    await self._write({'op': 'pong', 'nonce': msg['nonce'],
+                                       'backlog': dispatches.qsize() + len(self.bot.active_events)})
+                elif op in ('http_result', 'http_error'):
+                    self._resolve(msg)
+                elif op == 'invalidate':
+                    self.invalidate(msg)
+        finally:
+            applier.cancel()
+
+    def _disconnected(self):
+        self._writer = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(HTTPException(_Response(503, 'Gateway disconnected'), 'Gateway disconnected'))
+        self._pending.clear()
+        # the gateway replays the whole state on the next hello
+        self.bot._connection.clear()
+
+    async def run(self):
+        delay = self.reconnect_delay
+        while not self.bot.is_closed():
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.socket_path)
+            except (ConnectionError, FileNotFoundError):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+
+            delay = self.reconnect_delay
+            self._writer = writer
+            try:
+                await self._write({'op': 'hello', 'worker': self.worker_id, 'pid': os.getpid()})
+                await self._session(reader)
+            except ConnectionError:
+                pass
+            finally:
+                self._disconnected()
+                writer.close()
+            logger.warning(f"Worker {self.worker_id} lost the gateway, reconnecting")
@@ -0,0 +1,114 @@
+import importlib.abc
+import importlib.machinery
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+
+class _TimingFinder(importlib.abc.MetaPathFinder):
+    """
+    Times the execution of every module loaded from a file, the same numbers python -X importtime reports.
+    """
+
+    def __init__(self, profile: 'StartupProfile'):
+        self.profile = profile
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        loader = spec.loader
+        if isinstance(loader, (importlib.machinery.SourceFileLoader, importlib.machinery.SourcelessFileLoader,
+                               importlib.machinery.ExtensionFileLoader)):
+            exec_module = loader.exec_module
+
+            def timed_exec_module(module):
+                self.profile.enter_import(fullname)
+                try:
+                    exec_module(module)
+                finally:
+                    self.profile.exit_import()
+
+            # loaders of file modules are created per module, so this only affects this module
+            loader.exec_module = timed_exec_module
+        return spec
+
+
+class StartupProfile:
+    """
+    Collects the duration of the startup phases and, once the import hook is installed, the import time of every
+    module. Printed by main.py --profile-startup.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self.imports: Dict[str, Tuple[float, float]] = {}
+        self._stack: List[List] = []
+        self._finder = None
+
+    def install_import_hook(self):
+        if self._finder is None:
+            self._finder = _TimingFinder(self)
+            sys.meta_path.insert(0, self._finder)
+
+    def remove_import_hook(self):
+        if self._finder is not None:
+            sys.meta_path.remove(self._finder)
+            self._finder = None
+
+    def enter_import(self, name: str):
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def exit_import(self):
+        name, start, children = self._stack.pop()
+        total = time.perf_counter() - start
+        if self._stack:
+            self._stack[-1][2] += total
+        self.imports[name] = (total - children, total)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def package_times(self) -> List[Tuple[str, float]]:
+        """
+        Self time of all imported modules, summed up per top level package.
+        """
+        packages: Dict[str, float] = {}
+        for name, (self_time, _) in self.imports.items():
+            package = name.split('.')[0]
+            packages[package] = packages.get(package, 0) + self_time
+        return sorted(packages.items(), key=lambda i: i[1], reverse=True)
+
+    def report(self, top: int = 20) -> str:
+        lines = ["Startup phases:"]
+        for name, duration in self.phases:
+            lines.append(f"  {name:<30} {duration * 1000:>9.1f}ms")
+        lines.append(f"  {'total':<30} {(time.perf_counter() - self.start) * 1000:>9.1f}ms")
+
+        if self.imports:
+            lines.append("")
+            lines.append(f"Import time per package (top {top}):")
+            for name, duration in self.package_times()[:top]:
+                lines.append(f"  {name:<30} {duration * 1000:>9.1f}ms")
+            lines.append("")
+            lines.append(f"Slowest modules, cumulative (top {top}):")
+            slowest = sorted(self.imports.items(), key=lambda i: i[1][1], reverse=True)[:top]
+            for name, (self_time, total) in slowest:
+                lines.append(f"  {name:<50} {total * 1000:>9.1f}ms (self {self_time * 1000:.1f}ms)")
+        return "\n".join(lines)
+
+
+startup_profile = StartupProfile()
@@ -0,0 +1,190 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Type, Tuple, Union
+
+from django.db import connection, models
+from django.db.models.signals import post_save, post_delete
+
+from db.models import DBGuild, DBUser, DBChannel, DBRole
+
+# natural key of every model handled by the upsert layer
+NATURAL_KEYS: Dict[Type[models.Model], Tuple[str, ...]] = {
+    DBGuild: ('g_id',),
+    DBUser: ('u_id', 'g_id'),
+    DBChannel: ('g_id', 'channel_id'),
+    DBRole: ('g_id', 'role_id'),
+}
+
+
+class UpsertStats:
+    """
+    Counters of the upsert layer. writes_skipped and fields_skipped are the writes the old always-save
+    helpers would have done and that were saved by dirty checking.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.cache_hits = 0
+        self.inserts = 0
+        self.updates = 0
+        self.writes_skipped = 0
+        self.fields_written = 0
+        self.fields_skipped = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(self.__dict__)
+
+    @property
+    def write_amplification_saved(self) -> float:
+        """
+        Share of calls that did not write, compared to one write per call before.
+        """
+        return self.writes_skipped / self.calls if self.calls else 0.0
+
+
+class SnapshotCache:
+    """
+    LRU cache of the last known db state of a row, keyed by model and natural key. Kept up to date by the
+    post_save/post_delete signals, so saves done outside of the upsert layer are seen as well. Saves of other
+    processes (clusters, the admin) send no signal here, so a snapshot is read again from the db after ttl
+    seconds.
+    """
+
+    def __init__(self, max_size: int = 100000, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: 'OrderedDict[tuple, Tuple[Dict[str, object], float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    @staticmethod
+    def key(model: Type[models.Model], values: dict) -> tuple:
+        return (model,) + tuple(values[i] for i in NATURAL_KEYS[model])
+
+    def get(self, key: tuple) -> Union[Dict[str, object], None]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def put(self, instance: models.Model):
+        snapshot = {f.attname: getattr(instance, f.attname) for f in instance._meta.concrete_fields}
+        key = self.key(type(instance), snapshot)
+        with self._lock:
+            self._data[key] = (snapshot, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            if len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def evict(self, instance: models.Model):
+        values = {f.attname: getattr(instance, f.attname) for f in instance._meta.concrete_fields}
+        self.discard(self.key(type(instance), values))
+
+    def discard(self, key: tuple):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+upsert_stats = UpsertStats()
+snapshots = SnapshotCache()
+
+
+def _from_snapshot(model: Type[models.Model], snapshot: Dict[str, object]) -> models.Model:
+    fields = model._meta.concrete_fields
+    return model.from_db(connection.alias, [f.attname for f in fields], [snapshot[f.attname] for f in fields])
+
+
+def _insert(model: Type[models.Model], obj: models.Model) -> bool:
+    """
+    Inserts obj with a single INSERT ... ON CONFLICT DO NOTHING. Returns False if the row already existed.
+    """
+    meta = model._meta
+    qn = connection.ops.quote_name
+    fields = [f for f in meta.concrete_fields if not isinstance(f, models.AutoField)]
+    sql = f"INSERT INTO {qn(meta.db_table)} ({', '.join(qn(f.column) for f in fields)}) " \
+          f"VALUES ({', '.join(['%s'] * len(fields))}) " \
+          f"ON CONFLICT ({', '.join(qn(meta.get_field(i).column) for i in NATURAL_KEYS[model])}) DO NOTHING " \
+          f"RETURNING {qn(meta.pk.column)}"
+    params = [f.get_db_prep_save(f.pre_save(obj, True), connection) for f in fields]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+
+    if row is None:
+        return False
+
+    obj.pk = row[0]
+    obj._state.adding = False
+    obj._state.db = connection.alias
+    return True
+
+
+def upsert(model: Type[models.Model], lookup: dict, values: dict = None, defaults: dict = None) -> models.Model:
+    """
+    Change detecting get-or-create. The incoming state is compared against the cached snapshot of the row,
+    only changed fields are written with an UPDATE and new rows are created with INSERT ... ON CONFLICT.
+    Blocking, use it from the db thread pool.
+    :param model: One of the models in NATURAL_KEYS
+    :param lookup: Natural key of the row, using attnames (i.e. g_id)
+    :param values: Fields that should always reflect the discord state
+    :param defaults: Fields only set when the row is created
+    :return: model instance
+    """
+    values = values or {}
+    upsert_stats.calls += 1
+    key = SnapshotCache.key(model, lookup)
+    snapshot = snapshots.get(key)
+
+    if snapshot is not None:
+        upsert_stats.cache_hits += 1
+    else:
+        obj = model.objects.filter(**lookup).first()
+        if obj is None:
+            obj = model(**lookup, **(defaults or {}), **values)
+            if _insert(model, obj):
+                upsert_stats.inserts += 1
+                upsert_stats.fields_written += len(values)
+                snapshots.put(obj)
+                return _from_snapshot(model, snapshots.get(key))
+            # someone else inserted it in the meantime
+            obj = model.objects.get(**lookup)
+        snapshots.put(obj)
+        snapshot = snapshots.get(key)
+
+    changed = {k: v for k, v in values.items() if snapshot[k] != v}
+    if changed:
+        model.objects.filter(pk=snapshot[model._meta.pk.attname]).update(**changed)
+        snapshot.update(changed)
+        upsert_stats.updates += 1
+        upsert_stats.fields_written += len(changed)
+    else:
+        upsert_stats.writes_skipped += 1
+    upsert_stats.fields_skipped += len(values) - len(changed)
+
+    return _from_snapshot(model, snapshot)
+
+
+def _on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        snapshots.put(instance)
+
+
+def _on_delete(sender, instance, **kwargs):
+    snapshots.evict(instance)
+
+
+for _model in NATURAL_KEYS.keys():
+    post_save.connect(_on_save, sender=_model, dispatch_uid=f'upsert_save_{_model.__name__}')
+    post_delete.connect(_on_delete, sender=_model, dispatch_uid=f'upsert_delete_{_model.__name__}')
@@ -0,0 +1,77 @@
+"""
+Wire format between the gateway process and the worker processes of the split mode.
+
+Every frame is a 4 byte big endian unsigned length followed by that many bytes of UTF-8 encoded JSON. The JSON
+is always an object with an "op" key. Frames larger than MAX_FRAME are refused.
+
+gateway -> worker:
+    {"op": "dispatch", "seq": int, "t": str, "d": object, "dispatch": bool}
+        A raw gateway event. The worker feeds d to the discord.py parser of t. If dispatch is false the worker
+        only updates its cache and fires no listeners (broadcast events are dispatched on one worker only).
+    {"op": "ping", "nonce": float}
+        Health check, answered with a pong.
+    {"op": "http_result", "id": int, "data": object}
+    {"op": "http_error", "id": int, "status": int, "reason": str, "message": object}
+        Result of an http request of the worker.
+    {"op": "invalidate", "cache": str, "g_id": int, "u_id": int}
+        A worker changed a cached row, relayed unchanged to all other workers (see worker -> gateway).
+
+worker -> gateway:
+    {"op": "hello", "worker": int, "pid": int}
+        First frame of every connection. The gateway answers by replaying the cached state (READY and the
+        guild events) with seq 0.
+    {"op": "ack", "seq": int}
+        The dispatch with this seq was parsed. The gateway keeps at most max_in_flight unacked dispatches
+        per worker.
+    {"op": "pong", "nonce": float, "backlog": int}
+    {"op": "http", "id": int, "method": str, "path": str, "url": str, "channel_id": int|null,
+     "guild_id": int|null, "kwargs": object, "form": list|null}
+        A discord REST request. The gateway runs it with its own http client, so rate limits are tracked
+        in one place. File contents in form are base64 encoded.
+    {"op": "invalidate", "cache": str, "g_id": int, "u_id": int}
+        Sent whenever the worker saved or deleted a DBGuild ("guild": prefix and snapshot), a DBUser ("user":
+        snapshot and permissions, with u_id) or a ModRole ("mod_roles": mod roles of the guild), so the other
+        workers drop their cached copy.
+"""
+import asyncio
+import json
+import struct
+from typing import Union
+
+HEADER = struct.Struct(">I")
+MAX_FRAME = 16 * 1024 * 1024
+
+
+class FrameTooLarge(Exception):
+    pass
+
+
+def encode(message: dict) -> bytes:
+    data = json.dumps(message, separators=(',', ':')).encode()
+    if len(data) > MAX_FRAME:
+        raise FrameTooLarge(f"Frame of {len(data)} bytes")
+    return HEADER.pack(len(data)) + data
+
+
+def decode(data: bytes) -> dict:
+    return json.loads(data.decode())
+
+
+async def read_message(reader: asyncio.StreamReader) -> Union[dict, None]:
+    """
+    Reads one frame.
+    :return: the message, None if the connection was closed
+    """
+    try:
+        header = await reader.readexactly(HEADER.size)
+        (length,) = HEADER.unpack(header)
+        if length > MAX_FRAME:
+            raise FrameTooLarge(f"Frame of {length} bytes")
+        return decode(await reader.readexactly(length))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+
+
+async def write_message(writer: asyncio.StreamWriter, message: dict):
+    writer.write(encode(message))
+    await writer.drain()
@@ -1,44 +1,111 @@
 # django initial stuff
 import argparse
 import os
+import sys
+
+from discord_handler.startup_profile import startup_profile
+
+if '--profile-startup' in sys.argv:
+    startup_profile.install_import_hook()
+
+with startup_profile.phase('load config'):
+    from config import load_config
+    load_config()
 
-import discord
+with startup_profile.phase('import discord.py'):
+    import discord
 
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
-from django.core.wsgi import get_wsgi_application
+with startup_profile.phase('django setup'):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+    import django
 
-# Ensure settings are read
-application = get_wsgi_application()
+    # Ensure settings are read, the bot doesn't need the wsgi application
+    django.setup()
 
-from discord_handler.CustHelp import CustHelp
-from discord_handler.cogs.cog_bot_owner import DBotOwner
-from discord_handler.helper import get_guild, get_pre
+with startup_profile.phase('import bot modules'):
+    from discord_handler.CustHelp import CustHelp
+    from discord_handler.cogs.cog_bot_owner import DBotOwner
+    from discord_handler import db_async
+    from discord_handler.analytics import analytics
+    from discord_handler.command_stats import command_stats
+    from discord_handler.error_aggregator import error_aggregator
+    from discord_handler.helper import get_pre
+    from discord_handler.metrics import MetricsMixin
+    from discord_handler.prefix_cache import prefix_cache
+    from discord_handler.split import GatewayMixin, WorkerMixin, Worker, DEFAULT_SOCKET
+    from discord_handler.cluster import ClusterMixin, ClusterSupervisor, DEFAULT_CLUSTER_SOCKET
 
 
 # discord.py stuff
-from discord.ext.commands import Bot
+from discord.ext.commands import Bot, AutoShardedBot
+from discord.http import HTTPClient, Route
 # library stuff
-import json
+import asyncio
 # local
-import os
-from db.models import Error
-import sys
 import traceback
 
+EXTENSIONS = [
+    'discord_handler.cogs.cog_all',
+    'discord_handler.cogs.cog_crawler',
+    'discord_handler.cogs.cog_listener',
+    'discord_handler.cogs.cog_mod',
+    'discord_handler.cogs.cog_owner',
+    'discord_handler.cogs.cog_setup',
+]
+
+
+class DrainMixin:
+    async def close(self):
+        await command_stats.drain()
+        await error_aggregator.drain()
+        bot_owner: 'DBotOwner' = self.get_cog('DBotOwner')
+        if bot_owner is not None:
+            await bot_owner.notifications.drain()
+        analytics.shutdown()
+        await super().close()
+
+
+class DBot(MetricsMixin, DrainMixin, Bot):
+    pass
+
+
+class ShardedDBot(ClusterMixin, MetricsMixin, DrainMixin, AutoShardedBot):
+    pass
+
+
+class GatewayBot(GatewayMixin, DBot):
+    pass
+
+
+class WorkerBot(WorkerMixin, DBot):
+    pass
+
+
+def str_to_bool(value: str) -> bool:
+    return value.lower() in ('true', '1', 'yes')
+
+
 def get_parser():
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("--split_logic_bot", help="Flag to split the bot and the logic behind",default=False,type=bool)
+    parser.add_argument("--split_logic_bot", help="Flag to split the bot and the logic behind",default=False,
+                        type=str_to_bool)
     parser.add_argument("--type", help="Which type of bot is run",type=str,
                         choices=['bot','worker'],
                         default='bot')
+    parser.add_argument("--socket", help="Unix socket between the bot and the workers, or the clusters and "
+                                         "their supervisor",type=str,default=None)
+    parser.add_argument("--worker_id", help="Id of the worker, worker 0 also runs the background tasks",type=int,
+                        default=0)
+    parser.add_argument("--clusters", help="Runs the bot as this many processes, each with a range of shards",
+                        type=int,default=0)
+    parser.add_argument("--shards", help="Total shard count in cluster mode, recommended count if not given",
+                        type=int,default=None)
+    parser.add_argument("--profile-startup", help="Prints the import and phase times of the startup and exits "
+                                                  "without connecting",action='store_true')
     return parser
 
-def main(args=None):
-    if args is None:
-        args = sys.argv[1:]
-    parser = get_parser()
-    args = parser.parse_args(args)
+def get_intents() -> discord.Intents:
     intents = discord.Intents(messages=True, guilds=True)
     """
     #use these if necessary
@@ -47,8 +114,15 @@ def main(args=None):
     intents.bans = True
     intents.members = True
     """
-    bot = Bot(command_prefix=get_pre,help_command=CustHelp(show=True),intents=intents)
-    path = os.path.dirname(os.path.realpath(__file__)) + "/"
+    return intents
+
+
+def setup_bot(bot: Bot, d: dict, extensions: list):
+    @bot.event
+    async def on_message(message):
+        if message.author.bot or not prefix_cache.may_be_command(message):
+            return
+        await bot.process_commands(message)
 
     @bot.event
     async def on_error(event, *args, **kwargs):
@@ -56,35 +130,122 @@ def main(args=None):
             g_obj = args[0].guild
         except AttributeError:
             g_obj = bot.get_guild(args[0].guild_id)
-        try:
-            g = get_guild(g_obj)
-        except AttributeError:
-            g = None
         sys_info = sys.exc_info()
-        e = Error(g=g, cmd_string=event
-                  , error_type=f'{sys_info[0]}', error=f'{sys_info[1]}', traceback=traceback.format_exc())
-        e.save()
-        bot_owner : 'DBotOwner' = bot.get_cog('DBotOwner')
+        await error_aggregator.report(g_obj.id if g_obj is not None else None, event, f'{sys_info[0]}',
+                                      f'{sys_info[1]}', traceback.format_exc())
+
+    with startup_profile.phase('load prefixes'):
+        prefix_cache.load()
+    with startup_profile.phase('load extensions'):
+        bot.add_cog(DBotOwner(bot,d,extensions))
+
+
+def run_cluster(cluster_id: int, shard_ids: list, shard_count: int, socket_path: str, d: dict):
+    """
+    Entry point of a cluster process started by the ClusterSupervisor.
+    """
+    bot = ShardedDBot(command_prefix=get_pre,help_command=CustHelp(show=True),intents=get_intents(),
+                      shard_ids=shard_ids,shard_count=shard_count,cluster_id=cluster_id,cluster_socket=socket_path)
+    setup_bot(bot,d,EXTENSIONS)
+    try:
+        bot.run(d['discord_secret'])
+    finally:
+        db_async.shutdown()
+
+
+async def get_gateway_info(token: str) -> dict:
+    """
+    Recommended shard count and identify concurrency of the bot.
+    """
+    http = HTTPClient()
+    try:
+        await http.static_login(token, bot=True)
+        return await http.request(Route('GET', '/gateway/bot'))
+    finally:
+        await http.close()
+
+
+def run_supervisor(args, d: dict):
+    loop = asyncio.get_event_loop()
+    info = loop.run_until_complete(get_gateway_info(d['discord_secret']))
+    shard_count = args.shards or info['shards']
+    max_concurrency = info.get('session_start_limit', {}).get('max_concurrency', 1)
+    supervisor = ClusterSupervisor(run_cluster, args.clusters, shard_count,
+                                   args.socket or d.get('cluster_socket', DEFAULT_CLUSTER_SOCKET), args=(d,),
+                                   max_concurrency=max_concurrency)
+    try:
+        loop.run_until_complete(supervisor.run())
+    except KeyboardInterrupt:
+        loop.run_until_complete(supervisor.close())
+
 
-        await bot_owner.send_error_notification(e, g_obj)
+def profile_startup(d: dict):
+    """
+    Runs the startup without connecting to discord, times reload_all and prints the phase and import times.
+    """
+    with startup_profile.phase('create bot'):
+        bot = DBot(command_prefix=get_pre,help_command=CustHelp(show=True),intents=get_intents())
+    setup_bot(bot,d,EXTENSIONS)
+    with startup_profile.phase('reload_all'):
+        for i in EXTENSIONS:
+            if i != 'discord_handler.cogs.cog_owner':
+                bot.reload_extension(i)
+    startup_profile.remove_import_hook()
+    print(startup_profile.report())
+    bot.loop.run_until_complete(bot.close())
+    db_async.shutdown()
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    parser = get_parser()
+    args = parser.parse_args(args)
+    intents = get_intents()
+    d = load_config()
 
+    if args.profile_startup:
+        profile_startup(d)
+        return
 
-    if sys.platform == "darwin":
-        with open(os.path.join(path,'secret_dev.json'),'r') as f:
-            d = json.load(f)
+    if args.clusters > 0:
+        run_supervisor(args, d)
+        return
+
+    socket_path = args.socket or d.get('split_socket', DEFAULT_SOCKET)
+    if args.split_logic_bot and args.type == 'bot':
+        # the gateway only forwards events, the workers run the cogs
+        bot = GatewayBot(command_prefix=get_pre,help_command=None,intents=intents,socket_path=socket_path)
+        try:
+            bot.run(d['discord_secret'])
+        finally:
+            db_async.shutdown()
+        return
+
+    if args.split_logic_bot:
+        bot = WorkerBot(command_prefix=get_pre,help_command=CustHelp(show=True),intents=intents)
     else:
-        with open(os.path.join(path,'secret.json'),'r') as f:
-            d = json.load(f)
-
-    bot.add_cog(DBotOwner(bot,d,[
-        'discord_handler.cogs.cog_all',
-        'discord_handler.cogs.cog_crawler',
-        'discord_handler.cogs.cog_listener',
-        'discord_handler.cogs.cog_mod',
-        'discord_handler.cogs.cog_owner',
-        'discord_handler.cogs.cog_setup',
-    ]))
-    bot.run(d['discord_secret'])
+        bot = DBot(command_prefix=get_pre,help_command=CustHelp(show=True),intents=intents)
+
+    extensions = list(EXTENSIONS)
+    if args.split_logic_bot and args.worker_id != 0:
+        # background tasks run on one worker only
+        extensions.remove('discord_handler.cogs.cog_crawler')
+
+    setup_bot(bot,d,extensions)
+    try:
+        if args.split_logic_bot:
+            worker = Worker(bot, socket_path, args.worker_id)
+            try:
+                bot.loop.run_until_complete(worker.run())
+            except KeyboardInterrupt:
+                pass
+            finally:
+                bot.loop.run_until_complete(bot.close())
+        else:
+            bot.run(d['discord_secret'])
+    finally:
+        db_async.shutdown()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,15 +1,11 @@
 import os
 import sys
-import json
+
+from config import load_config
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-if sys.platform == "darwin":
-    with open(os.path.join(BASE_DIR,'secret_dev.json'),'r') as f:
-        d = json.load(f)
-else:
-    with open(os.path.join(BASE_DIR,'secret.json'),'r') as f:
-        d = json.load(f)
+d = load_config()
 
 if sys.platform == "darwin":
     DATABASES = {
@@ -20,6 +16,11 @@ if sys.platform == "darwin":
             'PASSWORD': f"{d['db_pw']}",
             'HOST': 'localhost',
             'PORT': '',
+            # keep the connection of every db thread open between jobs instead of reconnecting
+            'CONN_MAX_AGE': d.get('db_conn_max_age', 600),
+            'OPTIONS': {
+                'connect_timeout': 5,
+            },
         }
     }
 else:
@@ -31,9 +32,18 @@ else:
             'PASSWORD': f"{d['db_pw']}",
             'HOST': 'localhost',
             'PORT': '',
+            # keep the connection of every db thread open between jobs instead of reconnecting
+            'CONN_MAX_AGE': d.get('db_conn_max_age', 600),
+            'OPTIONS': {
+                'connect_timeout': 5,
+            },
         }
     }
 
+# size of the db thread pool and with that the number of connections per bot process, the postgres
+# max_connections has to cover this for every process (clusters, split workers)
+DB_THREADS = d.get('db_threads', 8)
+
 INSTALLED_APPS = (
     'db',
 )